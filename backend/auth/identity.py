@@ -0,0 +1,205 @@
+# Cached resolution of a user's profile and active subscription
+import asyncio
+import fcntl
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from backend.auth.tokens import TokenClaims
+from backend.cache import SingleFlight, TTLCache
+from backend.metrics import register_cache_metrics, register_flight_metrics
+
+logger = logging.getLogger("backend.auth")
+
+IDENTITY_CACHE_TTL_SECONDS = float(os.getenv("IDENTITY_CACHE_TTL_SECONDS", "300"))
+IDENTITY_CACHE_MAX_ENTRIES = int(os.getenv("IDENTITY_CACHE_MAX_ENTRIES", "10000"))
+# Invalidated user ids, appended by whichever worker gets the hook and read
+# by all of them; empty limits invalidation to the receiving worker
+IDENTITY_INVALIDATION_PATH = os.getenv("IDENTITY_INVALIDATION_PATH", "data/identity_invalidations")
+IDENTITY_INVALIDATION_MAX_BYTES = 1024 * 1024
+# How often a worker checks the file for other workers' invalidations
+IDENTITY_INVALIDATION_POLL_SECONDS = 1.0
+
+
+class Subscription(BaseModel):
+    id: Optional[str] = None
+    plan: Optional[str] = None
+    status: str
+    end_date: Optional[str] = None
+
+
+class Identity(BaseModel):
+    username: Optional[str] = None
+    subscription: Optional[Subscription] = None
+
+
+identity_cache = TTLCache(
+    ttl=IDENTITY_CACHE_TTL_SECONDS,
+    max_entries=IDENTITY_CACHE_MAX_ENTRIES,
+    max_bytes=IDENTITY_CACHE_MAX_ENTRIES * 1024,
+    sizeof=lambda identity: 512,
+)
+identity_flight = SingleFlight()
+register_cache_metrics("identity", identity_cache)
+register_flight_metrics("identity", identity_flight)
+
+
+class InvalidationLog:
+    """
+    Append-only file of user ids whose cached identity is out of date,
+    shared by the workers on a host.
+
+    Each worker remembers the file's inode and how far it has read, and
+    ``poll`` returns the ids appended since. Past ``max_bytes`` a writer
+    replaces the file with a new one; a reader that sees the inode change
+    can't know what it missed and is told to drop everything (None).
+    """
+
+    def __init__(self, path: str, max_bytes: int = IDENTITY_INVALIDATION_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._position: Tuple[int, int] = self._end()
+
+    def _end(self) -> Tuple[int, int]:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return (0, 0)
+        return (stat.st_ino, stat.st_size)
+
+    def append(self, user_id: str) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        line = (user_id + "\n").encode()
+        # Held by writers only, so an append can't land in a file being replaced
+        fd = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                full = os.path.getsize(self.path) + len(line) > self.max_bytes
+            except OSError:
+                full = False
+            if full:
+                fresh = f"{self.path}.{os.getpid()}"
+                with open(fresh, "wb") as f:
+                    f.write(line)
+                os.replace(fresh, self.path)
+            else:
+                with open(self.path, "ab") as f:
+                    f.write(line)
+        finally:
+            os.close(fd)
+
+    def poll(self) -> Optional[List[str]]:
+        inode, offset = self._position
+        try:
+            with open(self.path, "rb") as f:
+                stat = os.fstat(f.fileno())
+                if stat.st_ino != inode:
+                    if inode:
+                        # Replaced since the last poll
+                        self._position = (stat.st_ino, stat.st_size)
+                        return None
+                    # Created since the last poll: all of it is new
+                    inode, offset = stat.st_ino, 0
+                if stat.st_size <= offset:
+                    self._position = (inode, offset)
+                    return []
+                f.seek(offset)
+                data = f.read(stat.st_size - offset)
+        except OSError:
+            return []
+        # Only whole lines; a partial one is read on the next poll
+        complete = data.rfind(b"\n") + 1
+        self._position = (inode, offset + complete)
+        return data[:complete].decode(errors="replace").split()
+
+
+invalidation_log = InvalidationLog(IDENTITY_INVALIDATION_PATH) if IDENTITY_INVALIDATION_PATH else None
+_next_poll = 0.0
+
+
+def invalidate_identity(user_id: str) -> None:
+    """
+    Forget a user's cached profile and subscription on every worker, so a
+    plan change takes effect on the next request instead of after
+    IDENTITY_CACHE_TTL_SECONDS.
+
+    The app never writes subscriptions itself; whatever does (a billing
+    webhook, a Supabase database webhook on user_subscriptions or
+    user_profiles, an operator) calls POST /admin/identities/{user_id}/invalidate
+    with the admin token, which lands here.
+    """
+    identity_cache.pop(user_id)
+    if invalidation_log is not None:
+        invalidation_log.append(user_id)
+
+
+def _apply_invalidations() -> None:
+    global _next_poll
+    now = time.monotonic()
+    if invalidation_log is None or now < _next_poll:
+        return
+    _next_poll = now + IDENTITY_INVALIDATION_POLL_SECONDS
+    user_ids = invalidation_log.poll()
+    if user_ids is None:
+        identity_cache.clear()
+        return
+    for user_id in user_ids:
+        identity_cache.pop(user_id)
+
+
+def default_username(auth_user: TokenClaims) -> str:
+    if "username" in auth_user.user_metadata:
+        return auth_user.user_metadata["username"]
+    return auth_user.email.split('@')[0] if auth_user.email else f"user_{auth_user.id[:8]}"
+
+
+def _fetch_identity(supabase_client, auth_user: TokenClaims) -> Identity:
+    """
+    Upsert the profile and read it back with the active subscription.
+
+    Uses the resolve_user_identity database function (see supabase_schema.sql)
+    so the whole lookup is a single round trip and first logins don't race
+    on select-then-insert.
+    """
+    response = supabase_client.rpc('resolve_user_identity', {
+        'p_user_id': auth_user.id,
+        'p_email': auth_user.email,
+        'p_username': default_username(auth_user),
+    }).execute()
+    data: Dict[str, Any] = response.data or {}
+    return Identity(
+        username=data.get('username'),
+        subscription=data.get('subscription'),
+    )
+
+
+async def resolve_identity(supabase_client, auth_user: TokenClaims) -> Identity:
+    """
+    Return the user's profile and subscription, from cache when warm.
+
+    Lookup failures degrade to an identity without username or subscription,
+    which is not cached so the next request tries again. Neither is a result
+    without a profile, so the next request retries creating it.
+    """
+    _apply_invalidations()
+    cached = identity_cache.get(auth_user.id)
+    if cached is not None:
+        return cached
+
+    async def load() -> Identity:
+        try:
+            identity = await asyncio.to_thread(_fetch_identity, supabase_client, auth_user)
+        except Exception as e:
+            logger.warning("Identity lookup failed", extra={"error": str(e)})
+            return Identity()
+        if identity.username is None:
+            logger.warning("Identity lookup returned no profile", extra={"has_subscription": identity.subscription is not None})
+            return identity
+        identity_cache.set(auth_user.id, identity)
+        return identity
+
+    return await identity_flight.do(auth_user.id, load)
@@ -1,64 +1,102 @@
+import asyncio
 from fastapi import HTTPException, Depends, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from supabase import create_client, Client
+import httpx
+from gotrue.http_clients import SyncClient as GoTrueHttpClient
+from supabase import Client
+from supabase.lib.client_options import ClientOptions
+from supabase._sync.auth_client import SyncSupabaseAuthClient
+import logging
 import os
 from typing import Optional
 from pydantic import BaseModel
+from backend.auth.tokens import (
+    TokenClaims,
+    remember_token,
+    token_cache_key,
+    verified_tokens,
+    verify_token,
+)
+from backend.auth.identity import resolve_identity
+from backend.http_pools import pool_timeout, sync_transport
+from backend.metrics import STAGE_SECONDS, timed
+from backend.scheduler import Caller, current_caller, tier_for_plan
 
-# Enhanced Supabase configuration logging
-print("=== SUPABASE AUTH CONFIGURATION DEBUG ===")
-supabase_url = os.getenv("SUPABASE_URL")
-supabase_service_key = os.getenv("SUPABASE_SERVICE_KEY")
+logger = logging.getLogger("backend.auth")
 
-print(f"SUPABASE_URL: {'SET' if supabase_url else 'NOT SET'}")
-if supabase_url:
-    print(f"SUPABASE_URL value: {supabase_url}")
-    print(f"SUPABASE_URL is placeholder: {'YES' if 'your_supabase_project_url' in supabase_url else 'NO'}")
+class PooledSupabaseClient(Client):
+    """
+    supabase-py client whose auth and PostgREST calls share one configured
+    connection pool instead of each building default httpx clients
+    """
+
+    def __init__(self, supabase_url: str, supabase_key: str, transport: httpx.BaseTransport):
+        self._transport = transport
+        super().__init__(supabase_url, supabase_key, ClientOptions(postgrest_client_timeout=pool_timeout()))
+
+    def _init_supabase_auth_client(self, auth_url: str, client_options: ClientOptions) -> SyncSupabaseAuthClient:
+        return SyncSupabaseAuthClient(
+            url=auth_url,
+            auto_refresh_token=client_options.auto_refresh_token,
+            persist_session=client_options.persist_session,
+            storage=client_options.storage,
+            headers=client_options.headers,
+            flow_type=client_options.flow_type,
+            http_client=GoTrueHttpClient(transport=self._transport, timeout=pool_timeout(), follow_redirects=True),
+        )
+
+    @property
+    def postgrest(self):
+        if self._postgrest is None:
+            postgrest = super().postgrest
+            session = postgrest.session
+            postgrest.session = type(session)(
+                base_url=session.base_url,
+                headers=session.headers,
+                timeout=session.timeout,
+                transport=self._transport,
+            )
+            session.close()
+        return self._postgrest
 
-print(f"SUPABASE_SERVICE_KEY: {'SET' if supabase_service_key else 'NOT SET'}")
-if supabase_service_key:
-    print(f"SUPABASE_SERVICE_KEY length: {len(supabase_service_key)}")
-    print(f"SUPABASE_SERVICE_KEY starts with: {supabase_service_key[:10]}...")
-    print(f"SUPABASE_SERVICE_KEY is placeholder: {'YES' if 'your_supabase_service_key' in supabase_service_key else 'NO'}")
+_supabase: Optional[Client] = None
+_supabase_initialized = False
 
-# Initialize Supabase client with detailed logging
-if not supabase_url or not supabase_service_key:
-    print("WARNING: Supabase environment variables not set. Authentication will fail.")
-    print(f"Missing SUPABASE_URL: {not supabase_url}")
-    print(f"Missing SUPABASE_SERVICE_KEY: {not supabase_service_key}")
-    supabase: Optional[Client] = None
-else:
+def get_supabase() -> Optional[Client]:
+    """
+    The shared Supabase client, created on first use so importing this
+    module does no network I/O. None when unconfigured or creation failed.
+    """
+    global _supabase, _supabase_initialized
+    if _supabase_initialized:
+        return _supabase
+    _supabase_initialized = True
+    
+    supabase_url = os.getenv("SUPABASE_URL")
+    supabase_service_key = os.getenv("SUPABASE_SERVICE_KEY")
+    if not supabase_url or not supabase_service_key:
+        logger.warning(
+            "Supabase environment variables not set; authentication will fail",
+            extra={"supabase_url_set": bool(supabase_url), "supabase_service_key_set": bool(supabase_service_key)},
+        )
+        return None
     try:
-        print("Attempting to create Supabase client...")
-        print(f"URL: {supabase_url}")
-        print(f"Key length: {len(supabase_service_key)}")
-        print(f"Key starts with: {supabase_service_key[:20]}...")
-        
-        # Try to create client with minimal parameters
-        import os
-        # Clear any proxy environment variables that might interfere
-        if 'HTTP_PROXY' in os.environ:
-            del os.environ['HTTP_PROXY']
-        if 'HTTPS_PROXY' in os.environ:
-            del os.environ['HTTPS_PROXY']
-            
-        supabase: Client = create_client(supabase_url, supabase_service_key)
-        print("SUCCESS: Supabase client created successfully")
-        
-        # Test the connection
-        try:
-            # Try a simple query to test the connection
-            test_response = supabase.table('user_profiles').select('count', count='exact').limit(1).execute()
-            print("SUCCESS: Supabase connection test passed")
-        except Exception as test_error:
-            print(f"WARNING: Supabase connection test failed: {test_error}")
-            print("This might be due to missing tables or incorrect permissions")
-            
+        _supabase = PooledSupabaseClient(supabase_url, supabase_service_key, sync_transport("supabase"))
+        logger.info("Supabase client created")
     except Exception as client_error:
-        print(f"ERROR: Failed to create Supabase client: {client_error}")
-        supabase = None
+        logger.error("Failed to create Supabase client", extra={"error": str(client_error)})
+        _supabase = None
+    return _supabase
 
-print("=========================================")
+def check_supabase() -> None:
+    """
+    Readiness probe: a cheap query that fails if Supabase is unreachable
+    or the schema/permissions are wrong. Blocking; run it in a thread.
+    """
+    client = get_supabase()
+    if client is None:
+        raise RuntimeError("Supabase client not configured")
+    client.table('user_profiles').select('id').limit(1).execute()
 
 security = HTTPBearer()
 
@@ -66,68 +104,16 @@ class User(BaseModel):
     id: str
     email: str
     username: Optional[str] = None
+    plan: Optional[str] = None
 
-async def create_user_profile(user, supabase_client) -> User:
-    """
-    Create a new user profile in the database using service role access
-    """
-    try:
-        print(f"Creating profile for user: {user.id}")
-        
-        # Extract username from user metadata or generate one
-        username = None
-        if user.user_metadata and 'username' in user.user_metadata:
-            username = user.user_metadata['username']
-        else:
-            # Generate username from email
-            username = user.email.split('@')[0] if user.email else f"user_{user.id[:8]}"
-        
-        # Create profile using service role (bypasses RLS)
-        profile_data = {
-            'id': user.id,
-            'username': username,
-            'email': user.email,
-            'is_active': True
-        }
-        
-        print(f"Inserting profile data: {profile_data}")
-        
-        profile_response = supabase_client.table('user_profiles').insert(profile_data).execute()
-        
-        if profile_response.data:
-            print("SUCCESS: User profile created")
-            return User(
-                id=user.id,
-                email=user.email,
-                username=username
-            )
-        else:
-            print("WARNING: Profile creation returned no data")
-            return User(
-                id=user.id,
-                email=user.email,
-                username=username
-            )
-            
-    except Exception as e:
-        print(f"ERROR: Failed to create user profile: {e}")
-        print(f"Error type: {type(e).__name__}")
-        # Return user without profile if creation fails
-        return User(
-            id=user.id,
-            email=user.email,
-            username=None
-        )
-
+@timed(STAGE_SECONDS, stage="get_current_user")
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> User:
     """
     Validate JWT token and return user information
     """
-    print(f"=== AUTHENTICATION DEBUG ===")
-    print(f"Supabase client available: {'YES' if supabase else 'NO'}")
-    
+    supabase = get_supabase()
     if not supabase:
-        print("ERROR: Supabase client not available")
+        logger.error("Supabase client not available")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Authentication service not configured"
@@ -135,83 +121,64 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     
     try:
         token = credentials.credentials
-        print(f"Token received: {'YES' if token else 'NO'}")
-        print(f"Token length: {len(token) if token else 0}")
-        print(f"Token starts with: {token[:10] if token else 'N/A'}...")
-        
-        # Verify token with Supabase
-        print("Attempting to verify token with Supabase...")
-        user_response = supabase.auth.get_user(token)
-        
-        if not user_response.user:
-            print("ERROR: No user found in response")
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid authentication credentials",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
-        
-        print(f"SUCCESS: User authenticated - ID: {user_response.user.id}")
-        print(f"User email: {user_response.user.email}")
-        
-        # Get user profile from database - create if doesn't exist
-        try:
-            print("Attempting to fetch user profile...")
-            profile_response = supabase.table('user_profiles').select('*').eq('id', user_response.user.id).single().execute()
-            
-            if profile_response.data:
-                print("SUCCESS: User profile found")
-                return User(
+        # Verify token locally, falling back to Supabase only when we can't
+        auth_user = verified_tokens.get(token_cache_key(token))
+        if auth_user is None:
+            auth_user = await verify_token(token)
+            if auth_user is None:
+                logger.debug("Verifying token with Supabase")
+                # In a thread so the request deadline can still cut it short
+                user_response = await asyncio.to_thread(supabase.auth.get_user, token)
+                
+                if not user_response.user:
+                    raise HTTPException(
+                        status_code=status.HTTP_401_UNAUTHORIZED,
+                        detail="Invalid authentication credentials",
+                        headers={"WWW-Authenticate": "Bearer"},
+                    )
+                auth_user = TokenClaims(
                     id=user_response.user.id,
                     email=user_response.user.email,
-                    username=profile_response.data.get('username')
+                    user_metadata=user_response.user.user_metadata or {},
                 )
-            else:
-                # Profile doesn't exist - create it
-                print("No profile found - creating new profile...")
-                return await create_user_profile(user_response.user, supabase)
-                
-        except Exception as profile_error:
-            print(f"Profile fetch error: {profile_error}")
-            # Profile doesn't exist - create it
-            print("Creating new profile due to fetch error...")
-            return await create_user_profile(user_response.user, supabase)
+            remember_token(token, auth_user)
+        
+        # Profile (created on first login) and subscription, cached per user
+        identity = await resolve_identity(supabase, auth_user)
+        plan = identity.subscription.plan if identity.subscription else None
+        # Groq calls made for this request are scheduled by plan
+        current_caller.set(Caller(user_id=auth_user.id, tier=tier_for_plan(plan)))
+        return User(
+            id=auth_user.id,
+            email=auth_user.email,
+            username=identity.username,
+            plan=plan
+        )
         
     except Exception as e:
-        print(f"Authentication error: {e}")
-        print(f"Error type: {type(e).__name__}")
+        logger.info("Authentication failed", extra={"error_type": type(e).__name__})
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid authentication credentials",
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+@timed(STAGE_SECONDS, stage="require_subscription")
 async def require_subscription(user: User = Depends(get_current_user)) -> User:
     """
     Check if user has active subscription for premium features
     """
+    supabase = get_supabase()
     if not supabase:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Authentication service not configured"
         )
     
-    try:
-        # Check for active subscription - handle missing table gracefully
-        try:
-            subscription_response = supabase.table('user_subscriptions').select('*').eq('user_id', user.id).eq('status', 'active').single().execute()
-            
-            if subscription_response.data:
-                return user
-        except Exception as subscription_error:
-            print(f"Subscription table error (likely missing): {subscription_error}")
-            # Allow access if subscription table doesn't exist (for testing)
-            return user
-        
-        # For now, allow access without subscription (for testing)
-        return user
-        
-    except Exception as e:
-        print(f"Subscription check error: {e}")
-        # Allow access for testing
+    # Usually served from the cache warmed by get_current_user
+    identity = await resolve_identity(supabase, TokenClaims(id=user.id, email=user.email))
+    if identity.subscription:
         return user
+    
+    # For now, allow access without subscription (for testing)
+    return user
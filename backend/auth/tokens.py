@@ -0,0 +1,228 @@
+# Local verification of Supabase access tokens
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+from pydantic import BaseModel
+
+from backend.cache import SingleFlight, TTLCache
+from backend.http_pools import async_transport, pool_timeout
+from backend.metrics import register_cache_metrics
+
+try:
+    # Optional: only needed for asymmetric (JWKS) signing keys
+    import jwt as pyjwt
+except ImportError:
+    pyjwt = None
+
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")
+SUPABASE_JWT_AUDIENCE = os.getenv("SUPABASE_JWT_AUDIENCE", "authenticated")
+SUPABASE_JWKS_URL = os.getenv("SUPABASE_JWKS_URL") or (
+    f"{os.getenv('SUPABASE_URL').rstrip('/')}/auth/v1/.well-known/jwks.json"
+    if os.getenv("SUPABASE_URL")
+    else None
+)
+
+# A token signed with a key we don't have triggers at most one JWKS fetch per interval
+JWKS_MIN_REFRESH_SECONDS = 60
+# Verified tokens are remembered for at most this long, and never past their exp
+TOKEN_CACHE_TTL_SECONDS = float(os.getenv("TOKEN_CACHE_TTL_SECONDS", "60"))
+TOKEN_CACHE_MAX_ENTRIES = int(os.getenv("TOKEN_CACHE_MAX_ENTRIES", "10000"))
+CLOCK_SKEW_SECONDS = 30
+
+ASYMMETRIC_ALGORITHMS = {"RS256", "ES256", "EdDSA"}
+
+logger = logging.getLogger("backend.auth")
+
+
+class InvalidTokenError(Exception):
+    """
+    Raised when a token was checked locally and is not acceptable
+    """
+
+
+class UnknownSigningKey(Exception):
+    """
+    Raised when an asymmetric token names a key that hasn't been fetched
+    """
+
+
+class TokenClaims(BaseModel):
+    id: str
+    email: Optional[str] = None
+    user_metadata: Dict[str, Any] = {}
+
+
+verified_tokens = TTLCache(
+    ttl=TOKEN_CACHE_TTL_SECONDS,
+    max_entries=TOKEN_CACHE_MAX_ENTRIES,
+    max_bytes=TOKEN_CACHE_MAX_ENTRIES * 1024,
+    sizeof=lambda claims: 512,
+)
+register_cache_metrics("verified_tokens", verified_tokens)
+
+# Asymmetric signing keys by key id, fetched from SUPABASE_JWKS_URL on the
+# event loop (at startup, then when a token names an unknown key)
+_signing_keys: Dict[str, Any] = {}
+_jwks_fetched_at: Optional[float] = None
+_jwks_flight = SingleFlight()
+_jwks_http: Optional[httpx.AsyncClient] = None
+
+
+def _b64url_decode(segment: str) -> bytes:
+    return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+
+
+def token_cache_key(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def _split(token: str):
+    try:
+        header_b64, payload_b64, signature_b64 = token.split(".")
+        header = json.loads(_b64url_decode(header_b64))
+        payload = json.loads(_b64url_decode(payload_b64))
+        signature = _b64url_decode(signature_b64)
+    except (ValueError, TypeError) as e:
+        raise InvalidTokenError(f"Malformed token: {e}")
+    return header_b64, payload_b64, header, payload, signature
+
+
+def _check_claims(payload: Dict[str, Any]) -> TokenClaims:
+    exp = payload.get("exp")
+    if not isinstance(exp, (int, float)) or exp + CLOCK_SKEW_SECONDS < time.time():
+        raise InvalidTokenError("Token expired")
+
+    audience = payload.get("aud")
+    audiences = audience if isinstance(audience, list) else [audience]
+    if SUPABASE_JWT_AUDIENCE not in audiences:
+        raise InvalidTokenError("Token audience mismatch")
+
+    if not payload.get("sub"):
+        raise InvalidTokenError("Token has no subject")
+
+    return TokenClaims(
+        id=payload["sub"],
+        email=payload.get("email"),
+        user_metadata=payload.get("user_metadata") or {},
+    )
+
+
+def _verify_asymmetric(token: str, header: Dict[str, Any], algorithm: str) -> Optional[Dict[str, Any]]:
+    if pyjwt is None or not SUPABASE_JWKS_URL:
+        return None
+    signing_key = _signing_keys.get(header.get("kid"))
+    if signing_key is None:
+        raise UnknownSigningKey(header.get("kid"))
+    try:
+        # Claims are checked by _check_claims so both key types behave the same
+        return pyjwt.decode(
+            token,
+            signing_key,
+            algorithms=[algorithm],
+            options={"verify_exp": False, "verify_aud": False},
+        )
+    except pyjwt.InvalidTokenError as e:
+        raise InvalidTokenError(str(e))
+
+
+async def refresh_signing_keys() -> None:
+    """
+    Fetch the project JWKS, unless it was fetched (or tried) within
+    JWKS_MIN_REFRESH_SECONDS; concurrent callers share one fetch
+    """
+    if pyjwt is None or not SUPABASE_JWKS_URL:
+        return
+    if _jwks_fetched_at is not None and time.monotonic() - _jwks_fetched_at < JWKS_MIN_REFRESH_SECONDS:
+        return
+    await _jwks_flight.do("jwks", _fetch_signing_keys)
+
+
+async def _fetch_signing_keys() -> None:
+    global _jwks_fetched_at, _jwks_http, _signing_keys
+    if _jwks_http is None:
+        _jwks_http = httpx.AsyncClient(transport=async_transport("supabase_jwks"), timeout=pool_timeout())
+    try:
+        response = await _jwks_http.get(SUPABASE_JWKS_URL)
+        response.raise_for_status()
+        jwk_set = pyjwt.PyJWKSet.from_dict(response.json())
+    except (httpx.HTTPError, ValueError, pyjwt.PyJWTError) as e:
+        logger.warning("JWKS fetch failed", extra={"error_type": type(e).__name__, "error": str(e)})
+        return
+    finally:
+        # Set when the fetch ends, so callers arriving during it join it
+        # instead of skipping it, and a failing endpoint isn't retried
+        # more often than a working one
+        _jwks_fetched_at = time.monotonic()
+    _signing_keys = {key.key_id: key.key for key in jwk_set.keys if key.key_id}
+    logger.info("JWKS loaded", extra={"keys": len(_signing_keys)})
+
+
+def verify_token_locally(token: str) -> Optional[TokenClaims]:
+    """
+    Verify a Supabase access token without a network call.
+
+    Checks the signature (HS256 against SUPABASE_JWT_SECRET, or an asymmetric
+    key from the project JWKS when PyJWT is installed), expiry and audience.
+    Returns None when the token cannot be checked locally so the caller can
+    fall back to asking Supabase; raises InvalidTokenError for bad tokens
+    and UnknownSigningKey when its key needs fetching first.
+    """
+    header_b64, payload_b64, header, payload, signature = _split(token)
+    algorithm = header.get("alg")
+
+    if algorithm == "HS256":
+        if not SUPABASE_JWT_SECRET:
+            return None
+        expected = hmac.new(
+            SUPABASE_JWT_SECRET.encode(),
+            f"{header_b64}.{payload_b64}".encode(),
+            hashlib.sha256,
+        ).digest()
+        if not hmac.compare_digest(expected, signature):
+            raise InvalidTokenError("Bad token signature")
+    elif algorithm in ASYMMETRIC_ALGORITHMS:
+        verified_payload = _verify_asymmetric(token, header, algorithm)
+        if verified_payload is None:
+            return None
+        payload = verified_payload
+    else:
+        raise InvalidTokenError(f"Unsupported token algorithm: {algorithm}")
+
+    return _check_claims(payload)
+
+
+async def verify_token(token: str) -> Optional[TokenClaims]:
+    """
+    verify_token_locally, fetching the JWKS without blocking the event loop
+    when the token is signed with a key not loaded yet (e.g. after rotation)
+    """
+    try:
+        return verify_token_locally(token)
+    except UnknownSigningKey:
+        await refresh_signing_keys()
+    try:
+        return verify_token_locally(token)
+    except UnknownSigningKey:
+        return None
+
+
+def remember_token(token: str, claims: TokenClaims) -> None:
+    """
+    Cache verified claims until the token expires or the cache TTL passes
+    """
+    try:
+        exp = _split(token)[3].get("exp")
+    except InvalidTokenError:
+        return
+    if not isinstance(exp, (int, float)):
+        return
+    ttl = min(TOKEN_CACHE_TTL_SECONDS, exp - time.time())
+    if ttl > 0:
+        verified_tokens.set(token_cache_key(token), claims, ttl=ttl)
@@ -0,0 +1,181 @@
+# In-process caching for LLM results
+import asyncio
+import os
+import string
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+DEFINITION_CACHE_TTL_SECONDS = float(os.getenv("DEFINITION_CACHE_TTL_SECONDS", "86400"))
+DEFINITION_CACHE_MAX_ENTRIES = int(os.getenv("DEFINITION_CACHE_MAX_ENTRIES", "10000"))
+DEFINITION_CACHE_MAX_BYTES = int(os.getenv("DEFINITION_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+
+# Stripped from the ends of input; punctuation inside ("don't", "x-ray") is kept
+_EDGE_CHARACTERS = string.punctuation + " \u2018\u2019\u201c\u201d\u00ab\u00bb\u2026\u2013\u2014\u00a1\u00bf"
+
+
+def normalize_text(text: str) -> str:
+    """
+    Canonical form of user input used for cache keys: Unicode-compatibility
+    normalized, casefolded, whitespace collapsed and surrounding punctuation
+    removed (unless nothing else is left)
+    """
+    collapsed = " ".join(unicodedata.normalize("NFKC", text).split()).casefold()
+    return collapsed.strip(_EDGE_CHARACTERS) or collapsed
+
+
+def definition_cache_key(text: str, model: str, temperature: float) -> Tuple[str, str, float]:
+    return (normalize_text(text), model, temperature)
+
+
+class TTLCache:
+    """
+    Bounded LRU cache with per-entry TTL.
+
+    Entries are evicted least-recently-used first once either the entry
+    count or the summed entry size exceeds its limit. Expired entries miss
+    on ``get`` but stay available to ``get_stale`` until they are replaced
+    or evicted. ``sizeof`` returns the size charged for a value; it is
+    called once, when the value is stored.
+    """
+
+    def __init__(
+        self,
+        ttl: float,
+        max_entries: int,
+        max_bytes: int,
+        sizeof: Callable[[Any], int] = lambda value: len(repr(value)),
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof
+        # key -> (expires_at, size, value)
+        self._entries: "OrderedDict[Hashable, Tuple[float, int, Any]]" = OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, _, value = entry
+        if expires_at <= time.monotonic():
+            # Left in place (until evicted or replaced) for get_stale
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def get_stale(self, key: Hashable) -> Optional[Any]:
+        """
+        The value stored under key even if it has expired, for serving
+        while the source of fresh values is failing
+        """
+        entry = self._entries.get(key)
+        return None if entry is None else entry[2]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """
+        Store value under key; ttl overrides the cache-wide TTL for this entry
+        """
+        size = self._sizeof(value)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), size, value)
+        self.current_bytes += size
+        while len(self._entries) > self.max_entries or self.current_bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def pop(self, key: Hashable) -> None:
+        if key in self._entries:
+            self._remove(key)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.current_bytes = 0
+
+    def _remove(self, key: Hashable) -> None:
+        _, size, _ = self._entries.pop(key)
+        self.current_bytes -= size
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.current_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key into one execution.
+
+    The first caller for a key starts the work as a task; callers arriving
+    while it runs await the same task and receive its result or exception.
+    Waiters are shielded, so cancelling any one of them (including the one
+    that started the work) leaves the shared call running for the others;
+    once the last waiter is cancelled nobody wants the result, and the
+    call is cancelled too.
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[Hashable, "asyncio.Task"] = {}
+        self._waiters: Dict["asyncio.Task", int] = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.abandoned = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._in_flight.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(fn())
+            self._in_flight[key] = task
+            self._waiters[task] = 0
+            task.add_done_callback(lambda done, key=key: self._finish(key, done))
+        else:
+            self.coalesced += 1
+        self._waiters[task] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if task in self._waiters:
+                self._waiters[task] -= 1
+                if self._waiters[task] == 0 and not task.done():
+                    self.abandoned += 1
+                    task.cancel()
+            raise
+
+    def _finish(self, key: Hashable, task: "asyncio.Task") -> None:
+        self._waiters.pop(task, None)
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        # Mark the exception as retrieved in case every waiter went away
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": len(self._in_flight),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "abandoned": self.abandoned,
+        }
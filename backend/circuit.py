@@ -0,0 +1,206 @@
+# Circuit breaker that fails fast while an upstream is unhealthy
+import logging
+import math
+import os
+import time
+from collections import deque
+from typing import Deque, Optional, Tuple
+
+from fastapi import HTTPException, status
+
+from backend.metrics import CallbackMetric, Counter
+
+logger = logging.getLogger("backend.circuit")
+
+CIRCUIT_BREAKER_ENABLED = os.getenv("CIRCUIT_BREAKER_ENABLED", "true").lower() in ("1", "true", "yes")
+# Calls considered when deciding to trip, and how many are needed first
+CIRCUIT_WINDOW_SECONDS = float(os.getenv("CIRCUIT_WINDOW_SECONDS", "30"))
+CIRCUIT_MIN_CALLS = int(os.getenv("CIRCUIT_MIN_CALLS", "10"))
+# Trip when this share of calls in the window failed, or ran longer than CIRCUIT_SLOW_CALL_SECONDS
+CIRCUIT_FAILURE_RATIO = float(os.getenv("CIRCUIT_FAILURE_RATIO", "0.5"))
+CIRCUIT_SLOW_CALL_SECONDS = float(os.getenv("CIRCUIT_SLOW_CALL_SECONDS", "8"))
+CIRCUIT_SLOW_RATIO = float(os.getenv("CIRCUIT_SLOW_RATIO", "0.8"))
+# How long to fail fast before letting probe calls through
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", "15"))
+# Probe calls that must succeed in a row to close the circuit again
+CIRCUIT_HALF_OPEN_PROBES = int(os.getenv("CIRCUIT_HALF_OPEN_PROBES", "3"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+CIRCUIT_TRANSITIONS = Counter(
+    "circuit_transitions_total",
+    "Circuit breaker state changes by circuit and new state",
+    ["circuit", "state"],
+)
+CIRCUIT_REJECTIONS = Counter(
+    "circuit_rejections_total",
+    "Calls failed fast because the circuit was open",
+    ["circuit"],
+)
+
+
+class CircuitOpen(HTTPException):
+    """
+    503 raised instead of calling an upstream the breaker considers down
+    """
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"{name} is temporarily unavailable, please retry shortly",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+
+class CircuitBreaker:
+    """
+    Closed / open / half-open breaker driven by failure rate and latency.
+
+    While closed, outcomes of the last ``window`` seconds are kept; once
+    there are at least ``min_calls`` of them and either the failure ratio
+    or the slow-call ratio crosses its threshold, the circuit opens and
+    ``begin`` raises ``CircuitOpen`` without touching the upstream. After
+    ``open_seconds`` it goes half-open and admits one probe call at a time:
+    ``probes`` successes in a row close it, any failure reopens it.
+
+    Callers wrap each upstream call in ``begin`` and then exactly one of
+    ``succeeded``, ``failed`` or ``abandoned`` (for calls that end without
+    saying anything about upstream health, such as client cancellation).
+    Each pair must cover a single upstream request: a client that retries
+    internally turns failures into one slow success, or one failure after
+    several, and the breaker trips late or not at all.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        enabled: bool = CIRCUIT_BREAKER_ENABLED,
+        window: float = CIRCUIT_WINDOW_SECONDS,
+        min_calls: int = CIRCUIT_MIN_CALLS,
+        failure_ratio: float = CIRCUIT_FAILURE_RATIO,
+        slow_call_seconds: float = CIRCUIT_SLOW_CALL_SECONDS,
+        slow_ratio: float = CIRCUIT_SLOW_RATIO,
+        open_seconds: float = CIRCUIT_OPEN_SECONDS,
+        probes: int = CIRCUIT_HALF_OPEN_PROBES,
+    ):
+        self.name = name
+        self.enabled = enabled
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_ratio = slow_ratio
+        self.open_seconds = open_seconds
+        self.probes = probes
+        self.state = CLOSED
+        # (finished_at, failed, slow) for calls made while closed
+        self._outcomes: Deque[Tuple[float, bool, bool]] = deque()
+        self._failures = 0
+        self._slow = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._probe_successes = 0
+
+    # State
+
+    def _transition(self, state: str) -> None:
+        previous, self.state = self.state, state
+        self._outcomes.clear()
+        self._failures = self._slow = 0
+        self._probe_successes = 0
+        self._probe_in_flight = False
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        CIRCUIT_TRANSITIONS.inc(circuit=self.name, state=state)
+        log = logger.info if state == CLOSED else logger.warning
+        log("Circuit state changed", extra={"circuit": self.name, "from": previous, "to": state})
+
+    def _retry_after(self) -> float:
+        return self._opened_at + self.open_seconds - time.monotonic()
+
+    def allows_calls(self) -> bool:
+        """
+        Whether a call started now would be let through
+        """
+        if not self.enabled or self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            return self._retry_after() <= 0
+        return not self._probe_in_flight
+
+    # Call lifecycle
+
+    def begin(self) -> None:
+        if not self.enabled:
+            return
+        if self.state == OPEN:
+            retry_after = self._retry_after()
+            if retry_after > 0:
+                CIRCUIT_REJECTIONS.inc(circuit=self.name)
+                raise CircuitOpen(self.name, retry_after)
+            self._transition(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self._probe_in_flight:
+                CIRCUIT_REJECTIONS.inc(circuit=self.name)
+                raise CircuitOpen(self.name, 1)
+            self._probe_in_flight = True
+
+    def succeeded(self, seconds: float) -> None:
+        if not self.enabled:
+            return
+        if self.state == HALF_OPEN:
+            self._probe_in_flight = False
+            self._probe_successes += 1
+            if self._probe_successes >= self.probes:
+                self._transition(CLOSED)
+            return
+        self._record(failed=False, slow=seconds >= self.slow_call_seconds)
+
+    def failed(self) -> None:
+        if not self.enabled:
+            return
+        if self.state == HALF_OPEN:
+            self._transition(OPEN)
+            return
+        self._record(failed=True, slow=False)
+
+    def abandoned(self) -> None:
+        if self.state == HALF_OPEN:
+            self._probe_in_flight = False
+
+    def _record(self, failed: bool, slow: bool) -> None:
+        if self.state != CLOSED:
+            # A call admitted before the circuit opened
+            return
+        now = time.monotonic()
+        self._outcomes.append((now, failed, slow))
+        self._failures += failed
+        self._slow += slow
+        while self._outcomes and self._outcomes[0][0] < now - self.window:
+            _, old_failed, old_slow = self._outcomes.popleft()
+            self._failures -= old_failed
+            self._slow -= old_slow
+        calls = len(self._outcomes)
+        if calls >= self.min_calls and (
+            self._failures >= self.failure_ratio * calls or self._slow >= self.slow_ratio * calls
+        ):
+            self._transition(OPEN)
+
+    def report(self) -> dict:
+        report = {"state": self.state}
+        if self.state == OPEN:
+            report["retry_after_seconds"] = round(max(0.0, self._retry_after()), 1)
+        return report
+
+
+def register_circuit_metrics(breaker: CircuitBreaker) -> None:
+    CallbackMetric(
+        "circuit_state",
+        "Circuit breaker state: 0 closed, 1 half-open, 2 open",
+        "gauge",
+        lambda: [((breaker.name,), _STATE_VALUES[breaker.state])],
+        ["circuit"],
+    )
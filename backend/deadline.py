@@ -0,0 +1,170 @@
+# Per-request deadlines, and cancelling work for clients that have gone away
+import asyncio
+import contextvars
+import json
+import logging
+from typing import Callable, Optional
+
+from backend.metrics import Counter
+
+logger = logging.getLogger("backend.deadline")
+
+# Sent by the frontend: how long (seconds) it will wait before giving up
+CLIENT_TIMEOUT_HEADER = b"x-request-timeout"
+# Answer a little before the client's own timeout fires
+CLIENT_TIMEOUT_MARGIN_SECONDS = 0.5
+
+REQUESTS_ABANDONED = Counter(
+    "requests_abandoned_total",
+    "Requests stopped before a response started: client disconnect or deadline",
+    ["reason"],
+)
+
+
+class RequestScope:
+    """
+    Deadline (event loop time) of the current request, and why its work was
+    cancelled if it was
+    """
+
+    def __init__(self, deadline: float):
+        self.deadline = deadline
+        self.cancel_reason: Optional[str] = None
+
+
+current_request: contextvars.ContextVar[Optional[RequestScope]] = contextvars.ContextVar(
+    "current_request", default=None
+)
+
+
+def remaining_time(budget: float) -> float:
+    """
+    ``budget`` capped by what is left of the current request's deadline
+    """
+    scope = current_request.get()
+    if scope is None:
+        return budget
+    return min(budget, scope.deadline - asyncio.get_running_loop().time())
+
+
+def cancel_reason(default: str = "cancelled") -> str:
+    scope = current_request.get()
+    if scope is None or scope.cancel_reason is None:
+        return default
+    return scope.cancel_reason
+
+
+def _client_timeout(scope) -> Optional[float]:
+    for name, value in scope["headers"]:
+        if name == CLIENT_TIMEOUT_HEADER:
+            try:
+                seconds = float(value)
+            except ValueError:
+                return None
+            return seconds - CLIENT_TIMEOUT_MARGIN_SECONDS if seconds > 0 else None
+    return None
+
+
+class DeadlineMiddleware:
+    """
+    Pure-ASGI middleware that bounds each request with a deadline and
+    stops its work as soon as nobody is waiting for the answer.
+
+    ``budget(path)`` gives the server-side deadline for a path (None leaves
+    the request alone); an X-Request-Timeout header from the client can
+    only shorten it. The deadline covers everything the handler does,
+    dependencies (auth) included, and code below can read what is left of
+    it through ``remaining_time``. Until the response starts, a client
+    disconnect cancels the handler, and reaching the deadline cancels it
+    and answers 504. Streaming responses, once started, are left to
+    Starlette, which stops them when the client disconnects.
+    """
+
+    def __init__(self, app, budget: Callable[[str], Optional[float]]):
+        self.app = app
+        self.budget = budget
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        budget = self.budget(scope["path"])
+        if budget is None:
+            await self.app(scope, receive, send)
+            return
+        client_timeout = _client_timeout(scope)
+        if client_timeout is not None:
+            budget = min(budget, client_timeout)
+
+        loop = asyncio.get_running_loop()
+        request = RequestScope(loop.time() + budget)
+        token = current_request.set(request)
+        messages: asyncio.Queue = asyncio.Queue()
+        response_started = False
+
+        async def read_messages():
+            # Sole reader of the server's receive, so a disconnect is seen
+            # even while the handler isn't reading
+            while True:
+                message = await receive()
+                messages.put_nowait(message)
+                if message["type"] == "http.disconnect":
+                    return
+
+        async def queued_receive():
+            message = await messages.get()
+            if message["type"] == "http.disconnect":
+                # Repeat it for anyone who asks again
+                messages.put_nowait(message)
+            return message
+
+        async def tracked_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        handler = asyncio.ensure_future(self.app(scope, queued_receive, tracked_send))
+        reader = asyncio.ensure_future(read_messages())
+        try:
+            while not handler.done():
+                watching = {handler} if reader.done() else {handler, reader}
+                timeout = None if response_started else request.deadline - loop.time()
+                await asyncio.wait(watching, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if handler.done() or response_started:
+                    continue
+                if reader.done():
+                    request.cancel_reason = "disconnect"
+                elif loop.time() >= request.deadline:
+                    request.cancel_reason = "deadline"
+                else:
+                    continue
+                REQUESTS_ABANDONED.inc(reason=request.cancel_reason)
+                logger.info(
+                    "Request abandoned",
+                    extra={"path": scope["path"], "reason": request.cancel_reason, "budget_seconds": round(budget, 3)},
+                )
+                handler.cancel()
+                try:
+                    await handler
+                except asyncio.CancelledError:
+                    pass
+                if request.cancel_reason == "deadline" and not response_started:
+                    await _send_timeout(send, budget)
+                return
+            handler.result()
+        finally:
+            if not handler.done():
+                handler.cancel()
+            reader.cancel()
+            current_request.reset(token)
+
+
+async def _send_timeout(send, budget: float) -> None:
+    body = json.dumps({"detail": f"Request deadline of {budget:g}s exceeded"}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": 504,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,202 @@
+# Near-duplicate matching for definition lookups
+import os
+from collections import Counter as Tally, OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from backend.metrics import Counter
+
+FUZZY_MATCH_ENABLED = os.getenv("FUZZY_MATCH_ENABLED", "true").lower() in ("1", "true", "yes")
+# Typo matching guesses between real words (effect/affect, desert/dessert),
+# so it is opt-in; inflection matching alone is on by default
+FUZZY_TYPO_ENABLED = os.getenv("FUZZY_TYPO_ENABLED", "false").lower() in ("1", "true", "yes")
+FUZZY_MIN_SIMILARITY = float(os.getenv("FUZZY_MIN_SIMILARITY", "0.92"))
+FUZZY_MAX_TERMS = int(os.getenv("FUZZY_MAX_TERMS", "100000"))
+# Typo matching is skipped for short inputs, where one edit is a different word
+FUZZY_MIN_TYPO_LENGTH = 5
+# Candidates sharing the most trigrams that get a full edit-distance check
+FUZZY_CANDIDATES = 20
+
+FUZZY_MATCHES = Counter(
+    "definition_fuzzy_matches_total",
+    "Definition lookups answered by a near-duplicate of a known entry, by match kind",
+    ["kind"],
+)
+
+# (suffix, replacement, minimum stem length left after removing the suffix)
+_SUFFIX_RULES = (
+    ("ies", "y", 2),
+    ("ied", "y", 2),
+    ("sses", "ss", 2),
+    ("xes", "x", 1),
+    ("ches", "ch", 1),
+    ("shes", "sh", 1),
+    ("ing", "", 3),
+    ("ed", "", 3),
+    ("s", "", 4),
+)
+_NO_S_FOLD = ("ss", "us", "is")
+_VOWELS = set("aeiou")
+
+
+def _ends_cvc(stem: str) -> bool:
+    # hop, car, unit: a short final syllable, so the base took a silent "e"
+    # (hoping, caring, united) or a doubled consonant (hopping)
+    return (
+        len(stem) >= 3
+        and stem[-1] not in _VOWELS | set("wxy")
+        and stem[-2] in _VOWELS
+        and stem[-3] not in _VOWELS
+    )
+
+
+def base_forms(word: str) -> List[str]:
+    """
+    Candidate base words an inflected word could come from ("puppies" ->
+    "puppy", "hopping" -> "hop", "hoping" -> "hope"). Empty for words with
+    no recognised inflection. Only ever maps inflected to base, never the
+    reverse, and is only used to look up words already defined.
+    """
+    if not word.isalpha():
+        return []
+    for suffix, replacement, min_stem in _SUFFIX_RULES:
+        if not word.endswith(suffix) or len(word) - len(suffix) < min_stem:
+            continue
+        if suffix == "s" and word.endswith(_NO_S_FOLD):
+            return []
+        stem = word[: -len(suffix)] + replacement
+        if suffix not in ("ing", "ed"):
+            return [stem]
+        if stem[-1] == stem[-2] and stem[-1] not in _VOWELS | set("lsz"):
+            # hopping -> hop, planned -> plan
+            return [stem[:-1]]
+        if _ends_cvc(stem):
+            # hoping -> hope, never hop; united -> unite, never unit
+            return [stem + "e"]
+        # walked -> walk, loved -> love
+        return [stem, stem + "e"]
+    return []
+
+
+def base_texts(text: str) -> List[str]:
+    """
+    Candidate base forms of a normalized text, inflecting its last word
+    ("running shoes" -> "running shoe")
+    """
+    head, _, last = text.rpartition(" ")
+    prefix = head + " " if head else ""
+    return [prefix + base for base in base_forms(last)]
+
+
+def trigrams(text: str) -> Set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """
+    Optimal string alignment distance (Levenshtein plus adjacent swaps).
+    Returns limit + 1 as soon as the distance is known to exceed limit.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2: List[int] = []
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+class FuzzyIndex:
+    """
+    Normalized texts that have a definition somewhere (vocabulary index,
+    memory cache or persistent store), indexed for near-duplicate lookup.
+
+    ``match`` maps an inflected text to its known base form and, when
+    ``typos`` is set, falls back to a trigram search scored by edit
+    distance. Ambiguous bases, typo matches below ``min_similarity`` and
+    ties between equally close candidates are rejected. The oldest terms
+    are forgotten past ``max_terms``.
+    """
+
+    def __init__(
+        self,
+        max_terms: int = FUZZY_MAX_TERMS,
+        min_similarity: float = FUZZY_MIN_SIMILARITY,
+        typos: bool = FUZZY_TYPO_ENABLED,
+    ):
+        self.max_terms = max_terms
+        self.min_similarity = min_similarity
+        self.typos = typos
+        self._terms: "OrderedDict[str, None]" = OrderedDict()
+        self._grams: Dict[str, Set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._terms)
+
+    def add(self, term: str) -> None:
+        if term in self._terms:
+            self._terms.move_to_end(term)
+            return
+        self._terms[term] = None
+        for gram in trigrams(term):
+            self._grams.setdefault(gram, set()).add(term)
+        while len(self._terms) > self.max_terms:
+            self.discard(next(iter(self._terms)))
+
+    def update(self, terms: Iterable[str]) -> None:
+        for term in terms:
+            self.add(term)
+
+    def discard(self, term: str) -> None:
+        if term not in self._terms:
+            return
+        del self._terms[term]
+        for gram in trigrams(term):
+            postings = self._grams.get(gram)
+            if postings is not None:
+                postings.discard(term)
+                if not postings:
+                    del self._grams[gram]
+
+    def match(self, text: str) -> Optional[Tuple[str, str, float]]:
+        """
+        Best known term for normalized text as (term, kind, similarity),
+        where kind is "inflection" or "typo", or None
+        """
+        bases = [base for base in base_texts(text) if base in self._terms]
+        if len(bases) == 1:
+            return bases[0], "inflection", 1.0
+        if bases:
+            return None
+
+        if not self.typos or len(text) < FUZZY_MIN_TYPO_LENGTH:
+            return None
+        shared = Tally()
+        for gram in trigrams(text):
+            shared.update(self._grams.get(gram, ()))
+        limit = int(len(text) * (1 - self.min_similarity))
+        best: Optional[str] = None
+        best_distance = limit + 1
+        tied = False
+        for term, _ in shared.most_common(FUZZY_CANDIDATES):
+            if term == text:
+                continue
+            distance = edit_distance(text, term, limit)
+            if distance < best_distance:
+                best, best_distance, tied = term, distance, False
+            elif distance == best_distance and distance <= limit:
+                tied = True
+        if best is None or tied:
+            return None
+        similarity = 1 - best_distance / max(len(text), len(best))
+        if similarity < self.min_similarity:
+            return None
+        return best, "typo", similarity
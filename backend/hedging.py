@@ -0,0 +1,166 @@
+# Hedged completions: adaptive deadlines and accounting for duplicate calls
+import os
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+from backend.metrics import CallbackMetric, Counter
+
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "true").lower() in ("1", "true", "yes")
+# A second request is sent once the first has run longer than this latency percentile
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+HEDGE_MIN_DELAY_SECONDS = float(os.getenv("HEDGE_MIN_DELAY_SECONDS", "0.5"))
+HEDGE_MAX_DELAY_SECONDS = float(os.getenv("HEDGE_MAX_DELAY_SECONDS", "10"))
+# Hedges allowed per completion, bounding the extra token spend
+HEDGE_MAX_RATIO = float(os.getenv("HEDGE_MAX_RATIO", "0.1"))
+# Send the hedge to the endpoint's first fallback model, when it has one
+HEDGE_TO_FALLBACK = os.getenv("HEDGE_TO_FALLBACK", "true").lower() in ("1", "true", "yes")
+# Completed calls per endpoint the percentile is taken over
+HEDGE_WINDOW = 500
+# Below this many samples the percentile is noise, so nothing is hedged
+HEDGE_MIN_SAMPLES = 20
+
+LLM_HEDGES = Counter(
+    "llm_hedges_total",
+    "Hedged completion decisions by endpoint: fired, won, lost or skipped",
+    ["endpoint", "result"],
+)
+LLM_HEDGE_CANCELLED_TOKENS = Counter(
+    "llm_hedge_cancelled_prompt_tokens_total",
+    "Estimated prompt tokens of completion attempts cancelled because the other one won",
+    ["endpoint"],
+)
+LLM_FALLBACKS = Counter(
+    "llm_model_fallbacks_total",
+    "Completions retried on the next model in the endpoint's preference list",
+    ["endpoint", "model", "reason"],
+)
+
+
+def model_list(value: str) -> List[str]:
+    """
+    Parse a comma-separated model preference list
+    """
+    return [model.strip() for model in value.split(",") if model.strip()]
+
+
+class LatencyWindow:
+    """
+    The most recent successful call durations for one endpoint
+    """
+
+    def __init__(self, size: int = HEDGE_WINDOW):
+        self._samples: Deque[float] = deque(maxlen=size)
+        self._sorted: Optional[List[float]] = None
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def observe(self, seconds: float) -> None:
+        self._samples.append(seconds)
+        self._sorted = None
+
+    def percentile(self, q: float) -> float:
+        if self._sorted is None:
+            self._sorted = sorted(self._samples)
+        return self._sorted[min(len(self._sorted) - 1, int(q * len(self._sorted)))]
+
+
+class HedgePolicy:
+    """
+    Decides when a slow completion gets a second, competing request.
+
+    The deadline is the endpoint's recent ``percentile`` latency, clamped
+    to [min_delay, max_delay], so it follows the upstream as it speeds up
+    or slows down. Hedges are capped at ``max_ratio`` of completions; past
+    that, slow calls are simply left to finish.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = HEDGE_ENABLED,
+        percentile: float = HEDGE_PERCENTILE,
+        min_delay: float = HEDGE_MIN_DELAY_SECONDS,
+        max_delay: float = HEDGE_MAX_DELAY_SECONDS,
+        max_ratio: float = HEDGE_MAX_RATIO,
+    ):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.max_ratio = max_ratio
+        self._latency: Dict[str, LatencyWindow] = {}
+        self.calls: Dict[str, int] = {}
+        self.hedges: Dict[str, int] = {}
+        self.wins: Dict[str, int] = {}
+
+    def observe(self, endpoint: str, seconds: float) -> None:
+        window = self._latency.get(endpoint)
+        if window is None:
+            window = self._latency[endpoint] = LatencyWindow()
+        window.observe(seconds)
+
+    def record_call(self, endpoint: str) -> None:
+        self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+
+    def delay(self, endpoint: str) -> Optional[float]:
+        """
+        Seconds to wait before hedging a call, or None if it shouldn't be
+        """
+        window = self._latency.get(endpoint)
+        if not self.enabled or window is None or len(window) < HEDGE_MIN_SAMPLES:
+            return None
+        return min(self.max_delay, max(self.min_delay, window.percentile(self.percentile)))
+
+    def try_hedge(self, endpoint: str) -> bool:
+        """
+        Claim a hedge if the endpoint is within its hedge budget
+        """
+        hedges = self.hedges.get(endpoint, 0)
+        if hedges + 1 > self.max_ratio * self.calls.get(endpoint, 0):
+            LLM_HEDGES.inc(endpoint=endpoint, result="skipped")
+            return False
+        self.hedges[endpoint] = hedges + 1
+        LLM_HEDGES.inc(endpoint=endpoint, result="fired")
+        return True
+
+    def record_outcome(self, endpoint: str, hedge_won: bool) -> None:
+        if hedge_won:
+            self.wins[endpoint] = self.wins.get(endpoint, 0) + 1
+        LLM_HEDGES.inc(endpoint=endpoint, result="won" if hedge_won else "lost")
+
+    def hedge_rate(self, endpoint: str) -> float:
+        calls = self.calls.get(endpoint, 0)
+        return self.hedges.get(endpoint, 0) / calls if calls else 0.0
+
+    def win_ratio(self, endpoint: str) -> float:
+        hedges = self.hedges.get(endpoint, 0)
+        return self.wins.get(endpoint, 0) / hedges if hedges else 0.0
+
+
+def register_hedge_metrics(policy: HedgePolicy) -> None:
+    CallbackMetric(
+        "llm_hedge_rate",
+        "Hedged completions divided by completions, by endpoint",
+        "gauge",
+        lambda: [((endpoint,), policy.hedge_rate(endpoint)) for endpoint in policy.calls],
+        ["endpoint"],
+    )
+    CallbackMetric(
+        "llm_hedge_win_ratio",
+        "Hedges that finished before the original request, divided by hedges",
+        "gauge",
+        lambda: [((endpoint,), policy.win_ratio(endpoint)) for endpoint in policy.hedges],
+        ["endpoint"],
+    )
+    CallbackMetric(
+        "llm_hedge_delay_seconds",
+        "Current adaptive hedging deadline, by endpoint",
+        "gauge",
+        lambda: [
+            ((endpoint,), delay)
+            for endpoint in policy.calls
+            for delay in [policy.delay(endpoint)]
+            if delay is not None
+        ],
+        ["endpoint"],
+    )
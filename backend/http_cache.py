@@ -0,0 +1,105 @@
+# Conditional requests, Cache-Control and compression for cacheable GET responses
+import gzip
+import hashlib
+import os
+from typing import Dict, Optional
+
+from fastapi import Request, Response
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is always available
+    brotli = None
+
+# Browsers keep a definition for an hour, shared caches (CDN, Vercel edge) for
+# a day, and either may serve a stale copy for a week while revalidating
+DEFINITION_MAX_AGE = int(os.getenv("DEFINITION_MAX_AGE", "3600"))
+DEFINITION_SHARED_MAX_AGE = int(os.getenv("DEFINITION_SHARED_MAX_AGE", "86400"))
+DEFINITION_STALE_WHILE_REVALIDATE = int(os.getenv("DEFINITION_STALE_WHILE_REVALIDATE", str(7 * 86400)))
+COMPRESS_MIN_BYTES = 1024
+
+NO_STORE = "no-store"
+
+
+def public_cache_control(
+    max_age: int = DEFINITION_MAX_AGE,
+    shared_max_age: int = DEFINITION_SHARED_MAX_AGE,
+    stale_while_revalidate: int = DEFINITION_STALE_WHILE_REVALIDATE,
+) -> str:
+    return (
+        f"public, max-age={max_age}, s-maxage={shared_max_age}, "
+        f"stale-while-revalidate={stale_while_revalidate}, stale-if-error={stale_while_revalidate}"
+    )
+
+
+def etag_for(body: bytes) -> str:
+    """
+    Validator derived from the uncompressed body. It is weak so that the
+    gzip, brotli and identity representations share it.
+    """
+    return 'W/"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Weak comparison, as If-None-Match requires
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == opaque for candidate in if_none_match.split(","))
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """
+    Preferred content coding we support from an Accept-Encoding header
+    """
+    offered: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        offered[coding.strip().lower()] = quality
+    supported = (["br"] if brotli is not None else []) + ["gzip"]
+    best = max(supported, key=lambda coding: offered.get(coding, offered.get("*", 0.0)))
+    return best if offered.get(best, offered.get("*", 0.0)) > 0 else None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+
+def cacheable_response(
+    request: Request,
+    body: bytes,
+    cache_control: str,
+    media_type: str = "application/json",
+) -> Response:
+    """
+    Response for a GET whose body is the same for every caller.
+
+    Sends 304 when If-None-Match already names this body, and compresses
+    larger bodies according to Accept-Encoding. ``Vary`` only lists
+    Accept-Encoding: the body never depends on who asked, so per-user
+    credentials must not fragment shared caches.
+    """
+    etag = etag_for(body)
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    if len(body) >= COMPRESS_MIN_BYTES:
+        encoding = choose_encoding(request.headers.get("accept-encoding", ""))
+        if encoding is not None:
+            body = compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type=media_type, headers=headers)
@@ -0,0 +1,178 @@
+# Shared, explicitly configured HTTP connection pools for upstream APIs
+import importlib.util
+import logging
+import os
+from typing import Dict, List, Tuple
+
+import httpx
+
+from backend.metrics import CallbackMetric
+
+logger = logging.getLogger("backend.http")
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("HTTP_KEEPALIVE_EXPIRY_SECONDS", "60"))
+HTTP_CONNECT_TIMEOUT_SECONDS = float(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", "5"))
+HTTP_READ_TIMEOUT_SECONDS = float(os.getenv("HTTP_READ_TIMEOUT_SECONDS", "30"))
+HTTP_WRITE_TIMEOUT_SECONDS = float(os.getenv("HTTP_WRITE_TIMEOUT_SECONDS", "10"))
+# How long a request may wait for a free connection before failing fast
+HTTP_POOL_TIMEOUT_SECONDS = float(os.getenv("HTTP_POOL_TIMEOUT_SECONDS", "2"))
+# HTTP/2 needs the optional h2 package; "auto" enables it when installed
+HTTP2 = os.getenv("HTTP2", "auto").lower()
+
+
+def http2_enabled() -> bool:
+    if HTTP2 in ("0", "false", "no"):
+        return False
+    available = importlib.util.find_spec("h2") is not None
+    if HTTP2 in ("1", "true", "yes") and not available:
+        logger.warning("HTTP2 requested but the h2 package is not installed; using HTTP/1.1")
+    return available
+
+
+def pool_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SECONDS,
+    )
+
+
+def pool_timeout() -> httpx.Timeout:
+    return httpx.Timeout(
+        connect=HTTP_CONNECT_TIMEOUT_SECONDS,
+        read=HTTP_READ_TIMEOUT_SECONDS,
+        write=HTTP_WRITE_TIMEOUT_SECONDS,
+        pool=HTTP_POOL_TIMEOUT_SECONDS,
+    )
+
+
+class _PoolCounters:
+    """
+    Request and connection counters shared by the transport wrappers.
+    New TCP connections and TLS handshakes are counted through httpcore's
+    trace hook, so a warm pool shows requests growing while they don't.
+    """
+
+    def __init__(self):
+        self.in_flight = 0
+        self.requests = 0
+        self.connects = 0
+        self.tls_handshakes = 0
+        self.pool_timeouts = 0
+
+    def on_trace(self, event_name: str) -> None:
+        if event_name == "connection.connect_tcp.complete":
+            self.connects += 1
+        elif event_name == "connection.start_tls.complete":
+            self.tls_handshakes += 1
+
+
+class AsyncPooledTransport(httpx.AsyncHTTPTransport):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.counters = _PoolCounters()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        counters = self.counters
+
+        async def trace(event_name, info):
+            counters.on_trace(event_name)
+
+        request.extensions["trace"] = trace
+        counters.requests += 1
+        counters.in_flight += 1
+        try:
+            return await super().handle_async_request(request)
+        except httpx.PoolTimeout:
+            counters.pool_timeouts += 1
+            raise
+        finally:
+            counters.in_flight -= 1
+
+
+class PooledTransport(httpx.HTTPTransport):
+    """
+    Sync counterpart for supabase-py, which we call from worker threads;
+    the counters are approximate when threads race
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.counters = _PoolCounters()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        counters = self.counters
+        request.extensions["trace"] = lambda event_name, info: counters.on_trace(event_name)
+        counters.requests += 1
+        counters.in_flight += 1
+        try:
+            return super().handle_request(request)
+        except httpx.PoolTimeout:
+            counters.pool_timeouts += 1
+            raise
+        finally:
+            counters.in_flight -= 1
+
+
+_pools: List[Tuple[str, httpx.BaseTransport]] = []
+
+
+def pool_stats(transport) -> Dict[str, int]:
+    connections = transport._pool.connections
+    idle = sum(1 for connection in connections if connection.is_idle())
+    counters = transport.counters
+    return {
+        "connections": len(connections),
+        "idle": idle,
+        "active": len(connections) - idle,
+        "in_flight": counters.in_flight,
+        "requests": counters.requests,
+        "connects": counters.connects,
+        "tls_handshakes": counters.tls_handshakes,
+        "pool_timeouts": counters.pool_timeouts,
+    }
+
+
+def all_pool_stats() -> Dict[str, Dict[str, int]]:
+    return {name: pool_stats(transport) for name, transport in _pools}
+
+
+def async_transport(name: str) -> AsyncPooledTransport:
+    transport = AsyncPooledTransport(limits=pool_limits(), http2=http2_enabled())
+    _pools.append((name, transport))
+    return transport
+
+
+def sync_transport(name: str) -> PooledTransport:
+    transport = PooledTransport(limits=pool_limits(), http2=http2_enabled())
+    _pools.append((name, transport))
+    return transport
+
+
+async def close_pools() -> None:
+    """
+    Close every pooled connection, at shutdown
+    """
+    for _, transport in _pools:
+        if isinstance(transport, httpx.AsyncBaseTransport):
+            await transport.aclose()
+        else:
+            transport.close()
+
+
+def _pool_collector(field: str):
+    return lambda: [((name,), pool_stats(transport)[field]) for name, transport in _pools]
+
+
+for _name, _field, _type, _help in (
+    ("http_pool_connections", "connections", "gauge", "Open upstream connections"),
+    ("http_pool_idle_connections", "idle", "gauge", "Open upstream connections not serving a request"),
+    ("http_pool_in_flight", "in_flight", "gauge", "Upstream requests in progress, including those waiting for a connection"),
+    ("http_pool_requests_total", "requests", "counter", "Upstream requests sent"),
+    ("http_pool_connects_total", "connects", "counter", "New TCP connections opened"),
+    ("http_pool_tls_handshakes_total", "tls_handshakes", "counter", "TLS handshakes performed"),
+    ("http_pool_timeouts_total", "pool_timeouts", "counter", "Requests that gave up waiting for a free connection"),
+):
+    CallbackMetric(_name, _help, _type, _pool_collector(_field), ["pool"])
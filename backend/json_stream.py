@@ -0,0 +1,130 @@
+# Incremental extraction of top-level JSON object members from streamed text
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class IncrementalObjectParser:
+    """
+    Feed chunks of an LLM response and get back each top-level member of
+    the JSON object as soon as its value is complete.
+
+    Text before the opening brace (such as a ```json fence) and after the
+    closing one is ignored. Members whose text doesn't parse are skipped
+    rather than failing the whole stream; the caller still validates the
+    final object. ``recover`` salvages what it can from text that never
+    finished, such as a completion cut off by its token limit.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.fields: Dict[str, Any] = {}
+        self.done = False
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._member_start: Optional[int] = None
+
+    def feed(self, text: str) -> List[Tuple[str, Any]]:
+        """
+        Append text and return the (key, value) pairs completed by it
+        """
+        self.buffer += text
+        completed: List[Tuple[str, Any]] = []
+        buffer = self.buffer
+        while self._pos < len(buffer) and not self.done:
+            ch = buffer[self._pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+                if self._depth == 1 and ch == "{":
+                    self._member_start = self._pos + 1
+            elif ch in "}]":
+                if self._depth == 1 and ch == "}":
+                    self._emit(self._pos, completed)
+                    self.done = True
+                self._depth = max(self._depth - 1, 0)
+            elif ch == "," and self._depth == 1:
+                self._emit(self._pos, completed)
+                self._member_start = self._pos + 1
+            self._pos += 1
+        return completed
+
+    def recover(self) -> Dict[str, Any]:
+        """
+        Best-effort object from everything fed so far: the completed members
+        plus as much of an unfinished last member as can be closed into
+        valid JSON
+        """
+        fields = dict(self.fields)
+        if self.done or self._member_start is None:
+            return fields
+        member = self.buffer[self._member_start:].strip()
+        if member:
+            fields.update(close_fragment(member) or {})
+        return fields
+
+    def _emit(self, end: int, completed: List[Tuple[str, Any]]) -> None:
+        if self._member_start is None:
+            return
+        member = self.buffer[self._member_start:end].strip()
+        if not member:
+            return
+        try:
+            parsed = json.loads("{" + member + "}")
+        except ValueError:
+            return
+        for key, value in parsed.items():
+            self.fields[key] = value
+            completed.append((key, value))
+
+
+def close_fragment(fragment: str) -> Optional[Dict[str, Any]]:
+    """
+    Parse an unterminated object member (``"key": [{"a": "b"}, {"a": "c``)
+    by closing whatever is still open: first all of it, ending an open
+    string, then cut back to each earlier separator in turn. None when no
+    prefix yields a member.
+    """
+    closers: List[str] = []
+    in_string = False
+    escape = False
+    # (end of a prefix that stops between values, closers it needs)
+    cuts: List[Tuple[int, str]] = []
+    for index, ch in enumerate(fragment):
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            closers.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            if closers:
+                closers.pop()
+            cuts.append((index + 1, "".join(reversed(closers))))
+        elif ch == ",":
+            cuts.append((index, "".join(reversed(closers))))
+    whole = fragment[:-1] if escape else fragment
+    candidates = [whole + ('"' if in_string else "") + "".join(reversed(closers))]
+    candidates.extend(fragment[:end] + closing for end, closing in reversed(cuts))
+    for candidate in candidates:
+        try:
+            parsed = json.loads("{" + candidate + "}")
+        except ValueError:
+            continue
+        if parsed:
+            return parsed
+    return None
@@ -0,0 +1,450 @@
+# Async Groq completion path shared by the LLM-backed endpoints
+import asyncio
+import logging
+import os
+import time
+from typing import AsyncIterator, Dict, List, Optional, Sequence
+
+import httpx
+from fastapi import HTTPException, status
+from groq import APIConnectionError, AsyncGroq, BadRequestError, InternalServerError, RateLimitError
+
+from backend.circuit import CircuitBreaker, register_circuit_metrics
+from backend.hedging import (
+    HEDGE_TO_FALLBACK,
+    LLM_FALLBACKS,
+    LLM_HEDGE_CANCELLED_TOKENS,
+    HedgePolicy,
+    register_hedge_metrics,
+)
+from backend.http_pools import async_transport, pool_timeout
+from backend.deadline import cancel_reason, remaining_time
+from backend.metrics import LLM_CANCELLED_CALLS, LLM_REQUEST_SECONDS, LLM_SAVED_TOKENS, LLM_TOKENS, LLM_TRUNCATED
+from backend.scheduler import (
+    LLMScheduler,
+    register_scheduler_metrics,
+    GROQ_REQUESTS_PER_MINUTE,
+    GROQ_TOKENS_PER_MINUTE,
+)
+
+logger = logging.getLogger("backend.llm")
+
+# Upper bound on completions in flight per worker, shared by every endpoint
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+
+# Per-endpoint request budget (seconds): auth, the wait for a slot and the call
+# itself. Requests carry it as a deadline (backend.deadline), and a call gets
+# whatever is left of it.
+ENDPOINT_TIMEOUTS: Dict[str, float] = {
+    "define": float(os.getenv("DEFINE_TIMEOUT_SECONDS", "20")),
+    "jokes": float(os.getenv("JOKES_TIMEOUT_SECONDS", "15")),
+    "captions": float(os.getenv("CAPTIONS_TIMEOUT_SECONDS", "15")),
+}
+DEFAULT_TIMEOUT = 20.0
+
+# Pause after a Groq 429 that doesn't say how long to wait
+RATE_LIMIT_PAUSE_SECONDS = 5.0
+
+# Upstream failures that move a call on to the next model in its preference
+# list, and that count against the circuit breaker
+FALLBACK_ERRORS = (RateLimitError, InternalServerError, APIConnectionError)
+UPSTREAM_ERRORS = FALLBACK_ERRORS
+
+scheduler = LLMScheduler(LLM_MAX_CONCURRENCY, GROQ_REQUESTS_PER_MINUTE, GROQ_TOKENS_PER_MINUTE)
+register_scheduler_metrics(scheduler)
+hedge_policy = HedgePolicy()
+register_hedge_metrics(hedge_policy)
+groq_circuit = CircuitBreaker("groq")
+register_circuit_metrics(groq_circuit)
+
+
+def free_slots() -> int:
+    """
+    Completion slots nobody holds or waits for right now; background work
+    checks this so it only uses capacity foreground requests don't need
+    """
+    return scheduler.free_slots()
+
+
+def estimate_tokens(messages: List[dict], max_tokens: int) -> int:
+    """
+    Upper-bound token cost of a call for the scheduler's token bucket
+    """
+    return sum(len(message.get("content", "")) for message in messages) // 4 + max_tokens
+
+
+def note_rate_limit(error: RateLimitError) -> None:
+    retry_after = error.response.headers.get("retry-after")
+    try:
+        seconds = float(retry_after) if retry_after else RATE_LIMIT_PAUSE_SECONDS
+    except ValueError:
+        seconds = RATE_LIMIT_PAUSE_SECONDS
+    scheduler.pause(seconds)
+
+
+def _fallback_reason(error: Exception) -> str:
+    if isinstance(error, RateLimitError):
+        return "rate_limited"
+    if isinstance(error, InternalServerError):
+        return "server_error"
+    return "connection_error"
+
+
+def _note_fallback(endpoint: str, error: Exception, failed_model: str, next_model: str) -> None:
+    reason = _fallback_reason(error)
+    LLM_FALLBACKS.inc(endpoint=endpoint, model=next_model, reason=reason)
+    logger.warning(
+        "Falling back to the next model",
+        extra={"endpoint": endpoint, "model": failed_model, "fallback_model": next_model, "reason": reason},
+    )
+
+
+def _report_to_circuit(outcome: str, upstream_failed: bool, seconds: float) -> None:
+    if outcome == "ok":
+        groq_circuit.succeeded(seconds)
+    elif upstream_failed:
+        groq_circuit.failed()
+    else:
+        # Shed locally, cancelled or rejected by Groq as a bad request
+        groq_circuit.abandoned()
+
+
+def _timeout_error(timeout: float) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+        detail=f"Groq API timed out after {timeout:g}s",
+    )
+
+
+def create_groq_client(api_key: Optional[str]) -> Optional[AsyncGroq]:
+    """
+    Build the async Groq client on the shared "groq" connection pool, or
+    None when the key is missing or a placeholder
+    """
+    if not api_key or api_key == "your_groq_api_key_here":
+        return None
+    http_client = httpx.AsyncClient(transport=async_transport("groq"), timeout=pool_timeout())
+    # The SDK would otherwise retry 429s and 5xx itself, outside the
+    # scheduler's queue, the token buckets and the hedge budget, and hide
+    # all but the last attempt's outcome from the circuit breaker
+    return AsyncGroq(api_key=api_key, http_client=http_client, max_retries=0)
+
+
+# Moving average of completion tokens per endpoint, for estimating what a
+# cancelled call would have cost
+_completion_tokens: Dict[str, float] = {}
+
+
+def expected_completion_tokens(endpoint: str, max_tokens: int) -> float:
+    return _completion_tokens.get(endpoint, max_tokens)
+
+
+def record_usage(endpoint: str, model: str, chat_completion) -> None:
+    usage = getattr(chat_completion, "usage", None)
+    if usage is None:
+        return
+    LLM_TOKENS.inc(usage.prompt_tokens or 0, endpoint=endpoint, model=model, kind="prompt")
+    LLM_TOKENS.inc(usage.completion_tokens or 0, endpoint=endpoint, model=model, kind="completion")
+    note_completion_tokens(endpoint, usage.completion_tokens or 0)
+
+
+def failed_generation(error: BadRequestError) -> Optional[str]:
+    """
+    What a JSON-mode completion generated before Groq rejected it as invalid
+    JSON (error code json_validate_failed), or None for other bad requests
+    """
+    body = error.body if isinstance(error.body, dict) else {}
+    details = body.get("error", body)
+    if isinstance(details, dict) and details.get("code") == "json_validate_failed":
+        return details.get("failed_generation")
+    return None
+
+
+def note_completion_tokens(endpoint: str, tokens: int) -> None:
+    if tokens:
+        average = _completion_tokens.get(endpoint, tokens)
+        _completion_tokens[endpoint] = 0.9 * average + 0.1 * tokens
+
+
+def record_cancellation(endpoint: str, reason: str, sent: bool, saved_tokens: float) -> None:
+    """
+    Count a completion abandoned before it finished. Queued calls save
+    their whole cost; calls already sent save the rest of the generation.
+    """
+    LLM_CANCELLED_CALLS.inc(endpoint=endpoint, reason=reason, stage="in_flight" if sent else "queued")
+    LLM_SAVED_TOKENS.inc(max(0, int(saved_tokens)), endpoint=endpoint)
+
+
+async def complete(
+    client: AsyncGroq,
+    *,
+    endpoint: str,
+    messages: List[dict],
+    model: str,
+    temperature: float,
+    max_tokens: int,
+    fallback_models: Sequence[str] = (),
+    json_mode: bool = False,
+):
+    """
+    Run one chat completion without blocking the event loop.
+
+    Each upstream request is admitted by the scheduler (which may shed it
+    with a 429). When ``model`` is rate limited or failing, the call moves
+    on through ``fallback_models`` in order. If it is still running at the
+    endpoint's adaptive hedging deadline, a second request races it (on the
+    first fallback model, when there is one); the first to succeed wins
+    and the other is cancelled. The whole operation is bounded by the
+    endpoint's timeout; running out of time surfaces as a 504 instead of
+    holding the request open indefinitely. ``json_mode`` uses Groq's JSON
+    response format, which only returns syntactically valid JSON objects
+    (see ``failed_generation`` for what happens otherwise).
+    """
+    timeout = max(0.0, remaining_time(ENDPOINT_TIMEOUTS.get(endpoint, DEFAULT_TIMEOUT)))
+    models = [model, *(name for name in fallback_models if name != model)]
+    options = {"response_format": {"type": "json_object"}} if json_mode else {}
+    prompt_tokens = estimate_tokens(messages, 0)
+    hedge_policy.record_call(endpoint)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    sent = False
+
+    async def _call(model_name: str):
+        # One breaker outcome per upstream request, so a failure that a
+        # fallback or hedge recovers from is still counted
+        nonlocal sent
+        groq_circuit.begin()
+        outcome = "error"
+        upstream_failed = False
+        started = None
+        try:
+            grant = await scheduler.acquire(estimate_tokens(messages, max_tokens))
+            started = time.perf_counter()
+            sent = True
+            try:
+                chat_completion = await client.chat.completions.create(
+                    messages=messages,
+                    model=model_name,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    timeout=timeout,
+                    **options,
+                )
+            finally:
+                scheduler.release(grant)
+            outcome = "ok"
+        except UPSTREAM_ERRORS:
+            upstream_failed = True
+            raise
+        except asyncio.CancelledError:
+            # Cut off by the deadline while Groq was working on it; a losing
+            # hedge or a caller that went away says nothing about its health
+            upstream_failed = started is not None and loop.time() >= deadline
+            raise
+        finally:
+            _report_to_circuit(outcome, upstream_failed, 0.0 if started is None else time.perf_counter() - started)
+        hedge_policy.observe(endpoint, time.perf_counter() - started)
+        usage = getattr(chat_completion, "usage", None)
+        if usage is not None and usage.total_tokens:
+            grant.settle(usage.total_tokens)
+        return model_name, chat_completion
+
+    async def _with_fallback():
+        for index, model_name in enumerate(models):
+            try:
+                return await _call(model_name)
+            except FALLBACK_ERRORS as e:
+                if index + 1 == len(models):
+                    if isinstance(e, RateLimitError):
+                        # Every model is rate limited: hold off all calls
+                        note_rate_limit(e)
+                    raise
+                _note_fallback(endpoint, e, model_name, models[index + 1])
+
+    async def _hedged():
+        primary = asyncio.ensure_future(_with_fallback())
+        delay = hedge_policy.delay(endpoint)
+        if delay is None:
+            return await primary
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        # No hedge when every slot is taken: it would only queue behind others
+        if done or free_slots() == 0 or not hedge_policy.try_hedge(endpoint):
+            return await primary
+        hedge_model = models[1] if HEDGE_TO_FALLBACK and len(models) > 1 else model
+        hedge = asyncio.ensure_future(_call(hedge_model))
+        pending = {primary, hedge}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in (primary, hedge):
+                    if task in done and task.exception() is None:
+                        hedge_policy.record_outcome(endpoint, hedge_won=task is hedge)
+                        if pending:
+                            LLM_HEDGE_CANCELLED_TOKENS.inc(prompt_tokens, endpoint=endpoint)
+                        return task.result()
+            # Both failed; report the original request's error
+            return primary.result()
+        finally:
+            for task in (primary, hedge):
+                if not task.done():
+                    task.cancel()
+
+    start = time.perf_counter()
+    outcome = "error"
+    served_model = model
+    try:
+        served_model, chat_completion = await asyncio.wait_for(_hedged(), timeout=timeout)
+        outcome = "ok"
+    except asyncio.TimeoutError:
+        outcome = "timeout"
+        saved = expected_completion_tokens(endpoint, max_tokens) + (0 if sent else prompt_tokens)
+        record_cancellation(endpoint, "deadline", sent, saved)
+        raise _timeout_error(timeout)
+    except asyncio.CancelledError:
+        outcome = "cancelled"
+        saved = expected_completion_tokens(endpoint, max_tokens) + (0 if sent else prompt_tokens)
+        record_cancellation(endpoint, cancel_reason(), sent, saved)
+        raise
+    except HTTPException as e:
+        if e.status_code == status.HTTP_429_TOO_MANY_REQUESTS:
+            outcome = "shed"
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        LLM_REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, model=served_model, outcome=outcome)
+    record_usage(endpoint, served_model, chat_completion)
+    if chat_completion.choices and chat_completion.choices[0].finish_reason == "length":
+        LLM_TRUNCATED.inc(endpoint=endpoint)
+    return chat_completion
+
+
+async def stream_completion(
+    client: AsyncGroq,
+    *,
+    endpoint: str,
+    messages: List[dict],
+    model: str,
+    temperature: float,
+    max_tokens: int,
+    fallback_models: Sequence[str] = (),
+) -> AsyncIterator[str]:
+    """
+    Stream the text deltas of one chat completion.
+
+    Holds a scheduler slot for the lifetime of the stream. The endpoint
+    timeout bounds the whole stream, checked while waiting for each chunk.
+    If the stream can't be opened on ``model`` because it is rate limited
+    or failing, ``fallback_models`` are tried in order. Streams are never
+    hedged: a duplicate would pay for a second full generation.
+    """
+    timeout = max(0.0, remaining_time(ENDPOINT_TIMEOUTS.get(endpoint, DEFAULT_TIMEOUT)))
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+
+    def remaining() -> float:
+        left = deadline - loop.time()
+        if left <= 0:
+            raise _timeout_error(timeout)
+        return left
+
+    # The first attempt is admitted by the breaker before queueing, so an
+    # open circuit fails fast; each fallback attempt is admitted again
+    groq_circuit.begin()
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        grant = await asyncio.wait_for(
+            scheduler.acquire(estimate_tokens(messages, max_tokens)), timeout=remaining()
+        )
+    except asyncio.TimeoutError:
+        groq_circuit.abandoned()
+        record_cancellation(endpoint, "deadline", False, estimate_tokens(messages, 0) + expected_completion_tokens(endpoint, max_tokens))
+        LLM_REQUEST_SECONDS.observe(
+            time.perf_counter() - start, endpoint=endpoint, model=model, outcome="timeout"
+        )
+        raise _timeout_error(timeout)
+    except HTTPException:
+        groq_circuit.abandoned()
+        LLM_REQUEST_SECONDS.observe(
+            time.perf_counter() - start, endpoint=endpoint, model=model, outcome="shed"
+        )
+        raise
+    except asyncio.CancelledError:
+        groq_circuit.abandoned()
+        record_cancellation(endpoint, cancel_reason("disconnect"), False, estimate_tokens(messages, 0) + expected_completion_tokens(endpoint, max_tokens))
+        raise
+    models = [model, *(name for name in fallback_models if name != model)]
+    stream = None
+    streamed_chars = 0
+    first_chunk_seconds = None
+    upstream_failed = False
+    # Whether an attempt has been admitted by the breaker and not yet reported
+    attempt_open = True
+    try:
+        for index, model_name in enumerate(models):
+            if index > 0:
+                groq_circuit.begin()
+                attempt_open = True
+            try:
+                stream = await asyncio.wait_for(
+                    client.chat.completions.create(
+                        messages=messages,
+                        model=model_name,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                        stream=True,
+                        timeout=timeout,
+                    ),
+                    timeout=remaining(),
+                )
+                break
+            except FALLBACK_ERRORS as e:
+                if index + 1 == len(models):
+                    raise
+                groq_circuit.failed()
+                attempt_open = False
+                _note_fallback(endpoint, e, model_name, models[index + 1])
+        model = model_name
+        chunks = stream.__aiter__()
+        while True:
+            try:
+                chunk = await asyncio.wait_for(chunks.__anext__(), timeout=remaining())
+            except StopAsyncIteration:
+                break
+            if first_chunk_seconds is None:
+                first_chunk_seconds = time.perf_counter() - start
+            if not chunk.choices:
+                continue
+            if chunk.choices[0].finish_reason == "length":
+                LLM_TRUNCATED.inc(endpoint=endpoint)
+            if chunk.choices[0].delta.content:
+                streamed_chars += len(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+        outcome = "ok"
+    except asyncio.TimeoutError:
+        outcome = "timeout"
+        upstream_failed = True
+        record_cancellation(endpoint, "deadline", True, expected_completion_tokens(endpoint, max_tokens) - streamed_chars / 4)
+        raise _timeout_error(timeout)
+    except (asyncio.CancelledError, GeneratorExit):
+        # The client went away mid-stream; closing the stream stops generation
+        outcome = "cancelled"
+        record_cancellation(endpoint, cancel_reason("disconnect"), True, expected_completion_tokens(endpoint, max_tokens) - streamed_chars / 4)
+        if stream is not None:
+            await stream.close()
+        raise
+    except UPSTREAM_ERRORS as e:
+        upstream_failed = True
+        if isinstance(e, RateLimitError):
+            note_rate_limit(e)
+        raise
+    finally:
+        scheduler.release(grant)
+        grant.settle(estimate_tokens(messages, 0) + streamed_chars // 4)
+        if outcome == "ok":
+            note_completion_tokens(endpoint, streamed_chars // 4)
+        elapsed = time.perf_counter() - start
+        if attempt_open:
+            # A stream's health is judged by how soon it started, not how long it ran
+            _report_to_circuit(outcome, upstream_failed, first_chunk_seconds or elapsed)
+        LLM_REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, model=model, outcome=outcome)
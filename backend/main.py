@@ -1,51 +1,175 @@
 # Load environment variables FIRST, before any imports
+import time
+IMPORT_STARTED = time.monotonic()
+
 import os
+import json
+import random
+import secrets
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from urllib.parse import quote
 from dotenv import load_dotenv
 load_dotenv()
 
-from fastapi import FastAPI, HTTPException, Depends
+from backend.logging_setup import configure_logging, RequestIdMiddleware
+configure_logging()
+
+from fastapi import FastAPI, HTTPException, Depends, Header, Path, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, RedirectResponse, StreamingResponse
+from groq import BadRequestError, RateLimitError
 from pydantic import BaseModel, Field
-from groq import Groq
-from typing import Optional, List
-from backend.auth.middleware import get_current_user, require_subscription, User
-
-# Enhanced environment variable debugging
-print("=== ENVIRONMENT VARIABLES DEBUG ===")
-print(f"GROQ_API_KEY: {'SET' if os.getenv('GROQ_API_KEY') else 'NOT SET'}")
-if os.getenv('GROQ_API_KEY'):
-    groq_key = os.getenv('GROQ_API_KEY')
-    print(f"GROQ_API_KEY length: {len(groq_key)}")
-    print(f"GROQ_API_KEY starts with: {groq_key[:10]}...")
-    print(f"GROQ_API_KEY is placeholder: {'YES' if 'your_groq_api_key_here' in groq_key else 'NO'}")
-
-print(f"SUPABASE_URL: {'SET' if os.getenv('SUPABASE_URL') else 'NOT SET'}")
-if os.getenv('SUPABASE_URL'):
-    supabase_url = os.getenv('SUPABASE_URL')
-    print(f"SUPABASE_URL: {supabase_url}")
-    print(f"SUPABASE_URL is placeholder: {'YES' if 'your_supabase_project_url' in supabase_url else 'NO'}")
-
-print(f"SUPABASE_SERVICE_KEY: {'SET' if os.getenv('SUPABASE_SERVICE_KEY') else 'NOT SET'}")
-if os.getenv('SUPABASE_SERVICE_KEY'):
-    service_key = os.getenv('SUPABASE_SERVICE_KEY')
-    print(f"SUPABASE_SERVICE_KEY length: {len(service_key)}")
-    print(f"SUPABASE_SERVICE_KEY starts with: {service_key[:10]}...")
-    print(f"SUPABASE_SERVICE_KEY is placeholder: {'YES' if 'your_supabase_service_key' in service_key else 'NO'}")
-
-# Check for .env file
-env_file_path = os.path.join(os.path.dirname(__file__), '.env')
-print(f".env file exists: {'YES' if os.path.exists(env_file_path) else 'NO'}")
-if os.path.exists(env_file_path):
-    print(f".env file path: {env_file_path}")
-    with open(env_file_path, 'r') as f:
-        env_content = f.read()
-        print(f".env file contains GROQ_API_KEY: {'YES' if 'GROQ_API_KEY' in env_content else 'NO'}")
-        print(f".env file contains SUPABASE_URL: {'YES' if 'SUPABASE_URL' in env_content else 'NO'}")
-        print(f".env file contains SUPABASE_SERVICE_KEY: {'YES' if 'SUPABASE_SERVICE_KEY' in env_content else 'NO'}")
-
-print("==================================")
-
-app = FastAPI(title="AI Dictionary API", version="1.0.0")
+from typing import Annotated, AsyncIterator, Dict, Optional, List, Sequence, Tuple, Type, get_args, get_origin
+from backend.auth.middleware import get_current_user, require_subscription, User, get_supabase, check_supabase
+from backend.auth.tokens import refresh_signing_keys
+from backend.auth.identity import invalidate_identity
+from backend.http_pools import close_pools
+from backend.readiness import ReadinessChecker, StartupTimeline, FirstRequestMiddleware
+from backend.circuit import CircuitOpen
+from backend.hedging import model_list
+from backend.deadline import DeadlineMiddleware
+from backend.profiling import (
+    PROFILE_MAX_SECONDS,
+    PROFILE_MIN_INTERVAL_SECONDS,
+    PROFILE_MODES,
+    SamplingProfiler,
+    SlowRequestLog,
+    SlowRequestMiddleware,
+    collapsed,
+    trace_listener,
+)
+from backend.llm import create_groq_client, complete, failed_generation, stream_completion, groq_circuit, ENDPOINT_TIMEOUTS
+from backend.json_stream import IncrementalObjectParser
+from backend.streaming import sse_event, sse_response, stream_text_events, mock_deltas
+from backend.metrics import (
+    DEFINITION_PARSE_RESULTS,
+    DEGRADED_RESPONSES,
+    LLM_REQUEST_SECONDS,
+    STAGE_SECONDS,
+    register_cache_metrics,
+    register_flight_metrics,
+    render_prometheus,
+    timed,
+)
+from backend.scheduler import LLM_QUEUE_WAIT_SECONDS
+from backend.vocab_index import open_vocab_index, prompt_fingerprint
+from backend.fuzzy import FuzzyIndex, FUZZY_MATCH_ENABLED, FUZZY_MATCHES
+from backend.prefetch import (
+    Prefetcher, register_prefetch_metrics, PREFETCH_ENABLED, PREFETCH_PER_DEFINITION, SIMILARITY_RANK,
+)
+from backend.http_cache import cacheable_response, public_cache_control, NO_STORE
+from backend.usage import UsageRecorder, register_usage_metrics, write_to_supabase, USAGE_EVENTS_ENABLED
+from backend.store import DefinitionStore, open_definition_store, run_cleanup, DEFINITION_STORE_PRELOAD
+from backend.cache import (
+    TTLCache,
+    SingleFlight,
+    definition_cache_key,
+    normalize_text,
+    DEFINITION_CACHE_TTL_SECONDS,
+    DEFINITION_CACHE_MAX_ENTRIES,
+    DEFINITION_CACHE_MAX_BYTES,
+)
+
+logger = logging.getLogger("backend.main")
+
+def placeholder_or_missing(name: str, placeholder: str) -> str:
+    value = os.getenv(name)
+    if not value:
+        return "missing"
+    return "placeholder" if placeholder in value else "set"
+
+def log_configuration() -> None:
+    """
+    Configuration summary (never logs secret values)
+    """
+    env_file_path = os.path.join(os.path.dirname(__file__), '.env')
+    logger.info(
+        "Configuration loaded",
+        extra={
+            "groq_api_key": placeholder_or_missing("GROQ_API_KEY", "your_groq_api_key_here"),
+            "supabase_url": placeholder_or_missing("SUPABASE_URL", "your_supabase_project_url"),
+            "supabase_service_key": placeholder_or_missing("SUPABASE_SERVICE_KEY", "your_supabase_service_key"),
+            "env_file": os.path.exists(env_file_path),
+        },
+    )
+
+startup_timeline = StartupTimeline(origin=IMPORT_STARTED)
+startup_timeline.register_metrics()
+readiness = ReadinessChecker()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global definition_store
+    startup_timeline.mark("lifespan_start")
+    log_configuration()
+    # Clients are built here, not at import; dependency checks run in the background
+    await asyncio.to_thread(get_supabase)
+    readiness.start()
+    # Asymmetric token keys load in the background; tokens arriving first
+    # wait on the same fetch
+    jwks_task = asyncio.create_task(refresh_signing_keys())
+    cleanup_task = None
+    if vocab_index is not None:
+        fuzzy_index.update(vocab_index.keys())
+    # Opened here rather than at import so each preforked worker gets its
+    # own connection and writer thread, and startup does no disk I/O early
+    definition_store = await asyncio.to_thread(open_definition_store, DefinitionResponse.model_validate_json)
+    if definition_store is not None:
+        # Warm the memory cache with the hottest persisted definitions,
+        # expiring each when it would expire in the store
+        hottest = await asyncio.to_thread(definition_store.hottest, DEFINITION_STORE_PRELOAD)
+        for key, definition, remaining in hottest:
+            definition_cache.set(key, definition, ttl=min(remaining, definition_cache.ttl))
+            fuzzy_index.add(key[0])
+        logger.info("Definition cache warmed from store", extra={"entries": len(hottest)})
+        cleanup_task = asyncio.create_task(run_cleanup(definition_store))
+    if PREFETCH_ENABLED and groq_client is not None:
+        prefetcher.start()
+    if USAGE_EVENTS_ENABLED and get_supabase() is not None:
+        usage_recorder.start()
+    startup_timeline.mark("lifespan_done")
+    logger.info("Startup complete", extra={f"{name}_seconds": round(value, 3) for name, value in startup_timeline.marks.items()})
+    yield
+    await readiness.stop()
+    await prefetcher.stop()
+    # Final flush before the connection pools close
+    await usage_recorder.stop()
+    await close_pools()
+    jwks_task.cancel()
+    if cleanup_task is not None:
+        cleanup_task.cancel()
+    if definition_store is not None:
+        await asyncio.to_thread(definition_store.close)
+        definition_store = None
+    if vocab_index is not None:
+        vocab_index.close()
+
+app = FastAPI(title="AI Dictionary API", version="1.0.0", lifespan=lifespan)
+
+def request_budget(path: str) -> Optional[float]:
+    """
+    Deadline for requests that end in a completion; batches are bounded per item
+    """
+    if path in ("/define", "/define/stream") or path.startswith("/definitions/"):
+        return ENDPOINT_TIMEOUTS["define"]
+    if path in ("/jokes/generate", "/jokes/generate/stream"):
+        return ENDPOINT_TIMEOUTS["jokes"]
+    if path in ("/captions/generate", "/captions/generate/stream"):
+        return ENDPOINT_TIMEOUTS["captions"]
+    return None
+
+# Innermost, so its 504s still get CORS and request id headers
+app.add_middleware(DeadlineMiddleware, budget=request_budget)
+
+# Stage breakdowns of slow requests, served at /admin/slow-requests
+slow_requests = SlowRequestLog()
+STAGE_SECONDS.add_listener(trace_listener("stage"))
+LLM_REQUEST_SECONDS.add_listener(trace_listener("endpoint", "model", "outcome", prefix="llm:"))
+LLM_QUEUE_WAIT_SECONDS.add_listener(trace_listener("tier", prefix="llm_queue:"))
+profiler = SamplingProfiler()
+app.add_middleware(SlowRequestMiddleware, log=slow_requests)
 
 # Configure CORS
 app.add_middleware(
@@ -60,22 +184,36 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(RequestIdMiddleware)
+app.add_middleware(FirstRequestMiddleware, timeline=startup_timeline)
 
-# Initialize Groq client with detailed logging
+# Initialize Groq client
 groq_api_key = os.getenv("GROQ_API_KEY")
-if not groq_api_key or groq_api_key == "your_groq_api_key_here":
-    print("WARNING: GROQ_API_KEY not set or using placeholder value. Real API calls will fail.")
-    print(f"GROQ_API_KEY value: {groq_api_key}")
-    groq_client = None
-else:
-    print("SUCCESS: GROQ_API_KEY is properly configured")
-    groq_client = Groq(api_key=groq_api_key)
+groq_client = create_groq_client(groq_api_key)
+if groq_client is None:
+    logger.warning("GROQ_API_KEY not set or using placeholder value; serving mock responses")
+
+# Optional bearer token protecting /metrics
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+# Bearer token for the /admin endpoints; they don't exist while it is unset
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# Batch /define limits
+DEFINE_BATCH_MAX_ITEMS = int(os.getenv("DEFINE_BATCH_MAX_ITEMS", "500"))
+DEFINE_BATCH_CONCURRENCY = int(os.getenv("DEFINE_BATCH_CONCURRENCY", "8"))
 
 # Pydantic models
 class DefinitionRequest(BaseModel):
     text: str = Field(..., min_length=1, max_length=500, description="Text to define")
     use_mock: bool = Field(default=False, description="Use mock response for testing")
 
+class BatchDefinitionRequest(BaseModel):
+    texts: List[Annotated[str, Field(min_length=1, max_length=500)]] = Field(
+        ..., min_length=1, max_length=DEFINE_BATCH_MAX_ITEMS, description="Texts to define"
+    )
+    use_mock: bool = Field(default=False, description="Use mock response for testing")
+    stream: bool = Field(default=False, description="Stream results as NDJSON as they finish")
+
 class JokeRequest(BaseModel):
     prompt: str = Field(..., min_length=1, max_length=500, description="Joke prompt")
 
@@ -83,20 +221,31 @@ class CaptionRequest(BaseModel):
     prompt: str = Field(..., min_length=1, max_length=500, description="Caption prompt")
 
 class Example(BaseModel):
-    sentence: str
-    context: str
+    sentence: str = Field(description="example sentence")
+    context: str = Field(description="brief context")
 
 class Synonym(BaseModel):
-    word: str
-    similarity: str
+    word: str = Field(description="synonym")
+    similarity: str = Field(description="high|medium|low")
 
 class DefinitionResponse(BaseModel):
-    word: str
-    part_of_speech: str
-    definition: str
+    word: str = Field(description="the text defined")
+    part_of_speech: str = Field(description="noun|verb|adjective|phrase|...")
+    definition: str = Field(description="clear, concise definition")
     examples: List[Example]
     synonyms: List[Synonym]
-    confidence: float
+    confidence: float = Field(description="number 0-1")
+    # Served from an expired cache entry because Groq was unavailable
+    stale: bool = False
+
+class BatchDefinitionItem(BaseModel):
+    index: int
+    text: str
+    definition: Optional[DefinitionResponse] = None
+    error: Optional[str] = None
+
+class BatchDefinitionResponse(BaseModel):
+    results: List[BatchDefinitionItem]
 
 class ErrorResponse(BaseModel):
     error: str
@@ -127,13 +276,401 @@ MOCK_RESPONSE = DefinitionResponse(
     confidence=0.95
 )
 
-# Feature usage logging removed for lean schema
-# No longer needed for MVP
+DEFINE_MODEL = "llama-3.1-8b-instant"
+# Tried in order when the endpoint's model is rate limited or failing
+DEFINE_FALLBACK_MODELS = model_list(os.getenv("DEFINE_FALLBACK_MODELS", "gemma2-9b-it"))
+DEFINE_TEMPERATURE = 0.3
+# Output budgets: a few times a typical answer, so truncation is rare
+# (llm_truncated_completions_total) while little quota is reserved per call
+DEFINE_MAX_TOKENS = int(os.getenv("DEFINE_MAX_TOKENS", "450"))
+# Use Groq's JSON response format for non-streamed definitions
+DEFINE_JSON_MODE = os.getenv("DEFINE_JSON_MODE", "true").lower() in ("1", "true", "yes")
+JOKE_MODEL = "llama-3.1-8b-instant"
+JOKE_FALLBACK_MODELS = model_list(os.getenv("JOKES_FALLBACK_MODELS", "gemma2-9b-it"))
+JOKE_TEMPERATURE = 0.7
+JOKE_MAX_TOKENS = int(os.getenv("JOKES_MAX_TOKENS", "150"))
+CAPTION_MODEL = "llama-3.1-8b-instant"
+CAPTION_FALLBACK_MODELS = model_list(os.getenv("CAPTIONS_FALLBACK_MODELS", "gemma2-9b-it"))
+CAPTION_TEMPERATURE = 0.6
+CAPTION_MAX_TOKENS = int(os.getenv("CAPTIONS_MAX_TOKENS", "150"))
+
+MOCK_JOKE = "Why did the AI go to therapy? Because it had too many deep learning issues! 🤖"
+MOCK_CAPTION = "Living my best life! ✨ #vibes #lifestyle"
+
+# Served while the Groq circuit is open
+CANNED_JOKES = [
+    MOCK_JOKE,
+    "I asked the dictionary for a synonym of 'thesaurus'. It's still looking. 📚",
+    "Why don't servers ever get lonely? They always have plenty of requests! 🖥️",
+    "Parallel lines have so much in common. It's a shame they'll never meet. 📐",
+]
+CANNED_CAPTIONS = [
+    MOCK_CAPTION,
+    "Good times and tan lines ☀️",
+    "Making memories one moment at a time 📸",
+    "Collect moments, not things ✨",
+]
+# Upstream statuses that let /define fall back to a stale definition
+STALE_IF_ERROR_STATUSES = {429, 500, 502, 503, 504}
+
+# Successfully parsed definitions, keyed by normalized text + model + temperature
+definition_cache = TTLCache(
+    ttl=DEFINITION_CACHE_TTL_SECONDS,
+    max_entries=DEFINITION_CACHE_MAX_ENTRIES,
+    max_bytes=DEFINITION_CACHE_MAX_BYTES,
+    sizeof=lambda definition: len(definition.model_dump_json()),
+)
+definition_flight = SingleFlight()
+register_cache_metrics("definition", definition_cache)
+# Parsed definitions persisted across restarts and shared between workers;
+# opened in lifespan
+definition_store: Optional[DefinitionStore] = None
+# Normalized texts with a known definition, for near-duplicate matching
+fuzzy_index = FuzzyIndex()
+register_flight_metrics("definition", definition_flight)
+
+# Per-user usage for quotas and billing, written in batches off the request path
+usage_recorder = UsageRecorder(lambda events: write_to_supabase(get_supabase(), events))
+register_usage_metrics(usage_recorder)
 
 @app.get("/")
 async def root():
     return {"message": "AI Dictionary API", "version": "1.0.0"}
 
+def json_outline(model: Type[BaseModel], exclude: Sequence[str] = ()) -> str:
+    """
+    Compact JSON outline of a model for prompts, with each field's
+    description (or its type) standing in for the value
+    """
+    def value(annotation, description: Optional[str]) -> str:
+        if get_origin(annotation) is list:
+            return "[" + value(get_args(annotation)[0], None) + "]"
+        if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+            return json_outline(annotation)
+        return json.dumps(description or annotation.__name__)
+
+    return "{" + ",".join(
+        f'"{name}":{value(field.annotation, field.description)}'
+        for name, field in model.model_fields.items()
+        if name not in exclude
+    ) + "}"
+
+DEFINITION_OUTLINE = json_outline(DefinitionResponse, exclude=("stale",))
+
+def definition_messages(text: str) -> List[dict]:
+    return [
+        {
+            "role": "system",
+            "content": f"You are a dictionary. Reply with one minified JSON object only: {DEFINITION_OUTLINE}"
+        },
+        {
+            "role": "user",
+            "content": f'Define "{text}": 2-3 examples, 3-5 synonyms.'
+        }
+    ]
+
+# What produces a definition; precomputed ones are only served while it matches
+DEFINITION_SOURCE = {
+    "model": DEFINE_MODEL,
+    "temperature": DEFINE_TEMPERATURE,
+    "prompt": prompt_fingerprint(definition_messages("{text}")),
+}
+# Read-only precomputed definitions for common words, checked before anything else
+vocab_index = open_vocab_index(DefinitionResponse.model_validate_json, DEFINITION_SOURCE)
+
+def joke_messages(prompt: str) -> List[dict]:
+    return [
+        {
+            "role": "system",
+            "content": "You are a funny comedian. Reply with one short joke only."
+        },
+        {
+            "role": "user",
+            "content": f"Joke about: {prompt}"
+        }
+    ]
+
+def caption_messages(prompt: str) -> List[dict]:
+    return [
+        {
+            "role": "system",
+            "content": "You are a social media expert. Reply with one engaging Instagram caption with relevant hashtags, nothing else."
+        },
+        {
+            "role": "user",
+            "content": f"Caption for: {prompt}"
+        }
+    ]
+
+def parse_definition(text: str, response_text: str) -> Tuple[DefinitionResponse, bool]:
+    """
+    Parse a completion into a DefinitionResponse.
+    Returns (definition, parsed). parsed is False when the definition is
+    incomplete (only some fields could be salvaged) or the free-text
+    fallback; such results are served but not cached.
+    """
+    with STAGE_SECONDS.time(stage="parse"):
+        definition, result = _parse_definition(text, response_text)
+    DEFINITION_PARSE_RESULTS.inc(result=result)
+    return definition, result in ("ok", "recovered")
+
+def _parse_definition(text: str, response_text: str) -> Tuple[DefinitionResponse, str]:
+    response_text = response_text.strip()
+    try:
+        return DefinitionResponse.model_validate_json(response_text), "ok"
+    except ValueError:
+        pass
+    # Fenced, wrapped in prose or cut off by the token limit: take the
+    # object apart member by member and keep whatever validates
+    parser = IncrementalObjectParser()
+    parser.feed(response_text)
+    data = parser.recover()
+    try:
+        return DefinitionResponse.model_validate(data), "recovered"
+    except ValueError:
+        pass
+    if isinstance(data.get("definition"), str) and data["definition"].strip():
+        return DefinitionResponse(
+            word=data["word"] if isinstance(data.get("word"), str) else text,
+            part_of_speech=data["part_of_speech"] if isinstance(data.get("part_of_speech"), str) else "unknown",
+            definition=data["definition"],
+            examples=_valid_items(Example, data.get("examples")),
+            synonyms=_valid_items(Synonym, data.get("synonyms")),
+            confidence=_number(data.get("confidence"), 0.7),
+        ), "partial"
+    logger.warning("Definition JSON parsing failed, using fallback", extra={"response_length": len(response_text)})
+    return DefinitionResponse(
+        word=text,
+        part_of_speech="unknown",
+        definition=response_text,
+        examples=[],
+        synonyms=[],
+        confidence=0.7
+    ), "fallback"
+
+def _number(value, default: float) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+def _valid_items(model: Type[BaseModel], items) -> list:
+    valid = []
+    for item in items if isinstance(items, list) else []:
+        try:
+            valid.append(model.model_validate(item))
+        except ValueError:
+            pass
+    return valid
+
+def remember_definition(cache_key, definition: DefinitionResponse) -> None:
+    """
+    Store a successfully parsed definition in memory and in the persistent store
+    """
+    definition_cache.set(cache_key, definition)
+    fuzzy_index.add(cache_key[0])
+    if definition_store is not None:
+        definition_store.put(cache_key, definition.model_dump_json())
+
+async def request_definition(text: str, endpoint: str = "define") -> Tuple[DefinitionResponse, bool]:
+    """
+    Ask Groq for a definition of text and parse it into a DefinitionResponse;
+    also returns whether it parsed (False for a fallback)
+    """
+    # Make API call to Groq
+    try:
+        chat_completion = await complete(
+            groq_client,
+            endpoint=endpoint,
+            messages=definition_messages(text),
+            model=DEFINE_MODEL,
+            fallback_models=DEFINE_FALLBACK_MODELS,
+            temperature=DEFINE_TEMPERATURE,
+            max_tokens=DEFINE_MAX_TOKENS,
+            json_mode=DEFINE_JSON_MODE,
+        )
+        response_text = chat_completion.choices[0].message.content.strip()
+    except HTTPException:
+        raise
+    except BadRequestError as groq_error:
+        # JSON mode refused output that isn't valid JSON; salvage it instead
+        response_text = failed_generation(groq_error)
+        if response_text is None:
+            logger.error("Groq API error", extra={"endpoint": endpoint, "error_type": type(groq_error).__name__, "error": str(groq_error)})
+            raise HTTPException(
+                status_code=500,
+                detail=f"Groq API error: {str(groq_error)}"
+            )
+    except RateLimitError as groq_error:
+        logger.warning("Groq rate limit", extra={"endpoint": endpoint})
+        retry_after = groq_error.response.headers.get("retry-after")
+        raise HTTPException(
+            status_code=429,
+            detail="Groq API rate limit reached, try again shortly",
+            headers={"Retry-After": retry_after} if retry_after else None,
+        )
+    except Exception as groq_error:
+        logger.error("Groq API error", extra={"endpoint": endpoint, "error_type": type(groq_error).__name__, "error": str(groq_error)})
+        raise HTTPException(
+            status_code=500,
+            detail=f"Groq API error: {str(groq_error)}"
+        )
+    
+    # Parse the response
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Groq response received", extra={"endpoint": "define", "response_length": len(response_text)})
+    
+    return parse_definition(text, response_text)
+
+async def generate_definition(text: str, cache_key, endpoint: str = "define") -> DefinitionResponse:
+    """
+    Definition of text from Groq. Successfully parsed results are stored in
+    the definition cache.
+    """
+    definition, parsed = await request_definition(text, endpoint)
+    if parsed:
+        remember_definition(cache_key, definition)
+    return definition
+
+def local_definition(text: str, cache_key) -> Optional[DefinitionResponse]:
+    """
+    Definition available without I/O: the core-vocabulary index, then the memory cache
+    """
+    if vocab_index is not None:
+        definition = vocab_index.get(text)
+        if definition is not None:
+            return definition
+    return definition_cache.get(cache_key)
+
+def for_input(definition: Optional[DefinitionResponse], text: str) -> Optional[DefinitionResponse]:
+    """
+    A shared definition with ``word`` set to what this caller typed
+    """
+    word = text.strip()
+    if definition is None or definition.word == word:
+        return definition
+    return definition.model_copy(update={"word": word})
+
+async def fuzzy_definition(normalized: str) -> Optional[DefinitionResponse]:
+    """
+    Definition of a known near-duplicate of normalized text (another
+    inflection, or a close typo), if one is confident enough
+    """
+    match = fuzzy_index.match(normalized)
+    if match is None:
+        return None
+    term, kind, similarity = match
+    term_key = definition_cache_key(term, DEFINE_MODEL, DEFINE_TEMPERATURE)
+    definition = local_definition(term, term_key)
+    if definition is None and definition_store is not None:
+        definition = await definition_store.get(term_key)
+    if definition is None:
+        # Expired everywhere since it was indexed
+        fuzzy_index.discard(term)
+        return None
+    FUZZY_MATCHES.inc(kind=kind)
+    logger.debug("Fuzzy definition match", extra={"kind": kind, "similarity": round(similarity, 3)})
+    return definition
+
+@timed(STAGE_SECONDS, stage="definition_lookup")
+async def known_definition(text: str, cache_key) -> Tuple[Optional[DefinitionResponse], bool]:
+    """
+    Definition for text that needs no completion: the exact key in the
+    index, memory cache or store, then a near-duplicate of a known entry.
+    Also returns whether it was an exact hit; a near-duplicate's definition
+    is a guess and must not be cached as this text's own.
+    """
+    cached = local_definition(text, cache_key)
+    if cached is not None:
+        return cached, True
+    
+    if definition_store is not None:
+        stored = await definition_store.get(cache_key)
+        if stored is not None:
+            definition_cache.set(cache_key, stored)
+            fuzzy_index.add(cache_key[0])
+            return stored, True
+    
+    if FUZZY_MATCH_ENABLED:
+        return await fuzzy_definition(cache_key[0]), False
+    return None, False
+
+async def stale_definition(cache_key) -> Optional[DefinitionResponse]:
+    """
+    Expired definition for the key from the memory cache or the store,
+    marked stale, for when Groq can't produce a fresh one
+    """
+    definition = definition_cache.get_stale(cache_key)
+    if definition is None and definition_store is not None:
+        definition = await definition_store.get_stale(cache_key)
+    if definition is None:
+        return None
+    return definition.model_copy(update={"stale": True})
+
+async def resolve_definition(text: str) -> Tuple[DefinitionResponse, bool]:
+    """
+    Definition for text from the caches, or from Groq on a miss, and
+    whether it is a validated, current result for this exact text (False
+    for a near-duplicate's definition or an unparsed or stale fallback). Concurrent lookups for the same normalized text share
+    one completion. When Groq is failing or its circuit is open, an
+    expired definition is served instead of the error if there is one.
+    """
+    cache_key = definition_cache_key(text, DEFINE_MODEL, DEFINE_TEMPERATURE)
+    prefetcher.record_lookup(cache_key)
+    definition, exact = await known_definition(text, cache_key)
+    if definition is not None:
+        return for_input(definition, text), exact
+    try:
+        definition = await definition_flight.do(
+            cache_key, lambda: generate_definition(text, cache_key)
+        )
+    except HTTPException as e:
+        if e.status_code not in STALE_IF_ERROR_STATUSES:
+            raise
+        stale = await stale_definition(cache_key)
+        if stale is None:
+            raise
+        DEGRADED_RESPONSES.inc(endpoint="define", kind="stale")
+        return for_input(stale, text), False
+    return for_input(definition, text), local_definition(text, cache_key) is not None
+
+async def lookup_definition(text: str) -> DefinitionResponse:
+    definition, _ = await resolve_definition(text)
+    return definition
+
+async def prefetch_definition(text: str) -> bool:
+    """
+    Background definition for the prefetcher; False when already known
+    """
+    cache_key = definition_cache_key(text, DEFINE_MODEL, DEFINE_TEMPERATURE)
+    definition, _ = await known_definition(text, cache_key)
+    if definition is not None:
+        return False
+    await definition_flight.do(
+        cache_key, lambda: generate_definition(text, cache_key, endpoint="prefetch")
+    )
+    return True
+
+prefetcher = Prefetcher(
+    prefetch_definition,
+    key=lambda text: definition_cache_key(text, DEFINE_MODEL, DEFINE_TEMPERATURE),
+)
+register_prefetch_metrics(prefetcher)
+
+def queue_synonym_prefetch(definition: DefinitionResponse) -> None:
+    """
+    Queue the synonyms of a fresh definition, most similar first, since
+    users often look one of them up next
+    """
+    if not PREFETCH_ENABLED or groq_client is None:
+        return
+    ranked = sorted(
+        (SIMILARITY_RANK.get(synonym.similarity, len(SIMILARITY_RANK)), synonym.word)
+        for synonym in definition.synonyms
+        if synonym.word.strip()
+    )
+    prefetcher.submit(ranked[:PREFETCH_PER_DEFINITION])
+
 @app.post("/define", response_model=DefinitionResponse)
 async def define_text(
     request: DefinitionRequest,
@@ -143,120 +680,150 @@ async def define_text(
     Get definition and meaning of the provided text using Groq LLM.
     Requires authentication.
     """
-    print(f"=== /define ENDPOINT DEBUG ===")
-    print(f"Request received: {request.text}")
-    print(f"Use mock: {request.use_mock}")
-    print(f"Current user: {current_user.email}")
-    print(f"Groq client available: {'YES' if groq_client else 'NO'}")
-    
     try:
-        # Feature usage logging removed for lean schema
+        usage_recorder.record(current_user.id, "define")
         
         # Return mock response if requested or if Groq client is not available
         if request.use_mock or groq_client is None:
-            if groq_client is None and not request.use_mock:
-                print("Using mock response because GROQ_API_KEY is not configured")
-            print("Returning mock response")
             mock_response = MOCK_RESPONSE.model_copy()
             mock_response.word = request.text
             return mock_response
         
-        # Prepare prompt for Groq
-        print("Preparing Groq API call...")
-        prompt = f"""
-        Define the following text/phrase: "{request.text}"
-        
-        Provide a comprehensive definition including:
-        1. The main definition/meaning
-        2. Part of speech (if applicable)
-        3. 2-3 example sentences showing usage
-        4. 3-5 synonyms with similarity levels
-        5. A confidence score (0-1) for your definition
-        
-        Format your response as JSON with the following structure:
-        {{
-            "word": "{request.text}",
-            "part_of_speech": "noun/verb/adjective/phrase/etc",
-            "definition": "Clear, concise definition",
-            "examples": [
-                {{"sentence": "Example sentence", "context": "Brief context"}},
-                {{"sentence": "Another example", "context": "Brief context"}}
-            ],
-            "synonyms": [
-                {{"word": "synonym1", "similarity": "high/medium/low"}},
-                {{"word": "synonym2", "similarity": "high/medium/low"}}
-            ],
-            "confidence": 0.9
-        }}
-        """
-        
-        # Make API call to Groq
-        try:
-            print("Making Groq API call...")
-            chat_completion = groq_client.chat.completions.create(
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a helpful dictionary assistant. Provide accurate, concise definitions in the exact JSON format requested. Always respond with valid JSON only."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                model="llama-3.1-8b-instant",
-                temperature=0.3,
-                max_tokens=1000,
-            )
-            print("Groq API call successful")
-        except Exception as groq_error:
-            print(f"Groq API error: {groq_error}")
-            print(f"Error type: {type(groq_error).__name__}")
-            raise HTTPException(
-                status_code=500,
-                detail=f"Groq API error: {str(groq_error)}"
-            )
-        
-        # Parse the response
-        print("Parsing Groq response...")
-        response_text = chat_completion.choices[0].message.content.strip()
-        print(f"Response length: {len(response_text)}")
-        print(f"Response preview: {response_text[:100]}...")
-        
-        # Try to extract JSON from the response
-        import json
-        try:
-            # Remove any markdown formatting
-            if response_text.startswith("```json"):
-                response_text = response_text[7:]
-            if response_text.endswith("```"):
-                response_text = response_text[:-3]
-            
-            response_data = json.loads(response_text)
-            print("JSON parsing successful")
-            return DefinitionResponse(**response_data)
-        except (json.JSONDecodeError, ValueError) as e:
-            print(f"JSON parsing error: {e}")
-            # Fallback response if JSON parsing fails
-            print("Using fallback response due to JSON parsing error")
-            return DefinitionResponse(
-                word=request.text,
-                part_of_speech="unknown",
-                definition=response_text,
-                examples=[],
-                synonyms=[],
-                confidence=0.7
-            )
+        definition = await lookup_definition(request.text)
+        queue_synonym_prefetch(definition)
+        return definition
     
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Unexpected error in /define endpoint: {e}")
-        print(f"Error type: {type(e).__name__}")
-        print(f"Error details: {str(e)}")
+        logger.exception("Unexpected error in /define endpoint")
         raise HTTPException(
             status_code=500,
             detail=f"Error processing definition request: {str(e)}"
         )
 
+@app.get("/definitions/{text:path}", response_model=DefinitionResponse)
+async def get_definition(
+    request: Request,
+    text: Annotated[str, Path(min_length=1, max_length=500)],
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Cacheable definition lookup with one canonical URL per normalized text.
+
+    Other spellings of the same text redirect to the canonical URL so
+    browsers and CDNs share one entry. The body never depends on the
+    caller, so it is marked public with an ETag (If-None-Match gets a 304)
+    and stale-while-revalidate; unvalidated fallbacks are not stored.
+    The token is still checked whenever a request reaches this worker.
+    """
+    canonical = normalize_text(text)
+    if text != canonical:
+        # url_for leaves "?", "#" and "%" in the text unescaped
+        url = f"{request.scope.get('root_path', '')}/definitions/{quote(canonical, safe='')}"
+        return RedirectResponse(url, status_code=308, headers={"Cache-Control": public_cache_control()})
+    
+    usage_recorder.record(current_user.id, "define")
+    try:
+        if groq_client is None:
+            definition, durable = MOCK_RESPONSE.model_copy(update={"word": canonical}), False
+        else:
+            definition, durable = await resolve_definition(canonical)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("Unexpected error in /definitions endpoint")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error processing definition request: {str(e)}"
+        )
+    
+    queue_synonym_prefetch(definition)
+    return cacheable_response(
+        request,
+        definition.model_dump_json().encode(),
+        public_cache_control() if durable else NO_STORE,
+    )
+
+async def batch_definition_items(request: BatchDefinitionRequest) -> AsyncIterator[BatchDefinitionItem]:
+    """
+    Resolve every text in the batch, yielding items as they finish.
+
+    Inputs are deduplicated by normalized text, cached definitions are
+    yielded first, and the rest go to Groq with at most
+    DEFINE_BATCH_CONCURRENCY completions in flight for this batch.
+    """
+    if request.use_mock or groq_client is None:
+        for index, text in enumerate(request.texts):
+            mock_response = MOCK_RESPONSE.model_copy()
+            mock_response.word = text
+            yield BatchDefinitionItem(index=index, text=text, definition=mock_response)
+        return
+    
+    # normalized key -> indices of every input sharing it
+    groups: Dict[tuple, List[int]] = {}
+    for index, text in enumerate(request.texts):
+        key = definition_cache_key(text, DEFINE_MODEL, DEFINE_TEMPERATURE)
+        groups.setdefault(key, []).append(index)
+    
+    pending = []
+    for key, indices in groups.items():
+        cached = local_definition(request.texts[indices[0]], key)
+        if cached is None:
+            pending.append(indices)
+            continue
+        for index in indices:
+            text = request.texts[index]
+            yield BatchDefinitionItem(index=index, text=text, definition=for_input(cached, text))
+    
+    semaphore = asyncio.Semaphore(DEFINE_BATCH_CONCURRENCY)
+    
+    async def resolve(indices: List[int]):
+        text = request.texts[indices[0]]
+        async with semaphore:
+            try:
+                return indices, await lookup_definition(text), None
+            except HTTPException as e:
+                return indices, None, str(e.detail)
+            except Exception as e:
+                return indices, None, f"Error processing definition request: {str(e)}"
+    
+    tasks = [asyncio.ensure_future(resolve(indices)) for indices in pending]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            indices, definition, error = await finished
+            for index in indices:
+                text = request.texts[index]
+                yield BatchDefinitionItem(
+                    index=index, text=text, definition=for_input(definition, text), error=error
+                )
+    finally:
+        for task in tasks:
+            task.cancel()
+
+@app.post("/define/batch", response_model=BatchDefinitionResponse)
+async def define_batch(
+    request: BatchDefinitionRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Define many texts in one authenticated request.
+    Errors are reported per item. With stream=true, items are sent as
+    NDJSON lines in completion order; otherwise they are returned in
+    input order once all are done.
+    """
+    usage_recorder.record(current_user.id, "define", quantity=len(request.texts))
+    if request.stream:
+        async def ndjson_lines():
+            async for item in batch_definition_items(request):
+                yield item.model_dump_json() + "\n"
+        
+        return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+    
+    results = [item async for item in batch_definition_items(request)]
+    results.sort(key=lambda item: item.index)
+    return BatchDefinitionResponse(results=results)
+
 @app.post("/jokes/generate")
 async def generate_joke(
     request: JokeRequest,
@@ -266,57 +833,43 @@ async def generate_joke(
     Generate jokes using Groq LLM.
     Requires active subscription.
     """
-    print(f"=== /jokes/generate ENDPOINT DEBUG ===")
-    print(f"Request received: {request.prompt}")
-    print(f"Current user: {current_user.email}")
-    print(f"Groq client available: {'YES' if groq_client else 'NO'}")
-    
     try:
-        # Feature usage logging removed for lean schema
+        usage_recorder.record(current_user.id, "jokes")
         
         if groq_client is None:
-            print("Groq client not available, returning mock joke")
-            return {"joke": "Why did the AI go to therapy? Because it had too many deep learning issues! 🤖"}
-        
-        # Generate joke using Groq
-        print("Preparing Groq API call for joke generation...")
-        prompt = f"Generate a funny joke based on: {request.prompt}"
+            return {"joke": MOCK_JOKE}
         
         try:
-            print("Making Groq API call for joke...")
-            chat_completion = groq_client.chat.completions.create(
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a funny comedian. Generate humorous jokes based on the given prompt."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                model="llama-3.1-8b-instant",
-                temperature=0.7,
-                max_tokens=200,
+            chat_completion = await complete(
+                groq_client,
+                endpoint="jokes",
+                messages=joke_messages(request.prompt),
+                model=JOKE_MODEL,
+                fallback_models=JOKE_FALLBACK_MODELS,
+                temperature=JOKE_TEMPERATURE,
+                max_tokens=JOKE_MAX_TOKENS,
             )
-            print("Groq API call for joke successful")
+        except CircuitOpen:
+            DEGRADED_RESPONSES.inc(endpoint="jokes", kind="canned")
+            return {"joke": random.choice(CANNED_JOKES), "fallback": True}
+        except HTTPException:
+            raise
         except Exception as groq_error:
-            print(f"Groq API error for joke: {groq_error}")
-            print(f"Error type: {type(groq_error).__name__}")
+            logger.error("Groq API error", extra={"endpoint": "jokes", "error_type": type(groq_error).__name__, "error": str(groq_error)})
             raise HTTPException(
                 status_code=500,
                 detail=f"Groq API error: {str(groq_error)}"
             )
         
         joke = chat_completion.choices[0].message.content.strip()
-        print(f"Generated joke length: {len(joke)}")
-        print(f"Generated joke: {joke}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Joke generated", extra={"response_length": len(joke)})
         return {"joke": joke}
         
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Unexpected error in /jokes/generate endpoint: {e}")
-        print(f"Error type: {type(e).__name__}")
-        print(f"Error details: {str(e)}")
+        logger.exception("Unexpected error in /jokes/generate endpoint")
         raise HTTPException(
             status_code=500,
             detail=f"Error generating joke: {str(e)}"
@@ -332,43 +885,267 @@ async def generate_caption(
     Requires active subscription.
     """
     try:
-        # Feature usage logging removed for lean schema
+        usage_recorder.record(current_user.id, "captions")
         
         if groq_client is None:
-            return {"caption": "Living my best life! ✨ #vibes #lifestyle"}
-        
-        # Generate caption using Groq
-        prompt = f"Generate an engaging Instagram caption for: {request.prompt}"
+            return {"caption": MOCK_CAPTION}
         
-        chat_completion = groq_client.chat.completions.create(
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a social media expert. Generate engaging Instagram captions with relevant hashtags."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            model="llama-3.1-8b-instant",
-            temperature=0.6,
-            max_tokens=300,
-        )
+        try:
+            chat_completion = await complete(
+                groq_client,
+                endpoint="captions",
+                messages=caption_messages(request.prompt),
+                model=CAPTION_MODEL,
+                fallback_models=CAPTION_FALLBACK_MODELS,
+                temperature=CAPTION_TEMPERATURE,
+                max_tokens=CAPTION_MAX_TOKENS,
+            )
+        except CircuitOpen:
+            DEGRADED_RESPONSES.inc(endpoint="captions", kind="canned")
+            return {"caption": random.choice(CANNED_CAPTIONS), "fallback": True}
         
         caption = chat_completion.choices[0].message.content.strip()
         return {"caption": caption}
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Error generating caption: {str(e)}"
         )
 
+async def stream_definition_events(text: str) -> AsyncIterator[str]:
+    """
+    SSE events for a streamed definition: one ``field`` event per top-level
+    field as soon as it is complete (definition arrives before examples and
+    synonyms), then a ``definition`` event with the validated response.
+    """
+    cache_key = definition_cache_key(text, DEFINE_MODEL, DEFINE_TEMPERATURE)
+    prefetcher.record_lookup(cache_key)
+    cached, _ = await known_definition(text, cache_key)
+    cached = for_input(cached, text)
+    if cached is not None:
+        for name, value in cached.model_dump().items():
+            yield sse_event("field", {"name": name, "value": value})
+        yield sse_event("definition", cached.model_dump())
+        queue_synonym_prefetch(cached)
+        return
+    
+    parser = IncrementalObjectParser()
+    fields_sent = False
+    try:
+        async for delta in stream_completion(
+            groq_client,
+            endpoint="define",
+            messages=definition_messages(text),
+            model=DEFINE_MODEL,
+            fallback_models=DEFINE_FALLBACK_MODELS,
+            temperature=DEFINE_TEMPERATURE,
+            max_tokens=DEFINE_MAX_TOKENS,
+        ):
+            for name, value in parser.feed(delta):
+                if name == "word":
+                    # What the caller typed, as /define and the cached path report it
+                    value = text.strip()
+                fields_sent = True
+                yield sse_event("field", {"name": name, "value": value})
+    except HTTPException as e:
+        stale = None
+        if not fields_sent and e.status_code in STALE_IF_ERROR_STATUSES:
+            stale = for_input(await stale_definition(cache_key), text)
+        if stale is None:
+            yield sse_event("error", {"detail": e.detail})
+            return
+        DEGRADED_RESPONSES.inc(endpoint="define", kind="stale")
+        for name, value in stale.model_dump().items():
+            yield sse_event("field", {"name": name, "value": value})
+        yield sse_event("definition", stale.model_dump())
+        return
+    except Exception as e:
+        yield sse_event("error", {"detail": f"Groq API error: {str(e)}"})
+        return
+    
+    definition, parsed = parse_definition(text, parser.buffer)
+    if parsed:
+        remember_definition(cache_key, definition)
+        queue_synonym_prefetch(definition)
+    yield sse_event("definition", for_input(definition, text).model_dump())
+
+@app.post("/define/stream")
+async def define_text_stream(
+    request: DefinitionRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Streaming variant of /define using Server-Sent Events.
+    Requires authentication.
+    """
+    usage_recorder.record(current_user.id, "define")
+    if request.use_mock or groq_client is None:
+        mock_response = MOCK_RESPONSE.model_copy()
+        mock_response.word = request.text
+        
+        async def mock_events():
+            yield sse_event("definition", mock_response.model_dump())
+        
+        return sse_response(mock_events())
+    
+    return sse_response(stream_definition_events(request.text))
+
+@app.post("/jokes/generate/stream")
+async def generate_joke_stream(
+    request: JokeRequest,
+    current_user: User = Depends(require_subscription)
+):
+    """
+    Streaming variant of /jokes/generate using Server-Sent Events.
+    Requires active subscription.
+    """
+    usage_recorder.record(current_user.id, "jokes")
+    if groq_client is None:
+        return sse_response(stream_text_events(mock_deltas(MOCK_JOKE), "joke"))
+    if not groq_circuit.allows_calls():
+        DEGRADED_RESPONSES.inc(endpoint="jokes", kind="canned")
+        return sse_response(stream_text_events(mock_deltas(random.choice(CANNED_JOKES)), "joke"))
+    
+    deltas = stream_completion(
+        groq_client,
+        endpoint="jokes",
+        messages=joke_messages(request.prompt),
+        model=JOKE_MODEL,
+        fallback_models=JOKE_FALLBACK_MODELS,
+        temperature=JOKE_TEMPERATURE,
+        max_tokens=JOKE_MAX_TOKENS,
+    )
+    return sse_response(stream_text_events(deltas, "joke"))
+
+@app.post("/captions/generate/stream")
+async def generate_caption_stream(
+    request: CaptionRequest,
+    current_user: User = Depends(require_subscription)
+):
+    """
+    Streaming variant of /captions/generate using Server-Sent Events.
+    Requires active subscription.
+    """
+    usage_recorder.record(current_user.id, "captions")
+    if groq_client is None:
+        return sse_response(stream_text_events(mock_deltas(MOCK_CAPTION), "caption"))
+    if not groq_circuit.allows_calls():
+        DEGRADED_RESPONSES.inc(endpoint="captions", kind="canned")
+        return sse_response(stream_text_events(mock_deltas(random.choice(CANNED_CAPTIONS)), "caption"))
+    
+    deltas = stream_completion(
+        groq_client,
+        endpoint="captions",
+        messages=caption_messages(request.prompt),
+        model=CAPTION_MODEL,
+        fallback_models=CAPTION_FALLBACK_MODELS,
+        temperature=CAPTION_TEMPERATURE,
+        max_tokens=CAPTION_MAX_TOKENS,
+    )
+    return sse_response(stream_text_events(deltas, "caption"))
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics(authorization: Optional[str] = Header(default=None)):
+    """
+    Prometheus-format metrics. Requires METRICS_TOKEN as a bearer token when set.
+    """
+    if METRICS_TOKEN and authorization != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+async def require_admin(authorization: Optional[str] = Header(default=None)) -> None:
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not secrets.compare_digest(authorization or "", f"Bearer {ADMIN_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+@app.post("/admin/profile", include_in_schema=False, dependencies=[Depends(require_admin)])
+async def admin_profile(seconds: float = 10.0, interval_ms: float = 10.0, mode: str = "threads"):
+    """
+    Sample this worker's stacks for a window and return them in collapsed
+    (flamegraph.pl / speedscope) format. ``threads`` shows where threads,
+    the event loop included, spend wall time; ``tasks`` shows what
+    suspended asyncio tasks are awaiting; ``all`` combines both. Only the
+    worker that serves the request is profiled.
+    """
+    if mode not in PROFILE_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(PROFILE_MODES)}")
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be in (0, {PROFILE_MAX_SECONDS:g}]")
+    if profiler.running:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    interval = max(interval_ms / 1000, PROFILE_MIN_INTERVAL_SECONDS)
+    try:
+        stacks, rounds = await asyncio.to_thread(
+            profiler.run, seconds, interval, mode, asyncio.get_running_loop()
+        )
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    logger.info("Profile taken", extra={"mode": mode, "seconds": seconds, "samples": rounds, "stacks": len(stacks)})
+    return PlainTextResponse(
+        collapsed(stacks),
+        headers={"X-Profile-Samples": str(rounds), "Cache-Control": NO_STORE},
+    )
+
+@app.get("/admin/slow-requests", include_in_schema=False, dependencies=[Depends(require_admin)])
+async def admin_slow_requests(limit: int = 50):
+    """
+    Latest requests over SLOW_REQUEST_THRESHOLD_MS with their stage timings, newest first
+    """
+    return JSONResponse(
+        {
+            "threshold_ms": slow_requests.threshold * 1000,
+            "capacity": slow_requests.entries.maxlen,
+            "requests": slow_requests.recent(limit),
+        },
+        headers={"Cache-Control": NO_STORE},
+    )
+
+@app.post("/admin/identities/{user_id}/invalidate", include_in_schema=False, dependencies=[Depends(require_admin)])
+async def admin_invalidate_identity(user_id: str):
+    """
+    Hook for whatever changes a subscription or profile (billing or
+    database webhook): drops the user's cached plan on every worker
+    """
+    await asyncio.to_thread(invalidate_identity, user_id)
+    return JSONResponse({"invalidated": user_id}, headers={"Cache-Control": NO_STORE})
+
 @app.get("/health")
 async def health_check():
+    """
+    Liveness only: the process is up and serving. See /ready for dependencies.
+    """
     return {"status": "healthy", "service": "AI Dictionary API"}
 
+async def check_groq() -> None:
+    if groq_client is None:
+        raise RuntimeError("GROQ_API_KEY not configured; serving mock responses")
+    if groq_circuit.state != "closed":
+        raise RuntimeError(f"Circuit {groq_circuit.state}; serving stale and canned responses")
+
+async def check_definition_store() -> None:
+    if definition_store is None:
+        raise RuntimeError("Definition store disabled")
+    await asyncio.to_thread(definition_store.ping)
+
+readiness.add("supabase", lambda: asyncio.to_thread(check_supabase))
+readiness.add("groq", check_groq, optional=True)
+readiness.add("definition_store", check_definition_store, optional=True)
+
+@app.get("/ready")
+async def ready_check():
+    """
+    Readiness: dependency health from the latest background check.
+    Returns 503 until every required dependency has passed.
+    """
+    report = readiness.report()
+    return JSONResponse(report, status_code=200 if report["status"] == "ready" else 503)
+
+startup_timeline.mark("imported")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
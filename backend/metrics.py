@@ -0,0 +1,251 @@
+# Minimal in-process metrics with Prometheus text exposition
+import bisect
+import functools
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+_registry: List["_Metric"] = []
+
+
+def _format_labels(labelnames: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [
+        f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for name, value in zip(labelnames, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> Iterable[str]:
+        for key, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [per-bucket counts..., +Inf count], sum
+        self._counts: Dict[Tuple[str, ...], List[int]] = {}
+        self._sums: Dict[Tuple[str, ...], float] = {}
+        self._listeners: List[Callable[[float, Dict[str, str]], None]] = []
+
+    def add_listener(self, listener: Callable[[float, Dict[str, str]], None]) -> None:
+        """
+        Also pass every observation (value, labels) to listener
+        """
+        self._listeners.append(listener)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        counts = self._counts.get(key)
+        if counts is None:
+            counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+            self._sums[key] = 0.0
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._sums[key] += value
+        for listener in self._listeners:
+            listener(value, labels)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> Iterable[str]:
+        for key, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(self._sums[key])}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class CallbackMetric(_Metric):
+    """
+    Metric whose samples are read at scrape time, for state that already
+    lives elsewhere (cache counters, queue depths). ``collect`` returns
+    (label values, value) pairs in labelnames order.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        type: str,
+        collect: Callable[[], Iterable[Tuple[Sequence[str], float]]],
+        labelnames: Sequence[str] = (),
+    ):
+        super().__init__(name, help, labelnames)
+        self.type = type
+        self._collect = collect
+
+    def samples(self) -> Iterable[str]:
+        for key, value in self._collect():
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+def render_prometheus() -> str:
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+def timed(histogram: Histogram, **labels):
+    """
+    Decorator recording the duration of an async function, including
+    failures. Keeps the signature visible to FastAPI's dependency injection.
+    """
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with histogram.time(**labels):
+                return await fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+# Shared application metrics
+STAGE_SECONDS = Histogram(
+    "stage_duration_seconds",
+    "Time spent in each request stage",
+    ["stage"],
+)
+LLM_REQUEST_SECONDS = Histogram(
+    "llm_request_duration_seconds",
+    "Duration of Groq chat completion calls",
+    ["endpoint", "model", "outcome"],
+)
+LLM_TOKENS = Counter(
+    "llm_tokens_total",
+    "Tokens reported by Groq usage",
+    ["endpoint", "model", "kind"],
+)
+LLM_TRUNCATED = Counter(
+    "llm_truncated_completions_total",
+    "Completions cut off by their max_tokens budget",
+    ["endpoint"],
+)
+LLM_CANCELLED_CALLS = Counter(
+    "llm_cancelled_calls_total",
+    "Completions abandoned because the client left or the deadline passed, by stage reached",
+    ["endpoint", "reason", "stage"],
+)
+LLM_SAVED_TOKENS = Counter(
+    "llm_saved_tokens_total",
+    "Estimated tokens not spent thanks to cancelled completions",
+    ["endpoint"],
+)
+DEFINITION_PARSE_RESULTS = Counter(
+    "definition_parse_total",
+    "Outcome of parsing /define completions: ok, recovered (complete after tolerant extraction), partial (some fields salvaged) or fallback (free text)",
+    ["result"],
+)
+DEGRADED_RESPONSES = Counter(
+    "degraded_responses_total",
+    "Responses served without a completion because Groq was failing (stale definition or canned text)",
+    ["endpoint", "kind"],
+)
+
+
+_caches: List[Tuple[str, object]] = []
+_flights: List[Tuple[str, object]] = []
+
+
+def register_cache_metrics(name: str, cache) -> None:
+    """
+    Expose a TTLCache's counters and size under cache="name"
+    """
+    _caches.append((name, cache))
+
+
+def register_flight_metrics(name: str, flight) -> None:
+    """
+    Expose a SingleFlight's leader/coalesced/abandoned counts under flight="name"
+    """
+    _flights.append((name, flight))
+
+
+def _stats_collector(sources: List[Tuple[str, object]], field: str):
+    return lambda: [((name,), source.stats()[field]) for name, source in sources]
+
+
+for _name, _field, _type, _help in (
+    ("cache_hits_total", "hits", "counter", "Cache lookups that found a live entry"),
+    ("cache_misses_total", "misses", "counter", "Cache lookups that found nothing"),
+    ("cache_evictions_total", "evictions", "counter", "Entries evicted to respect size limits"),
+    ("cache_entries", "entries", "gauge", "Entries currently cached"),
+    ("cache_bytes", "bytes", "gauge", "Approximate bytes currently cached"),
+    ("cache_hit_rate", "hit_rate", "gauge", "Hits divided by lookups since start"),
+):
+    CallbackMetric(_name, _help, _type, _stats_collector(_caches, _field), ["cache"])
+
+for _name, _field, _type, _help in (
+    ("singleflight_leaders_total", "leaders", "counter", "Calls that started the shared work"),
+    ("singleflight_coalesced_total", "coalesced", "counter", "Calls that joined work already in flight"),
+    ("singleflight_in_flight", "in_flight", "gauge", "Shared calls currently running"),
+    ("singleflight_abandoned_total", "abandoned", "counter", "Shared calls cancelled because every caller went away"),
+):
+    CallbackMetric(_name, _help, _type, _stats_collector(_flights, _field), ["flight"])
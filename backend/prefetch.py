@@ -0,0 +1,210 @@
+# Speculative background definitions for words users are likely to look up next
+import asyncio
+import itertools
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Hashable, Iterable, Optional, Tuple
+
+from fastapi import HTTPException
+
+from backend.llm import free_slots
+from backend.scheduler import BACKGROUND, current_caller
+from backend.metrics import CallbackMetric, Counter
+
+logger = logging.getLogger("backend.prefetch")
+
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "false").lower() in ("1", "true", "yes")
+# Synonyms queued per definition, best-ranked first
+PREFETCH_PER_DEFINITION = int(os.getenv("PREFETCH_PER_DEFINITION", "3"))
+PREFETCH_QUEUE_SIZE = int(os.getenv("PREFETCH_QUEUE_SIZE", "200"))
+# Token bucket shared by all prefetches in this worker
+PREFETCH_RATE_PER_MINUTE = float(os.getenv("PREFETCH_RATE_PER_MINUTE", "30"))
+PREFETCH_BURST = int(os.getenv("PREFETCH_BURST", "5"))
+# Completion slots that must stay free for foreground requests
+PREFETCH_RESERVED_SLOTS = int(os.getenv("PREFETCH_RESERVED_SLOTS", "8"))
+# Pause after the upstream signals overload (429/503/504) without a Retry-After
+PREFETCH_BACKOFF_SECONDS = float(os.getenv("PREFETCH_BACKOFF_SECONDS", "30"))
+# How long a prefetched entry is remembered for hit accounting
+PREFETCH_TRACK_ENTRIES = 10000
+_IDLE_POLL_SECONDS = 0.25
+
+SIMILARITY_RANK = {"high": 0, "medium": 1, "low": 2}
+
+PREFETCH_EVENTS = Counter(
+    "definition_prefetch_total",
+    "Synonym prefetch pipeline events by result",
+    ["result"],
+)
+PREFETCH_HITS = Counter(
+    "definition_prefetch_hits_total",
+    "Foreground lookups served by an entry that was prefetched",
+)
+
+
+class Prefetcher:
+    """
+    Low-priority queue of texts to define ahead of demand.
+
+    ``submit`` never blocks: texts are ranked, deduplicated and dropped when
+    the queue is full. One background task works through the queue, but
+    only while the token bucket allows it and at least ``reserved_slots``
+    completion slots are free, and it backs off when the upstream reports
+    rate limiting. ``define`` returns True when it made a completion,
+    False when the text turned out to be known already.
+    """
+
+    def __init__(
+        self,
+        define: Callable[[str], Awaitable[bool]],
+        key: Callable[[str], Hashable],
+        rate_per_minute: float = PREFETCH_RATE_PER_MINUTE,
+        burst: int = PREFETCH_BURST,
+        reserved_slots: int = PREFETCH_RESERVED_SLOTS,
+        queue_size: int = PREFETCH_QUEUE_SIZE,
+    ):
+        self._define = define
+        self._key = key
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.reserved_slots = reserved_slots
+        self._tokens = float(burst)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._queue: "asyncio.PriorityQueue[Tuple[int, int, str]]" = asyncio.PriorityQueue(maxsize=queue_size)
+        self._queued = set()
+        self._order = itertools.count()
+        # Keys defined by prefetching that no foreground lookup has used yet
+        self._prefetched: "OrderedDict[Hashable, None]" = OrderedDict()
+        self._task: Optional[asyncio.Task] = None
+        self.defined = 0
+        self.hits = 0
+
+    def submit(self, texts: Iterable[Tuple[int, str]]) -> None:
+        """
+        Queue (rank, text) pairs; a lower rank is defined sooner
+        """
+        for rank, text in texts:
+            key = self._key(text)
+            if key in self._queued or key in self._prefetched:
+                continue
+            try:
+                self._queue.put_nowait((rank, next(self._order), text))
+            except asyncio.QueueFull:
+                PREFETCH_EVENTS.inc(result="dropped")
+                continue
+            self._queued.add(key)
+            PREFETCH_EVENTS.inc(result="queued")
+
+    def record_lookup(self, key: Hashable) -> None:
+        """
+        Count a foreground lookup; the first one for a prefetched key is a hit
+        """
+        if key in self._prefetched:
+            del self._prefetched[key]
+            self.hits += 1
+            PREFETCH_HITS.inc()
+
+    def hit_ratio(self) -> float:
+        return self.hits / self.defined if self.defined else 0.0
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _take_token(self) -> float:
+        """
+        Consume a token, or return how long to wait for one
+        """
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate if self.rate > 0 else PREFETCH_BACKOFF_SECONDS
+
+    async def _wait_for_budget(self) -> None:
+        while True:
+            paused = self._paused_until - time.monotonic()
+            if paused > 0:
+                await asyncio.sleep(paused)
+                continue
+            if free_slots() < self.reserved_slots:
+                await asyncio.sleep(_IDLE_POLL_SECONDS)
+                continue
+            wait = self._take_token()
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def _back_off(self, error: HTTPException) -> None:
+        retry_after = (error.headers or {}).get("Retry-After")
+        try:
+            delay = float(retry_after) if retry_after else PREFETCH_BACKOFF_SECONDS
+        except ValueError:
+            delay = PREFETCH_BACKOFF_SECONDS
+        self._paused_until = time.monotonic() + delay
+        PREFETCH_EVENTS.inc(result="rate_limited")
+        logger.info("Prefetch paused after upstream overload", extra={"status": error.status_code, "seconds": delay})
+
+    async def _run(self) -> None:
+        # Lowest priority: admitted only when nobody else is waiting
+        current_caller.set(BACKGROUND)
+        while True:
+            _, _, text = await self._queue.get()
+            key = self._key(text)
+            self._queued.discard(key)
+            await self._wait_for_budget()
+            try:
+                made_completion = await self._define(text)
+            except asyncio.CancelledError:
+                raise
+            except HTTPException as e:
+                if e.status_code in (429, 503, 504):
+                    self._back_off(e)
+                else:
+                    PREFETCH_EVENTS.inc(result="failed")
+                continue
+            except Exception as e:
+                PREFETCH_EVENTS.inc(result="failed")
+                logger.warning("Prefetch failed", extra={"error_type": type(e).__name__, "error": str(e)})
+                continue
+            if not made_completion:
+                # Known already; give the unused token back
+                self._tokens = min(self.burst, self._tokens + 1)
+                PREFETCH_EVENTS.inc(result="known")
+                continue
+            self.defined += 1
+            PREFETCH_EVENTS.inc(result="defined")
+            self._prefetched[key] = None
+            while len(self._prefetched) > PREFETCH_TRACK_ENTRIES:
+                self._prefetched.popitem(last=False)
+
+
+def register_prefetch_metrics(prefetcher: Prefetcher) -> None:
+    CallbackMetric(
+        "definition_prefetch_hit_ratio",
+        "Prefetched definitions later requested, divided by definitions prefetched",
+        "gauge",
+        lambda: [((), prefetcher.hit_ratio())],
+    )
+    CallbackMetric(
+        "definition_prefetch_queue_depth",
+        "Texts waiting to be prefetched",
+        "gauge",
+        lambda: [((), prefetcher.queue_depth())],
+    )
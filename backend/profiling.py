@@ -0,0 +1,234 @@
+# On-demand sampling profiler and capture of slow requests' stage timings
+import asyncio
+import contextvars
+import os
+import sys
+import sysconfig
+import threading
+import time
+from collections import Counter as Tally, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from backend.logging_setup import request_id_var
+
+# Requests slower than this keep their per-stage breakdown; 0 disables capture
+SLOW_REQUEST_THRESHOLD_MS = float(os.getenv("SLOW_REQUEST_THRESHOLD_MS", "1000"))
+SLOW_REQUEST_BUFFER_SIZE = int(os.getenv("SLOW_REQUEST_BUFFER_SIZE", "200"))
+PROFILE_MAX_SECONDS = 60.0
+PROFILE_MIN_INTERVAL_SECONDS = 0.001
+PROFILE_MODES = ("threads", "tasks", "all")
+# Streamed bodies are judged by time to first byte, not by how long they stream
+_STREAMING_TYPES = (b"text/event-stream", b"application/x-ndjson")
+
+_CWD = os.getcwd() + os.sep
+_STDLIB = sysconfig.get_paths()["stdlib"] + os.sep
+
+
+def _frame_label(code, labels: Dict[Any, str]) -> str:
+    label = labels.get(code)
+    if label is None:
+        path = code.co_filename
+        if path.startswith(_CWD):
+            path = path[len(_CWD):]
+        elif "site-packages" + os.sep in path:
+            path = path.split("site-packages" + os.sep, 1)[1]
+        elif path.startswith(_STDLIB):
+            path = path[len(_STDLIB):]
+        label = labels[code] = f"{code.co_name} ({path}:{code.co_firstlineno})"
+    return label
+
+
+def _thread_stack(frame, labels: Dict[Any, str]) -> List[str]:
+    stack = []
+    while frame is not None:
+        stack.append(_frame_label(frame.f_code, labels))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+def _task_stack(task: asyncio.Task, labels: Dict[Any, str]) -> List[str]:
+    """
+    Where a suspended task is awaiting: its coroutine chain, outermost first
+    """
+    stack = []
+    awaitable = task.get_coro()
+    while awaitable is not None:
+        frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "ag_frame", None) or getattr(awaitable, "gi_frame", None)
+        if frame is None:
+            if not hasattr(awaitable, "cr_code"):
+                # A future or other leaf the chain is waiting on
+                stack.append(f"<{type(awaitable).__name__}>")
+            break
+        stack.append(_frame_label(frame.f_code, labels))
+        awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "ag_await", None) or getattr(awaitable, "gi_yieldfrom", None)
+    return stack
+
+
+class SamplingProfiler:
+    """
+    Wall-clock sampler for the whole worker, run only on demand.
+
+    Every ``interval`` it records the stack of each thread (where CPU time
+    goes, including the event loop thread, which shows as sitting in the
+    selector when idle) and/or of each suspended asyncio task (where await
+    time goes). Nothing is installed between runs, so it costs nothing
+    while idle. Results are counts of identical stacks, rendered in the
+    collapsed "frame;frame;frame count" format read by flamegraph.pl,
+    speedscope and similar tools.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    def run(self, seconds: float, interval: float, mode: str, loop: Optional[asyncio.AbstractEventLoop]) -> Tuple[Tally, int]:
+        """
+        Sample for ``seconds`` from the calling (non-loop) thread; returns
+        the stack counts and the number of sampling rounds
+        """
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("A profile is already running")
+        try:
+            stacks: Tally = Tally()
+            labels: Dict[Any, str] = {}
+            own_thread = threading.get_ident()
+            rounds = 0
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                if mode in ("threads", "all"):
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                    for ident, frame in sys._current_frames().items():
+                        if ident == own_thread:
+                            continue
+                        root = f"thread:{names.get(ident, ident)}"
+                        stacks[";".join([root, *_thread_stack(frame, labels)])] += 1
+                if mode in ("tasks", "all") and loop is not None:
+                    try:
+                        tasks = list(asyncio.all_tasks(loop))
+                    except RuntimeError:
+                        # The task set changed while we copied it; skip this round
+                        tasks = []
+                    for task in tasks:
+                        stack = _task_stack(task, labels)
+                        if stack:
+                            stacks[";".join([f"task:{task.get_name()}", *stack])] += 1
+                rounds += 1
+                time.sleep(interval)
+            return stacks, rounds
+        finally:
+            self._lock.release()
+
+
+def collapsed(stacks: Tally) -> str:
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+class RequestTrace:
+    """
+    Stage timings recorded during one request
+    """
+
+    __slots__ = ("started", "stages")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: List[Tuple[str, float, float]] = []
+
+    def add(self, stage: str, seconds: float) -> None:
+        end = time.perf_counter() - self.started
+        self.stages.append((stage, end - seconds, seconds))
+
+
+current_trace: contextvars.ContextVar[Optional[RequestTrace]] = contextvars.ContextVar("current_trace", default=None)
+
+
+def trace_listener(*label_names: str, prefix: str = ""):
+    """
+    Histogram listener adding each observation to the current request's
+    trace, named by the given labels' values; a no-op outside traced requests
+    """
+
+    def listener(value: float, labels: Dict[str, str]) -> None:
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add(prefix + ":".join(str(labels.get(name, "")) for name in label_names), value)
+
+    return listener
+
+
+class SlowRequestLog:
+    """
+    Ring buffer of the last ``capacity`` requests that took at least
+    ``threshold_ms``, with their stage breakdown
+    """
+
+    def __init__(self, threshold_ms: float = SLOW_REQUEST_THRESHOLD_MS, capacity: int = SLOW_REQUEST_BUFFER_SIZE):
+        self.threshold = threshold_ms / 1000
+        self.entries: Deque[Dict[str, Any]] = deque(maxlen=capacity)
+
+    def recent(self, limit: int) -> List[Dict[str, Any]]:
+        """
+        The latest slow requests, newest first
+        """
+        return list(self.entries)[-limit:][::-1] if limit > 0 else []
+
+
+class SlowRequestMiddleware:
+    """
+    Pure-ASGI middleware giving each request a ``RequestTrace`` for the
+    stage histograms to report into. Requests at or above the log's
+    threshold (time to first byte for streamed responses) are added to
+    it; the rest are discarded, so the steady-state cost is one small
+    object per request.
+    """
+
+    def __init__(self, app, log: SlowRequestLog):
+        self.app = app
+        self.log = log
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.log.threshold <= 0:
+            await self.app(scope, receive, send)
+            return
+        trace = RequestTrace()
+        token = current_trace.set(trace)
+        status_code = None
+        first_byte = None
+        streaming = False
+
+        async def traced_send(message):
+            nonlocal status_code, first_byte, streaming
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                for name, value in message.get("headers", ()):
+                    if name.lower() == b"content-type" and value.startswith(_STREAMING_TYPES):
+                        streaming = True
+            elif message["type"] == "http.response.body" and first_byte is None:
+                first_byte = time.perf_counter() - trace.started
+            await send(message)
+
+        try:
+            await self.app(scope, receive, traced_send)
+        finally:
+            current_trace.reset(token)
+            duration = time.perf_counter() - trace.started
+            measured = first_byte if streaming and first_byte is not None else duration
+            if measured >= self.log.threshold:
+                self.log.entries.append({
+                    "at": time.time(),
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "status": status_code,
+                    "request_id": request_id_var.get(),
+                    "duration_ms": round(duration * 1000, 1),
+                    "first_byte_ms": None if first_byte is None else round(first_byte * 1000, 1),
+                    "streaming": streaming,
+                    "stages": [
+                        {"stage": stage, "start_ms": round(start * 1000, 1), "duration_ms": round(seconds * 1000, 1)}
+                        for stage, start, seconds in sorted(trace.stages, key=lambda item: item[1])
+                    ],
+                })
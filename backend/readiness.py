@@ -0,0 +1,143 @@
+# Readiness checks run in the background, and startup timing
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from backend.metrics import CallbackMetric
+
+logger = logging.getLogger("backend.readiness")
+
+READINESS_INTERVAL_SECONDS = float(os.getenv("READINESS_INTERVAL_SECONDS", "30"))
+READINESS_CHECK_TIMEOUT_SECONDS = float(os.getenv("READINESS_CHECK_TIMEOUT_SECONDS", "5"))
+
+
+class ReadinessChecker:
+    """
+    Runs every registered dependency check on an interval and keeps the
+    latest results, so /ready answers from memory instead of probing
+    dependencies on each request. A check is a coroutine function that
+    raises when the dependency is unhealthy. Optional checks are reported
+    but don't make the service unready.
+    """
+
+    def __init__(self, interval: float = READINESS_INTERVAL_SECONDS, timeout: float = READINESS_CHECK_TIMEOUT_SECONDS):
+        self.interval = interval
+        self.timeout = timeout
+        self._checks: Dict[str, Callable[[], Awaitable[Any]]] = {}
+        self._optional: set = set()
+        self.results: Dict[str, Dict[str, Any]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, name: str, check: Callable[[], Awaitable[Any]], optional: bool = False) -> None:
+        self._checks[name] = check
+        if optional:
+            self._optional.add(name)
+
+    async def _run_check(self, name: str, check: Callable[[], Awaitable[Any]]) -> None:
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(check(), timeout=self.timeout)
+            result: Dict[str, Any] = {"ok": True}
+        except asyncio.TimeoutError:
+            result = {"ok": False, "error": f"timed out after {self.timeout:g}s"}
+        except Exception as e:
+            result = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+        result["latency_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        result["checked_at"] = time.time()
+        previous = self.results.get(name)
+        if previous is not None and previous["ok"] != result["ok"]:
+            log = logger.info if result["ok"] else logger.warning
+            log("Dependency readiness changed", extra={"dependency": name, **result})
+        self.results[name] = result
+
+    async def check_all(self) -> None:
+        await asyncio.gather(*(self._run_check(name, check) for name, check in self._checks.items()))
+
+    async def _loop(self) -> None:
+        while True:
+            await self.check_all()
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def ready(self) -> bool:
+        """
+        True once every required check has run and its latest result passed
+        """
+        return all(
+            name in self.results and self.results[name]["ok"]
+            for name in self._checks
+            if name not in self._optional
+        )
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "status": "ready" if self.ready() else "not_ready",
+            "checks": {
+                name: {**self.results.get(name, {"ok": False, "error": "not checked yet"}), "optional": name in self._optional}
+                for name in self._checks
+            },
+        }
+
+
+class StartupTimeline:
+    """
+    Seconds from the start of the app import to each startup milestone
+    (imported, lifespan started/finished, first request served)
+    """
+
+    def __init__(self, origin: Optional[float] = None):
+        self.origin = time.monotonic() if origin is None else origin
+        self.marks: Dict[str, float] = {}
+
+    def mark(self, name: str) -> None:
+        if name not in self.marks:
+            self.marks[name] = time.monotonic() - self.origin
+
+    def register_metrics(self) -> None:
+        CallbackMetric(
+            "app_startup_seconds",
+            "Seconds from app import start to each startup milestone",
+            "gauge",
+            lambda: [((name,), round(seconds, 4)) for name, seconds in self.marks.items()],
+            ["milestone"],
+        )
+
+
+class FirstRequestMiddleware:
+    """
+    Pure-ASGI middleware that records when the first HTTP request finishes
+    """
+
+    def __init__(self, app, timeline: StartupTimeline):
+        self.app = app
+        self.timeline = timeline
+        self._seen = False
+
+    async def __call__(self, scope, receive, send):
+        if self._seen or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            if not self._seen:
+                self._seen = True
+                self.timeline.mark("first_request")
+                logger.info(
+                    "First request served",
+                    extra={"path": scope.get("path"), **{f"{name}_seconds": round(value, 3) for name, value in self.timeline.marks.items()}},
+                )
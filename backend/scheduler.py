@@ -0,0 +1,329 @@
+# Admission control and prioritized dispatch of Groq calls
+import asyncio
+import contextvars
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, NamedTuple, Optional
+
+from fastapi import HTTPException, status
+
+from backend.metrics import CallbackMetric, Counter, Histogram
+
+# Account-wide Groq quotas as seen by this worker; 0 disables that bucket
+GROQ_REQUESTS_PER_MINUTE = float(os.getenv("GROQ_REQUESTS_PER_MINUTE", "0"))
+GROQ_TOKENS_PER_MINUTE = float(os.getenv("GROQ_TOKENS_PER_MINUTE", "0"))
+# Assumed call duration until real calls have been timed
+INITIAL_SERVICE_SECONDS = 1.0
+
+
+class TierLimits(NamedTuple):
+    priority: int
+    # Longest a request may queue before it is shed with 429
+    max_wait: float
+    max_queue: int
+
+
+# Subscription plans (subscription_plans.name, casefolded) plus the
+# implicit free tier and background work such as prefetching
+TIERS: Dict[str, TierLimits] = {
+    "pro": TierLimits(priority=0, max_wait=20.0, max_queue=500),
+    "premium": TierLimits(priority=1, max_wait=15.0, max_queue=500),
+    "basic": TierLimits(priority=2, max_wait=8.0, max_queue=300),
+    "free": TierLimits(priority=3, max_wait=4.0, max_queue=200),
+    "background": TierLimits(priority=4, max_wait=0.0, max_queue=0),
+}
+_BY_PRIORITY = sorted(TIERS, key=lambda tier: TIERS[tier].priority)
+
+
+class Caller(NamedTuple):
+    user_id: Optional[str]
+    tier: str
+
+
+ANONYMOUS = Caller(user_id=None, tier="free")
+BACKGROUND = Caller(user_id=None, tier="background")
+
+# Set by the auth dependencies; completions are scheduled for this caller
+current_caller: contextvars.ContextVar[Caller] = contextvars.ContextVar("current_caller", default=ANONYMOUS)
+
+
+def tier_for_plan(plan: Optional[str]) -> str:
+    tier = (plan or "").casefold()
+    return tier if tier in TIERS and tier != "background" else "free"
+
+
+LLM_QUEUE_WAIT_SECONDS = Histogram(
+    "llm_queue_wait_seconds",
+    "Time completions spent queued for a Groq slot, by tier",
+    ["tier"],
+)
+LLM_ADMISSIONS = Counter(
+    "llm_admissions_total",
+    "Completion admission decisions by tier: immediate, queued, shed or expired",
+    ["tier", "result"],
+)
+
+
+class TokenBucket:
+    """
+    Per-minute quota refilled continuously; capacity is one minute's worth
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.tokens = per_minute
+        self._updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def time_until(self, amount: float) -> float:
+        self._refill()
+        deficit = amount - self.tokens
+        return max(0.0, deficit / self.rate)
+
+    def take(self, amount: float) -> None:
+        self._refill()
+        self.tokens -= amount
+
+    def give_back(self, amount: float) -> None:
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class _Waiter(NamedTuple):
+    future: asyncio.Future
+    tokens: int
+    tier: str
+    enqueued_at: float
+
+
+class Grant:
+    """
+    A held slot; ``settle`` reports the tokens the call really used
+    """
+
+    def __init__(self, scheduler: "LLMScheduler", tokens: int):
+        self._scheduler = scheduler
+        self.tokens = tokens
+        self.started_at = time.monotonic()
+
+    def settle(self, used_tokens: int) -> None:
+        bucket = self._scheduler.token_bucket
+        if bucket is not None:
+            if used_tokens < self.tokens:
+                bucket.give_back(self.tokens - used_tokens)
+            else:
+                bucket.take(used_tokens - self.tokens)
+        self.tokens = used_tokens
+
+
+class LLMScheduler:
+    """
+    Gatekeeper for every Groq call in this worker.
+
+    A call needs a concurrency slot plus room in the request and token
+    buckets. When it can't start at once it joins its tier's queue; tiers
+    are served in strict priority order and, within a tier, users take
+    turns so one heavy user can't starve the rest. A request whose
+    estimated wait exceeds its tier's ``max_wait`` (or whose queue is full)
+    is rejected immediately with 429 and a Retry-After hint rather than
+    left to time out.
+    """
+
+    def __init__(self, max_concurrency: int, requests_per_minute: float = 0, tokens_per_minute: float = 0):
+        self.max_concurrency = max_concurrency
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self.active = 0
+        # tier -> user -> that user's waiters, users in round-robin order
+        self._queues: Dict[str, "OrderedDict[Optional[str], Deque[_Waiter]]"] = {tier: OrderedDict() for tier in TIERS}
+        self._depths: Dict[str, int] = {tier: 0 for tier in TIERS}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._service_seconds = INITIAL_SERVICE_SECONDS
+        self._paused_until = 0.0
+
+    # Introspection
+
+    def depth(self, tier: str) -> int:
+        return self._depths[tier]
+
+    def free_slots(self) -> int:
+        if any(self._depths.values()):
+            return 0
+        return max(0, self.max_concurrency - self.active)
+
+    def _budget_wait(self, requests: int, tokens: int) -> float:
+        wait = max(0.0, self._paused_until - time.monotonic())
+        if self.request_bucket is not None:
+            wait = max(wait, self.request_bucket.time_until(requests))
+        if self.token_bucket is not None:
+            wait = max(wait, self.token_bucket.time_until(tokens))
+        return wait
+
+    def estimate_wait(self, tier: str, tokens: int) -> float:
+        """
+        Rough time until a new request of this tier would start
+        """
+        priority = TIERS[tier].priority
+        ahead = sum(self._depths[t] for t in _BY_PRIORITY if TIERS[t].priority <= priority)
+        ahead_tokens = tokens + sum(
+            waiter.tokens
+            for t in _BY_PRIORITY if TIERS[t].priority <= priority
+            for waiters in self._queues[t].values()
+            for waiter in waiters
+        )
+        wait = self._budget_wait(ahead + 1, ahead_tokens)
+        blocked = ahead + 1 - max(0, self.max_concurrency - self.active)
+        if blocked > 0:
+            wait = max(wait, math.ceil(blocked / self.max_concurrency) * self._service_seconds)
+        return wait
+
+    # Acquire / release
+
+    def _shed(self, tier: str, retry_after: float, result: str) -> HTTPException:
+        LLM_ADMISSIONS.inc(tier=tier, result=result)
+        return HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="The service is busy, please retry shortly",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+    def _start(self, tokens: int) -> Grant:
+        if self.request_bucket is not None:
+            self.request_bucket.take(1)
+        if self.token_bucket is not None:
+            self.token_bucket.take(tokens)
+        self.active += 1
+        return Grant(self, tokens)
+
+    async def acquire(self, tokens: int, caller: Optional[Caller] = None) -> Grant:
+        caller = caller or current_caller.get()
+        tier = caller.tier
+        limits = TIERS[tier]
+        if self.token_bucket is not None:
+            # A single call larger than a minute's quota still has to fit eventually
+            tokens = min(tokens, int(self.token_bucket.capacity))
+
+        if self.free_slots() > 0 and self._budget_wait(1, tokens) == 0:
+            LLM_ADMISSIONS.inc(tier=tier, result="immediate")
+            LLM_QUEUE_WAIT_SECONDS.observe(0.0, tier=tier)
+            return self._start(tokens)
+
+        estimate = self.estimate_wait(tier, tokens)
+        if estimate > limits.max_wait or self._depths[tier] >= limits.max_queue:
+            raise self._shed(tier, estimate, "shed")
+
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(loop.create_future(), tokens, tier, time.monotonic())
+        self._queues[tier].setdefault(caller.user_id, deque()).append(waiter)
+        self._depths[tier] += 1
+        LLM_ADMISSIONS.inc(tier=tier, result="queued")
+        self._schedule(0)
+        try:
+            return await asyncio.wait_for(asyncio.shield(waiter.future), timeout=limits.max_wait)
+        except asyncio.TimeoutError:
+            if self._discard(caller.user_id, waiter):
+                raise self._shed(tier, self.estimate_wait(tier, tokens), "expired")
+            # Granted just as the wait ran out
+            return waiter.future.result()
+        except asyncio.CancelledError:
+            if not self._discard(caller.user_id, waiter) and not waiter.future.cancelled():
+                # Granted, but the caller went away before using it
+                self.release(waiter.future.result())
+            raise
+
+    def release(self, grant: Grant) -> None:
+        self.active -= 1
+        elapsed = time.monotonic() - grant.started_at
+        self._service_seconds = 0.8 * self._service_seconds + 0.2 * elapsed
+        self._schedule(0)
+
+    def pause(self, seconds: float) -> None:
+        """
+        The upstream rate-limited us: stop granting for a while
+        """
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    # Dispatch
+
+    def _discard(self, user_id: Optional[str], waiter: _Waiter) -> bool:
+        """
+        Remove a still-queued waiter; False if it was already dispatched
+        """
+        waiters = self._queues[waiter.tier].get(user_id)
+        if waiters is None or waiter not in waiters:
+            return False
+        waiters.remove(waiter)
+        if not waiters:
+            del self._queues[waiter.tier][user_id]
+        self._depths[waiter.tier] -= 1
+        waiter.future.cancel()
+        self._schedule(0)
+        return True
+
+    def _next_waiter(self) -> Optional[_Waiter]:
+        for tier in _BY_PRIORITY:
+            users = self._queues[tier]
+            if users:
+                return next(iter(users.values()))[0]
+        return None
+
+    def _pop_waiter(self, waiter: _Waiter) -> None:
+        users = self._queues[waiter.tier]
+        user_id, waiters = next(iter(users.items()))
+        waiters.popleft()
+        del users[user_id]
+        if waiters:
+            # Back of the line, so the next user in this tier goes first
+            users[user_id] = waiters
+        self._depths[waiter.tier] -= 1
+
+    def _schedule(self, delay: float) -> None:
+        loop = asyncio.get_running_loop()
+        if delay > 0:
+            # Budget-limited: one timer is enough, anything sooner re-checks anyway
+            if self._timer is None:
+                self._timer = loop.call_later(delay, self._dispatch)
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        loop.call_soon(self._dispatch)
+
+    def _dispatch(self) -> None:
+        self._timer = None
+        while self.active < self.max_concurrency:
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+            wait = self._budget_wait(1, waiter.tokens)
+            if wait > 0:
+                self._schedule(wait)
+                return
+            self._pop_waiter(waiter)
+            if waiter.future.done():
+                continue
+            LLM_QUEUE_WAIT_SECONDS.observe(time.monotonic() - waiter.enqueued_at, tier=waiter.tier)
+            waiter.future.set_result(self._start(waiter.tokens))
+
+
+def register_scheduler_metrics(scheduler: LLMScheduler) -> None:
+    CallbackMetric(
+        "llm_queue_depth",
+        "Completions waiting for a Groq slot, by tier",
+        "gauge",
+        lambda: [((tier,), scheduler.depth(tier)) for tier in _BY_PRIORITY],
+        ["tier"],
+    )
+    CallbackMetric(
+        "llm_active_calls",
+        "Groq calls currently holding a slot",
+        "gauge",
+        lambda: [((), scheduler.active)],
+    )
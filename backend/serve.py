@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Production entry point: preforked uvicorn workers sharing one socket.
+
+    python -m backend.serve --port $PORT
+
+The supervisor binds the listening socket, imports the app once (so the
+workers share its memory copy-on-write) and forks the workers. It
+replaces workers that exit, including those recycled after
+--max-requests. On SIGTERM or SIGINT every worker stops accepting
+connections, finishes the requests it has in flight (streams and LLM
+calls included) for up to --graceful-timeout seconds, and runs the app's
+shutdown (usage flush, pool close) before exiting.
+"""
+import argparse
+import gc
+import importlib.util
+import logging
+import os
+import random
+import signal
+import socket
+import sys
+import time
+from typing import Dict, Optional
+
+import uvicorn
+
+from backend.logging_setup import configure_logging, shutdown_logging
+
+logger = logging.getLogger("backend.serve")
+
+APP = "backend.main:app"
+# Workers; defaults to the cores this process may use (CPU affinity and cgroup quota)
+WEB_CONCURRENCY = os.getenv("WEB_CONCURRENCY")
+# A worker is replaced after this many requests (plus up to the jitter); 0 never
+SERVE_MAX_REQUESTS = int(os.getenv("SERVE_MAX_REQUESTS", "10000"))
+SERVE_MAX_REQUESTS_JITTER = int(os.getenv("SERVE_MAX_REQUESTS_JITTER", "1000"))
+# How long a stopping worker may spend finishing in-flight requests; keep
+# above the longest endpoint timeout and below the platform's kill delay
+SERVE_GRACEFUL_TIMEOUT_SECONDS = int(os.getenv("SERVE_GRACEFUL_TIMEOUT_SECONDS", "25"))
+SERVE_PRELOAD = os.getenv("SERVE_PRELOAD", "true").lower() in ("1", "true", "yes")
+# A worker exiting sooner than this after starting counts as a crash
+MIN_WORKER_LIFETIME_SECONDS = 5.0
+MAX_CONSECUTIVE_CRASHES = 5
+
+
+def available_cpus() -> int:
+    """
+    Cores usable by this process: CPU affinity, capped by a cgroup CPU quota
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota: Optional[float] = None
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            limit, period = f.read().split()
+            if limit != "max":
+                quota = int(limit) / int(period)
+    except (OSError, ValueError):
+        try:
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                limit = int(f.read())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period = int(f.read())
+            if limit > 0:
+                quota = limit / period
+        except (OSError, ValueError):
+            pass
+    if quota is not None:
+        cpus = min(cpus, max(1, int(quota)))
+    return max(1, cpus)
+
+
+def default_workers() -> int:
+    # Workers are async and mostly wait on Groq, so one per core saturates
+    # the CPU; more would only split the in-process caches further
+    return int(WEB_CONCURRENCY) if WEB_CONCURRENCY else available_cpus()
+
+
+def event_loop() -> str:
+    return "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+
+
+def http_parser() -> str:
+    return "httptools" if importlib.util.find_spec("httptools") else "h11"
+
+
+def bind(host: str, port: int, backlog: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+class Supervisor:
+    """
+    Forks ``workers`` uvicorn servers on ``sock`` and keeps that many running
+    until told to stop, then waits for them to drain
+    """
+
+    def __init__(self, sock: socket.socket, app, workers: int, args: argparse.Namespace):
+        self.sock = sock
+        self.app = app
+        self.workers = workers
+        self.args = args
+        self.children: Dict[int, float] = {}
+        self.stopping = False
+        self.crashes = 0
+
+    def run(self) -> int:
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        for _ in range(self.workers):
+            self._spawn()
+        while not self.stopping:
+            self._reap()
+            if self.crashes >= MAX_CONSECUTIVE_CRASHES:
+                logger.error("Workers keep crashing at startup, giving up", extra={"crashes": self.crashes})
+                self.stopping = True
+                break
+            while len(self.children) < self.workers and not self.stopping:
+                self._spawn()
+            time.sleep(0.2)
+        return self._drain()
+
+    def _handle_stop(self, signum, frame) -> None:
+        if not self.stopping:
+            logger.info("Stopping workers", extra={"signal": signal.Signals(signum).name, "workers": len(self.children)})
+        self.stopping = True
+
+    def _spawn(self) -> None:
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                code = self._run_worker()
+            except BaseException:
+                logger.exception("Worker failed")
+            finally:
+                # Skips the supervisor's atexit hooks, so flush logs first
+                shutdown_logging()
+                os._exit(code)
+        self.children[pid] = time.monotonic()
+
+    def _run_worker(self) -> int:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        max_requests = None
+        if self.args.max_requests > 0:
+            max_requests = self.args.max_requests + random.randint(0, max(0, self.args.max_requests_jitter))
+        config = uvicorn.Config(
+            self.app,
+            loop=event_loop(),
+            http=http_parser(),
+            log_level=self.args.log_level,
+            access_log=self.args.access_log,
+            proxy_headers=True,
+            forwarded_allow_ips=self.args.forwarded_allow_ips,
+            backlog=self.args.backlog,
+            limit_max_requests=max_requests,
+            timeout_keep_alive=self.args.keep_alive,
+            timeout_graceful_shutdown=self.args.graceful_timeout,
+        )
+        server = uvicorn.Server(config)
+        server.run(sockets=[self.sock])
+        return 0 if server.started else 3
+
+    def _reap(self) -> None:
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.children.clear()
+                return
+            if pid == 0:
+                return
+            started = self.children.pop(pid, None)
+            if started is None:
+                continue
+            code = os.waitstatus_to_exitcode(status)
+            lifetime = time.monotonic() - started
+            if code != 0 and lifetime < MIN_WORKER_LIFETIME_SECONDS:
+                self.crashes += 1
+            else:
+                self.crashes = 0
+            if not self.stopping:
+                # Exit code 0 is a worker recycled after max requests
+                log = logger.info if code == 0 else logger.warning
+                log("Worker exited, replacing it", extra={"pid": pid, "exit_code": code, "lifetime_seconds": round(lifetime, 1)})
+
+    def _drain(self) -> int:
+        # Refuse new connections instead of queueing them where no worker accepts
+        self.sock.close()
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        # Workers bound their own drain; this only catches ones that hang
+        deadline = time.monotonic() + self.args.graceful_timeout + 5
+        while self.children and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        for pid in self.children:
+            logger.error("Worker did not drain in time, killing it", extra={"pid": pid})
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        for pid in list(self.children):
+            os.waitpid(pid, 0)
+        logger.info("All workers stopped")
+        return 1 if self.crashes >= MAX_CONSECUTIVE_CRASHES else 0
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=None, help="Default: WEB_CONCURRENCY, else the available cores")
+    parser.add_argument("--max-requests", type=int, default=SERVE_MAX_REQUESTS)
+    parser.add_argument("--max-requests-jitter", type=int, default=SERVE_MAX_REQUESTS_JITTER)
+    parser.add_argument("--graceful-timeout", type=int, default=SERVE_GRACEFUL_TIMEOUT_SECONDS)
+    parser.add_argument("--keep-alive", type=int, default=5, help="Idle keep-alive timeout in seconds")
+    parser.add_argument("--backlog", type=int, default=2048)
+    parser.add_argument("--no-preload", dest="preload", action="store_false", default=SERVE_PRELOAD,
+                        help="Import the app in each worker instead of once before forking")
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--no-access-log", dest="access_log", action="store_false")
+    parser.add_argument("--forwarded-allow-ips", default=os.getenv("FORWARDED_ALLOW_IPS", "*"))
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    configure_logging()
+    workers = args.workers or default_workers()
+    sock = bind(args.host, args.port, args.backlog)
+    app = APP
+    if args.preload:
+        from backend.main import app
+        # Keep the collector from touching (and so copying) preloaded objects in workers
+        gc.freeze()
+    logger.info(
+        "Starting workers",
+        extra={
+            "host": args.host,
+            "port": args.port,
+            "workers": workers,
+            "loop": event_loop(),
+            "http": http_parser(),
+            "preload": args.preload,
+            "max_requests": args.max_requests,
+            "graceful_timeout_seconds": args.graceful_timeout,
+        },
+    )
+    return Supervisor(sock, app, workers, args).run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
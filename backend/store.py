@@ -0,0 +1,290 @@
+# Persistent definition store shared across workers and restarts
+import asyncio
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, List, Optional, Tuple
+
+from backend.metrics import Counter
+
+logger = logging.getLogger("backend.store")
+
+# Empty path disables the store. On Render, point this at a persistent disk.
+DEFINITION_STORE_PATH = os.getenv("DEFINITION_STORE_PATH", "data/definitions.sqlite3")
+DEFINITION_STORE_TTL_SECONDS = float(os.getenv("DEFINITION_STORE_TTL_SECONDS", str(30 * 86400)))
+# Expired rows are kept this much longer, to be served stale while Groq is down
+DEFINITION_STORE_STALE_SECONDS = float(os.getenv("DEFINITION_STORE_STALE_SECONDS", str(7 * 86400)))
+DEFINITION_STORE_PRELOAD = int(os.getenv("DEFINITION_STORE_PRELOAD", "2000"))
+DEFINITION_STORE_CLEANUP_INTERVAL_SECONDS = float(os.getenv("DEFINITION_STORE_CLEANUP_INTERVAL_SECONDS", "3600"))
+WRITE_QUEUE_SIZE = 10000
+WRITE_BATCH_SIZE = 200
+
+STORE_OPERATIONS = Counter(
+    "definition_store_operations_total",
+    "Persistent definition store reads and writes by result",
+    ["op"],
+)
+
+Key = Tuple[str, str, float]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS definitions (
+    text TEXT NOT NULL,
+    model TEXT NOT NULL,
+    temperature REAL NOT NULL,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_hit_at REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (text, model, temperature)
+);
+CREATE INDEX IF NOT EXISTS idx_definitions_hits ON definitions (hits DESC, last_hit_at DESC);
+CREATE INDEX IF NOT EXISTS idx_definitions_created_at ON definitions (created_at);
+"""
+
+
+class DefinitionStore:
+    """
+    SQLite (WAL mode) store of parsed definitions keyed like the memory cache.
+
+    Any number of processes can read concurrently. Writes and hit-count
+    updates are queued and applied in batches by one background thread per
+    process, so the request path never waits on a write lock. Payloads are
+    stored as JSON and turned back into models by ``decode``.
+    """
+
+    def __init__(self, path: str, ttl: float, decode: Callable[[str], Any], stale_ttl: float = DEFINITION_STORE_STALE_SECONDS):
+        self.path = path
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._decode = decode
+        self._local = threading.local()
+        # Every thread's connection (writer, to_thread workers), closed by close()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._writes: "queue.Queue[Optional[tuple]]" = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        connection = self._connection()
+        connection.executescript(_SCHEMA)
+        self._writer = threading.Thread(target=self._write_loop, name="definition-store-writer", daemon=True)
+        self._writer.start()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # Only used by this thread, but closed by whichever thread runs close()
+            connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA busy_timeout=5000")
+            self._local.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    # Reads
+
+    def _get(self, key: Key, max_age: float) -> Optional[Any]:
+        row = self._connection().execute(
+            "SELECT payload FROM definitions "
+            "WHERE text = ? AND model = ? AND temperature = ? AND created_at > ?",
+            (*key, time.time() - max_age),
+        ).fetchone()
+        if row is None:
+            STORE_OPERATIONS.inc(op="miss")
+            return None
+        STORE_OPERATIONS.inc(op="hit")
+        self._enqueue(("hit", key, time.time()))
+        return self._decode(row[0])
+
+    async def get(self, key: Key) -> Optional[Any]:
+        try:
+            return await asyncio.to_thread(self._get, key, self.ttl)
+        except sqlite3.Error as e:
+            STORE_OPERATIONS.inc(op="error")
+            logger.warning("Definition store read failed", extra={"error": str(e)})
+            return None
+
+    async def get_stale(self, key: Key) -> Optional[Any]:
+        """
+        Like ``get``, but also returns entries up to ``stale_ttl`` past expiry
+        """
+        try:
+            return await asyncio.to_thread(self._get, key, self.ttl + self.stale_ttl)
+        except sqlite3.Error as e:
+            STORE_OPERATIONS.inc(op="error")
+            logger.warning("Definition store read failed", extra={"error": str(e)})
+            return None
+
+    def hottest(self, limit: int) -> List[Tuple[Key, Any, float]]:
+        """
+        The most-hit live entries with their remaining lifetime in seconds,
+        for warming the memory cache at boot
+        """
+        now = time.time()
+        rows = self._connection().execute(
+            "SELECT text, model, temperature, payload, created_at FROM definitions "
+            "WHERE created_at > ? ORDER BY hits DESC, last_hit_at DESC LIMIT ?",
+            (now - self.ttl, limit),
+        ).fetchall()
+        return [
+            ((text, model, temperature), self._decode(payload), created_at + self.ttl - now)
+            for text, model, temperature, payload, created_at in rows
+        ]
+
+    # Writes
+
+    def put(self, key: Key, payload: str) -> None:
+        """
+        Queue an upsert; never blocks the caller
+        """
+        self._enqueue(("put", key, payload, time.time()))
+
+    def _enqueue(self, item: tuple) -> None:
+        try:
+            self._writes.put_nowait(item)
+        except queue.Full:
+            STORE_OPERATIONS.inc(op="dropped")
+
+    def _write_loop(self) -> None:
+        while True:
+            item = self._writes.get()
+            if item is None:
+                return
+            batch = [item]
+            while len(batch) < WRITE_BATCH_SIZE:
+                try:
+                    item = self._writes.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._apply(batch)
+                    return
+                batch.append(item)
+            self._apply(batch)
+
+    def _apply(self, batch: List[tuple]) -> None:
+        connection = self._connection()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            for item in batch:
+                if item[0] == "put":
+                    _, key, payload, now = item
+                    connection.execute(
+                        "INSERT INTO definitions (text, model, temperature, payload, created_at, last_hit_at, hits) "
+                        "VALUES (?, ?, ?, ?, ?, ?, 0) "
+                        "ON CONFLICT (text, model, temperature) DO UPDATE SET "
+                        "payload = excluded.payload, created_at = excluded.created_at",
+                        (*key, payload, now, now),
+                    )
+                else:
+                    _, key, now = item
+                    connection.execute(
+                        "UPDATE definitions SET hits = hits + 1, last_hit_at = ? "
+                        "WHERE text = ? AND model = ? AND temperature = ?",
+                        (now, *key),
+                    )
+            connection.execute("COMMIT")
+            STORE_OPERATIONS.inc(sum(1 for item in batch if item[0] == "put"), op="write")
+        except sqlite3.Error as e:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            STORE_OPERATIONS.inc(len(batch), op="error")
+            logger.warning("Definition store write failed", extra={"error": str(e), "batch": len(batch)})
+
+    def ping(self) -> None:
+        """
+        Readiness probe: fails if the database can't be read
+        """
+        self._connection().execute("SELECT 1 FROM definitions LIMIT 1").fetchall()
+
+    # Maintenance
+
+    def cleanup(self) -> int:
+        """
+        Delete entries past their stale window and checkpoint/shrink the WAL.
+        Returns rows removed.
+        """
+        connection = self._connection()
+        removed = connection.execute(
+            "DELETE FROM definitions WHERE created_at <= ?", (time.time() - self.ttl - self.stale_ttl,)
+        ).rowcount
+        connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        if removed:
+            connection.execute("PRAGMA optimize")
+        return removed
+
+    def compact(self) -> None:
+        """
+        Rebuild the database file to reclaim space; takes an exclusive lock
+        """
+        self._connection().execute("VACUUM")
+
+    def close(self, timeout: float = 5.0) -> None:
+        """
+        Flush queued writes, stop the writer thread and close every
+        connection. Blocks for up to about ``timeout`` seconds, so call it
+        from a thread, not the event loop.
+        """
+        try:
+            # A full queue drains as the writer works through it
+            self._writes.put(None, timeout=timeout)
+        except queue.Full:
+            logger.warning("Definition store writer not keeping up, closing without a final flush")
+        self._writer.join(timeout=timeout)
+        if self._writer.is_alive():
+            # Still inside a write; leave its connection to the process exit
+            logger.warning("Definition store writer did not stop in time")
+            return
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            try:
+                connection.close()
+            except sqlite3.Error as e:
+                logger.warning("Definition store connection close failed", extra={"error": str(e)})
+
+
+def open_definition_store(decode: Callable[[str], Any]) -> Optional[DefinitionStore]:
+    """
+    Open the configured store, or None when disabled or unusable
+    """
+    if not DEFINITION_STORE_PATH:
+        return None
+    try:
+        return DefinitionStore(DEFINITION_STORE_PATH, DEFINITION_STORE_TTL_SECONDS, decode)
+    except (OSError, sqlite3.Error) as e:
+        logger.warning("Definition store unavailable, continuing without it", extra={"error": str(e)})
+        return None
+
+
+async def run_cleanup(store: DefinitionStore) -> None:
+    """
+    Periodic TTL cleanup, meant to run as a background task
+    """
+    while True:
+        try:
+            removed = await asyncio.to_thread(store.cleanup)
+            if removed:
+                logger.info("Definition store cleanup", extra={"removed": removed})
+        except sqlite3.Error as e:
+            logger.warning("Definition store cleanup failed", extra={"error": str(e)})
+        await asyncio.sleep(DEFINITION_STORE_CLEANUP_INTERVAL_SECONDS)
+
+
+if __name__ == "__main__":
+    # Offline maintenance: python -m backend.store [cleanup|compact]
+    import sys
+
+    store = DefinitionStore(DEFINITION_STORE_PATH, DEFINITION_STORE_TTL_SECONDS, decode=lambda payload: payload)
+    command = sys.argv[1] if len(sys.argv) > 1 else "cleanup"
+    if command == "compact":
+        store.cleanup()
+        store.compact()
+    else:
+        print(f"Removed {store.cleanup()} expired definitions")
+    store.close()
@@ -0,0 +1,50 @@
+# Server-Sent Events helpers for the streaming endpoints
+import json
+from typing import Any, AsyncIterator
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    # Stop nginx-style proxies (Render) from buffering the stream
+    "X-Accel-Buffering": "no",
+}
+
+
+def sse_event(event: str, data: Any) -> str:
+    """
+    Format one SSE frame with a JSON payload
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def sse_response(events: AsyncIterator[str]) -> StreamingResponse:
+    return StreamingResponse(events, media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+async def stream_text_events(deltas: AsyncIterator[str], field: str) -> AsyncIterator[str]:
+    """
+    Forward completion deltas as ``delta`` events, then a ``done`` event
+    carrying the full text under field. Failures after the response has
+    started are reported as an ``error`` event.
+    """
+    parts = []
+    try:
+        async for delta in deltas:
+            parts.append(delta)
+            yield sse_event("delta", {"text": delta})
+    except HTTPException as e:
+        yield sse_event("error", {"detail": e.detail})
+        return
+    except Exception as e:
+        yield sse_event("error", {"detail": f"Groq API error: {str(e)}"})
+        return
+    yield sse_event("done", {field: "".join(parts).strip()})
+
+
+async def mock_deltas(text: str) -> AsyncIterator[str]:
+    """
+    Stand-in delta stream used when Groq isn't configured
+    """
+    yield text
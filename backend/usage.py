@@ -0,0 +1,299 @@
+# Per-user usage events for quotas and billing, written off the request path
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Callable, Deque, List, Optional
+
+from postgrest.types import ReturnMethod
+
+from backend.logging_setup import request_id_var
+from backend.metrics import CallbackMetric, Counter
+
+logger = logging.getLogger("backend.usage")
+
+USAGE_EVENTS_ENABLED = os.getenv("USAGE_EVENTS_ENABLED", "true").lower() in ("1", "true", "yes")
+USAGE_TABLE = "usage_events"
+# A batch is written once this many events are buffered, or after the interval
+USAGE_BATCH_SIZE = int(os.getenv("USAGE_BATCH_SIZE", "200"))
+USAGE_FLUSH_INTERVAL_SECONDS = float(os.getenv("USAGE_FLUSH_INTERVAL_SECONDS", "2"))
+# Events buffered in memory; beyond this new events are dropped (overflow)
+USAGE_QUEUE_SIZE = int(os.getenv("USAGE_QUEUE_SIZE", "10000"))
+# JSON-lines file for batches the database didn't take; empty disables spilling
+USAGE_SPILL_PATH = os.getenv("USAGE_SPILL_PATH", "data/usage_spill.jsonl")
+USAGE_SPILL_MAX_BYTES = int(os.getenv("USAGE_SPILL_MAX_BYTES", str(64 * 1024 * 1024)))
+# After a failed write, batches go straight to disk for this long before retrying
+USAGE_RETRY_SECONDS = float(os.getenv("USAGE_RETRY_SECONDS", "30"))
+USAGE_SHUTDOWN_TIMEOUT_SECONDS = float(os.getenv("USAGE_SHUTDOWN_TIMEOUT_SECONDS", "5"))
+
+USAGE_EVENTS = Counter(
+    "usage_events_total",
+    "Usage events by result: queued, overflow (buffer full), written, spilled, replayed or dropped (spill full)",
+    ["result"],
+)
+
+
+def write_to_supabase(supabase_client, events: List[dict]) -> None:
+    """
+    Insert a batch of events. Event ids make retries and replays idempotent.
+    """
+    supabase_client.table(USAGE_TABLE).upsert(
+        events, ignore_duplicates=True, returning=ReturnMethod.minimal
+    ).execute()
+
+
+class UsageRecorder:
+    """
+    Bounded in-memory buffer of usage events and the task that writes them.
+
+    ``record`` only appends to a deque, so request latency never depends on
+    the database. A background task writes batches of up to ``batch_size``
+    events whenever that many are buffered or ``flush_interval`` passes.
+    Batches the database rejects are appended to a local spill file and
+    replayed once writes succeed again; ``stop`` makes a final flush, to
+    disk if the database doesn't answer in time. ``write`` is blocking and
+    runs in a worker thread.
+
+    Preforked workers share the spill file. Appends hold an flock on a
+    sibling lock file; a replaying worker takes the file over by renaming
+    it under that lock, so appends made meanwhile start a new file, and
+    puts back what it couldn't write. A second lock keeps replays to one
+    worker at a time.
+    """
+
+    def __init__(
+        self,
+        write: Callable[[List[dict]], None],
+        spill_path: str = USAGE_SPILL_PATH,
+        batch_size: int = USAGE_BATCH_SIZE,
+        flush_interval: float = USAGE_FLUSH_INTERVAL_SECONDS,
+        max_buffered: int = USAGE_QUEUE_SIZE,
+        spill_max_bytes: int = USAGE_SPILL_MAX_BYTES,
+    ):
+        self._write = write
+        self.spill_path = spill_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffered = max_buffered
+        self.spill_max_bytes = spill_max_bytes
+        self._buffer: Deque[dict] = deque()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self._retry_at = 0.0
+
+    def buffered(self) -> int:
+        return len(self._buffer)
+
+    @property
+    def spill_bytes(self) -> int:
+        """
+        Spilled data awaiting replay, from any worker
+        """
+        if not self.spill_path:
+            return 0
+        total = 0
+        for path in (self.spill_path, self._replaying_path):
+            try:
+                total += os.path.getsize(path)
+            except OSError:
+                pass
+        return total
+
+    @property
+    def _replaying_path(self) -> str:
+        return self.spill_path + ".replaying"
+
+    def record(self, user_id: str, feature: str, quantity: int = 1) -> None:
+        """
+        Queue one event; never blocks and never raises
+        """
+        if self._task is None:
+            return
+        if len(self._buffer) >= self.max_buffered:
+            USAGE_EVENTS.inc(result="overflow")
+            return
+        self._buffer.append({
+            "id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "feature": feature,
+            "quantity": quantity,
+            "request_id": request_id_var.get(),
+            "occurred_at": datetime.now(timezone.utc).isoformat(),
+        })
+        USAGE_EVENTS.inc(result="queued")
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    # Lifecycle
+
+    def start(self) -> None:
+        if self._task is None:
+            self._closing = False
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = USAGE_SHUTDOWN_TIMEOUT_SECONDS) -> None:
+        if self._task is None:
+            return
+        self._closing = True
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(self._task, timeout=timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            pass
+        self._task = None
+        if self._buffer:
+            # The database was too slow; keep the rest for the next start
+            events = list(self._buffer)
+            self._buffer.clear()
+            self._spill(events)
+            logger.warning("Usage events spilled at shutdown", extra={"events": len(events)})
+
+    async def _run(self) -> None:
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self._flush_buffered()
+            if self.spill_bytes and time.monotonic() >= self._retry_at:
+                await self._replay()
+        await self._flush_buffered()
+
+    # Writing
+
+    async def _flush_buffered(self) -> None:
+        while self._buffer:
+            batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[dict]) -> None:
+        if time.monotonic() < self._retry_at:
+            await asyncio.to_thread(self._spill, batch)
+            return
+        try:
+            await asyncio.to_thread(self._write, batch)
+        except asyncio.CancelledError:
+            # Possibly written already; ids make writing it again harmless
+            self._buffer.extendleft(reversed(batch))
+            raise
+        except Exception as e:
+            self._retry_at = time.monotonic() + USAGE_RETRY_SECONDS
+            logger.warning(
+                "Usage event write failed, spilling to disk",
+                extra={"events": len(batch), "error_type": type(e).__name__, "error": str(e)},
+            )
+            await asyncio.to_thread(self._spill, batch)
+            return
+        USAGE_EVENTS.inc(len(batch), result="written")
+
+    def _spill(self, events: List[dict]) -> None:
+        if not self.spill_path:
+            USAGE_EVENTS.inc(len(events), result="dropped")
+            return
+        data = "".join(json.dumps(event) + "\n" for event in events).encode()
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.spill_path)), exist_ok=True)
+            with self._lock("lock"):
+                if self.spill_bytes + len(data) > self.spill_max_bytes:
+                    USAGE_EVENTS.inc(len(events), result="dropped")
+                    logger.error("Usage spill file full, dropping events", extra={"events": len(events)})
+                    return
+                with open(self.spill_path, "ab") as spill:
+                    spill.write(data)
+        except OSError as e:
+            USAGE_EVENTS.inc(len(events), result="dropped")
+            logger.error("Usage spill failed", extra={"events": len(events), "error": str(e)})
+            return
+        USAGE_EVENTS.inc(len(events), result="spilled")
+
+    @contextmanager
+    def _lock(self, kind: str, blocking: bool = True):
+        """
+        Exclusive flock on ``<spill_path>.<kind>``, shared by all workers;
+        raises BlockingIOError if not ``blocking`` and it is held
+        """
+        fd = os.open(f"{self.spill_path}.{kind}", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            yield
+        finally:
+            # Closing the descriptor releases the lock
+            os.close(fd)
+
+    async def _replay(self) -> None:
+        try:
+            replayed = await asyncio.to_thread(self._replay_spill)
+        except Exception as e:
+            self._retry_at = time.monotonic() + USAGE_RETRY_SECONDS
+            logger.warning("Usage spill replay failed", extra={"error_type": type(e).__name__, "error": str(e)})
+            return
+        logger.info("Usage spill replayed", extra={"events": replayed})
+
+    def _replay_spill(self) -> int:
+        """
+        Write spilled events in batches; whatever isn't written stays on disk
+        """
+        try:
+            with self._lock("replay.lock", blocking=False):
+                return self._replay_locked()
+        except BlockingIOError:
+            # Another worker is replaying
+            return 0
+
+    def _replay_locked(self) -> int:
+        # A leftover from a replay that crashed is finished first
+        if not os.path.exists(self._replaying_path):
+            with self._lock("lock"):
+                if not os.path.exists(self.spill_path):
+                    return 0
+                os.replace(self.spill_path, self._replaying_path)
+        with open(self._replaying_path, "rb") as spill:
+            lines = spill.read().splitlines()
+        written = 0
+        try:
+            for start in range(0, len(lines), self.batch_size):
+                events = []
+                for line in lines[start:start + self.batch_size]:
+                    try:
+                        events.append(json.loads(line))
+                    except ValueError:
+                        # Torn write from a crash
+                        USAGE_EVENTS.inc(result="dropped")
+                if events:
+                    self._write(events)
+                written = min(len(lines), start + self.batch_size)
+                USAGE_EVENTS.inc(len(events), result="replayed")
+        finally:
+            remaining = b"".join(line + b"\n" for line in lines[written:])
+            if remaining:
+                # Written back before the claimed file goes, so a crash in
+                # between only repeats events, which their ids make harmless
+                with self._lock("lock"):
+                    with open(self.spill_path, "ab") as spill:
+                        spill.write(remaining)
+            os.remove(self._replaying_path)
+        return written
+
+
+def register_usage_metrics(recorder: UsageRecorder) -> None:
+    CallbackMetric(
+        "usage_events_buffered",
+        "Usage events waiting in memory to be written",
+        "gauge",
+        lambda: [((), recorder.buffered())],
+    )
+    CallbackMetric(
+        "usage_spill_bytes",
+        "Size of the local usage spill file awaiting replay",
+        "gauge",
+        lambda: [((), recorder.spill_bytes)],
+    )
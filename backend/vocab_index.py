@@ -0,0 +1,284 @@
+# Precomputed core-vocabulary definitions served from a memory-mapped index
+"""
+File layout (all integers little-endian):
+
+    magic        8 bytes   b"GSVOCAB1"
+    header_len   uint32
+    header       JSON: {"model", "temperature", "prompt", "count", "built_at"}
+    table        count x (hash uint64, offset uint64, length uint32), sorted by hash
+    records      normalized text, NUL, DefinitionResponse JSON
+
+"model", "temperature" and "prompt" (a fingerprint of the /define
+prompt) say what produced the definitions; an index is only served, or
+reused by --merge, while they match the running configuration.
+
+The table is binary-searched in place on the mmap, so a lookup touches a
+handful of pages and copies only the matching record. Pages are shared
+between worker processes through the OS page cache.
+
+Build one with:
+
+    python -m backend.vocab_index build words.txt data/core_vocab.idx --concurrency 8
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from backend.cache import normalize_text
+from backend.metrics import Counter
+
+logger = logging.getLogger("backend.vocab_index")
+
+VOCAB_INDEX_PATH = os.getenv("VOCAB_INDEX_PATH", "data/core_vocab.idx")
+
+MAGIC = b"GSVOCAB1"
+_HEADER_LEN = struct.Struct("<I")
+_ENTRY = struct.Struct("<QQI")
+
+VOCAB_LOOKUPS = Counter(
+    "vocab_index_lookups_total",
+    "Core-vocabulary index lookups by result",
+    ["result"],
+)
+
+
+# Header fields that identify what produced the definitions
+SOURCE_FIELDS = ("model", "temperature", "prompt")
+
+
+def prompt_fingerprint(messages: List[dict]) -> str:
+    """
+    Short stable hash of a prompt template (messages built for a placeholder text)
+    """
+    return hashlib.sha256(json.dumps(messages, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def key_hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little")
+
+
+class VocabIndex:
+    """
+    Read-only view of an index file built by ``build_index``
+    """
+
+    def __init__(self, path: str, decode: Callable[[bytes], Any]):
+        self.path = path
+        self._decode = decode
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            self._mmap.close()
+            raise ValueError(f"{path} is not a vocabulary index")
+        (header_len,) = _HEADER_LEN.unpack_from(self._mmap, len(MAGIC))
+        header_start = len(MAGIC) + _HEADER_LEN.size
+        self.header: Dict[str, Any] = json.loads(self._mmap[header_start:header_start + header_len])
+        self.count: int = self.header["count"]
+        self._table_offset = header_start + header_len
+
+    def __len__(self) -> int:
+        return self.count
+
+    def built_with(self, source: Dict[str, Any]) -> bool:
+        """
+        Whether the definitions came from this model, temperature and prompt
+        """
+        return all(self.header.get(field) == source.get(field) for field in SOURCE_FIELDS)
+
+    def _entry(self, index: int) -> Tuple[int, int, int]:
+        return _ENTRY.unpack_from(self._mmap, self._table_offset + index * _ENTRY.size)
+
+    def get(self, text: str) -> Optional[Any]:
+        key = normalize_text(text)
+        target = key_hash(key)
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._entry(mid)[0] < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        encoded_key = key.encode() + b"\0"
+        while lo < self.count:
+            entry_hash, offset, length = self._entry(lo)
+            if entry_hash != target:
+                break
+            # Compare the stored key in place before copying the record out
+            if self._mmap.find(encoded_key, offset, offset + len(encoded_key)) == offset:
+                VOCAB_LOOKUPS.inc(result="hit")
+                return self._decode(self._mmap[offset + len(encoded_key):offset + length])
+            lo += 1
+        VOCAB_LOOKUPS.inc(result="miss")
+        return None
+
+    def keys(self) -> Iterator[str]:
+        """
+        Normalized texts stored in the index, in table order
+        """
+        for index in range(self.count):
+            _, offset, length = self._entry(index)
+            end = self._mmap.find(b"\0", offset, offset + length)
+            yield self._mmap[offset:end].decode()
+
+    def close(self) -> None:
+        self._mmap.close()
+
+
+def open_vocab_index(decode: Callable[[bytes], Any], source: Dict[str, Any]) -> Optional[VocabIndex]:
+    """
+    Open the configured index, or None when it isn't there, is unreadable
+    or was built with another model, temperature or prompt than ``source``
+    """
+    if not VOCAB_INDEX_PATH or not os.path.exists(VOCAB_INDEX_PATH):
+        return None
+    try:
+        index = VocabIndex(VOCAB_INDEX_PATH, decode)
+    except (OSError, ValueError) as e:
+        logger.warning("Vocabulary index unavailable", extra={"path": VOCAB_INDEX_PATH, "error": str(e)})
+        return None
+    if not index.built_with(source):
+        logger.warning(
+            "Vocabulary index was built for another configuration, ignoring it",
+            extra={"path": VOCAB_INDEX_PATH, "built_with": {field: index.header.get(field) for field in SOURCE_FIELDS}},
+        )
+        index.close()
+        return None
+    logger.info("Vocabulary index loaded", extra={"path": VOCAB_INDEX_PATH, "entries": len(index)})
+    return index
+
+
+def write_index(path: str, records: Dict[str, str], source: Dict[str, Any]) -> None:
+    """
+    Write normalized text -> definition JSON records as an index file,
+    labelled with the ``source`` (model, temperature, prompt) that produced
+    them. The file is written next to path and renamed into place.
+    """
+    header = json.dumps({
+        **{field: source[field] for field in SOURCE_FIELDS},
+        "count": len(records),
+        "built_at": int(time.time()),
+    }).encode()
+    entries = sorted((key_hash(key), key) for key in records)
+    table_offset = len(MAGIC) + _HEADER_LEN.size + len(header)
+    offset = table_offset + len(entries) * _ENTRY.size
+
+    table = bytearray()
+    blobs = []
+    for entry_hash, key in entries:
+        blob = key.encode() + b"\0" + records[key].encode()
+        table += _ENTRY.pack(entry_hash, offset, len(blob))
+        blobs.append(blob)
+        offset += len(blob)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(_HEADER_LEN.pack(len(header)))
+        f.write(header)
+        f.write(table)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp_path, path)
+
+
+async def _define_all(words: Iterable[str], concurrency: int) -> Dict[str, str]:
+    # The app module holds the Groq client and the request /define makes
+    from backend import main as app_module
+
+    if app_module.groq_client is None:
+        raise SystemExit("GROQ_API_KEY is required to build the vocabulary index")
+
+    semaphore = asyncio.Semaphore(concurrency)
+    records: Dict[str, str] = {}
+    failures = 0
+
+    async def define(word: str):
+        nonlocal failures
+        async with semaphore:
+            try:
+                definition, parsed = await app_module.request_definition(word)
+            except Exception as e:
+                failures += 1
+                logger.warning("Definition failed", extra={"word": word, "error": str(getattr(e, "detail", e))})
+                return
+        if parsed:
+            records[normalize_text(word)] = definition.model_dump_json()
+        else:
+            failures += 1
+        done = len(records) + failures
+        if done % 100 == 0:
+            logger.info("Vocabulary build progress", extra={"done": done, "failures": failures})
+
+    unique = {normalize_text(word): word.strip() for word in words if word.strip()}
+    await asyncio.gather(*(define(word) for word in unique.values()))
+    logger.info("Vocabulary build finished", extra={"defined": len(records), "failures": failures})
+    return records
+
+
+def build_index(word_list: str, output: str, concurrency: int, merge: Optional[str] = None) -> None:
+    """
+    Define every word in word_list with the /define prompt and write the
+    validated results to output. Words already present in merge (an
+    existing index) are carried over instead of being defined again, if
+    it was built with the current model, temperature and prompt.
+    """
+    from backend import main as app_module
+
+    with open(word_list, encoding="utf-8") as f:
+        words = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+    source = app_module.DEFINITION_SOURCE
+    records: Dict[str, str] = {}
+    if merge and os.path.exists(merge):
+        existing = VocabIndex(merge, decode=lambda payload: bytes(payload).decode())
+        if existing.built_with(source):
+            for word in words:
+                payload = existing.get(word)
+                if payload is not None:
+                    records[normalize_text(word)] = payload
+        else:
+            # Its definitions came from another model or prompt; redo them all
+            print(f"Not reusing {merge}: built with a different model, temperature or prompt")
+        existing.close()
+
+    todo = [word for word in words if normalize_text(word) not in records]
+    records.update(asyncio.run(_define_all(todo, concurrency)))
+    write_index(output, records, source)
+    print(f"Wrote {len(records)} definitions to {output}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Core-vocabulary index tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="Define a word list and write an index")
+    build.add_argument("word_list", help="Text file with one word or phrase per line")
+    build.add_argument("output", nargs="?", default=VOCAB_INDEX_PATH)
+    build.add_argument("--concurrency", type=int, default=8)
+    build.add_argument("--merge", help="Reuse definitions from an existing index")
+
+    lookup = commands.add_parser("lookup", help="Print the stored definition for a word")
+    lookup.add_argument("word")
+    lookup.add_argument("--index", default=VOCAB_INDEX_PATH)
+
+    args = parser.parse_args(argv)
+    if args.command == "build":
+        build_index(args.word_list, args.output, args.concurrency, args.merge)
+    else:
+        index = VocabIndex(args.index, decode=lambda payload: bytes(payload).decode())
+        payload = index.get(args.word)
+        print(payload if payload is not None else f"{args.word!r} is not in the index")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
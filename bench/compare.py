@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Compare two benchmark result files written by bench.run.
+
+    python -m bench.compare bench/results/before.json bench/results/after.json
+"""
+import argparse
+import json
+import sys
+
+
+def load(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def change(before: float, after: float) -> str:
+    if not before:
+        return "n/a"
+    return f"{(after - before) / before * 100:+.1f}%"
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("before")
+    parser.add_argument("after")
+    args = parser.parse_args(argv)
+
+    before, after = load(args.before), load(args.after)
+    print(f"before: {before['meta'].get('revision')} {before['meta'].get('label', '')}")
+    print(f"after:  {after['meta'].get('revision')} {after['meta'].get('label', '')}")
+    print()
+
+    baseline = {(r["endpoint"], r["concurrency"]): r for r in before["results"]}
+    header = f"{'endpoint':<10}{'conc':>5}  {'rps':>18}  {'p50 ms':>18}  {'p95 ms':>18}  {'p99 ms':>18}"
+    print(header)
+    print("-" * len(header))
+    for result in after["results"]:
+        old = baseline.get((result["endpoint"], result["concurrency"]))
+        if old is None:
+            continue
+        cells = [f"{result['endpoint']:<10}{result['concurrency']:>5}"]
+        cells.append(f"{result['rps']:>9} {change(old['rps'], result['rps']):>8}")
+        for pct in ("p50", "p95", "p99"):
+            new_value, old_value = result["latency_ms"][pct], old["latency_ms"][pct]
+            cells.append(f"{new_value:>9} {change(old_value, new_value):>8}")
+        print("  ".join(cells))
+
+    old_tokens, new_tokens = before.get("tokens", {}), after.get("tokens", {})
+    shared = [endpoint for endpoint in new_tokens if endpoint in old_tokens]
+    if shared:
+        print()
+        header = f"{'endpoint':<10}  {'prompt tokens/call':>26}  {'completion tokens/call':>26}"
+        print(header)
+        print("-" * len(header))
+        for endpoint in shared:
+            cells = [f"{endpoint:<10}"]
+            for kind in ("prompt_per_call", "completion_per_call"):
+                old_value, new_value = old_tokens[endpoint][kind], new_tokens[endpoint][kind]
+                cells.append(f"{old_value:>8} -> {new_value:<8} {change(old_value, new_value):>7}")
+            print("  ".join(cells))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
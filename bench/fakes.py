@@ -0,0 +1,202 @@
+# Local stand-ins for the Groq and Supabase HTTP APIs used by the benchmarks
+#
+# Behaviour is configured through environment variables so the runner can
+# start these with plain `uvicorn bench.fakes:groq_app` subprocesses:
+#
+#   FAKE_LATENCY_MS        median latency of each response (default 300)
+#   FAKE_LATENCY_DIST      fixed | uniform | lognormal (default lognormal)
+#   FAKE_LATENCY_SIGMA     spread for lognormal, as a multiplier exponent (default 0.5)
+#   FAKE_ERROR_RATE        fraction of requests answered with HTTP 500 (default 0)
+#   FAKE_MALFORMED_RATE    fraction of /define completions that aren't valid JSON (default 0)
+#   FAKE_SEED              seed for the random generator
+import asyncio
+import base64
+import json
+import os
+import random
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+LATENCY_MS = float(os.getenv("FAKE_LATENCY_MS", "300"))
+LATENCY_DIST = os.getenv("FAKE_LATENCY_DIST", "lognormal")
+LATENCY_SIGMA = float(os.getenv("FAKE_LATENCY_SIGMA", "0.5"))
+ERROR_RATE = float(os.getenv("FAKE_ERROR_RATE", "0"))
+MALFORMED_RATE = float(os.getenv("FAKE_MALFORMED_RATE", "0"))
+
+rng = random.Random(os.getenv("FAKE_SEED"))
+
+
+def sample_latency() -> float:
+    """
+    One response delay in seconds drawn from the configured distribution
+    """
+    median = LATENCY_MS / 1000
+    if LATENCY_DIST == "fixed":
+        return median
+    if LATENCY_DIST == "uniform":
+        return rng.uniform(0, 2 * median)
+    return rng.lognormvariate(0, LATENCY_SIGMA) * median
+
+
+async def maybe_fail():
+    await asyncio.sleep(sample_latency())
+    if rng.random() < ERROR_RATE:
+        return JSONResponse({"error": {"message": "fake upstream error"}}, status_code=500)
+    return None
+
+
+# --- Groq -----------------------------------------------------------------
+
+groq_app = FastAPI(title="Fake Groq")
+
+
+def fake_definition(word: str) -> str:
+    return json.dumps({
+        "word": word,
+        "part_of_speech": "noun",
+        "definition": f"A benchmark definition of {word} long enough to look like a real answer.",
+        "examples": [
+            {"sentence": f"The {word} was used in a sentence.", "context": "Benchmark"},
+            {"sentence": f"Another sentence with {word}.", "context": "Benchmark"},
+        ],
+        "synonyms": [
+            {"word": f"{word}-like", "similarity": "high"},
+            {"word": "thing", "similarity": "medium"},
+            {"word": "item", "similarity": "low"},
+        ],
+        "confidence": 0.9,
+    })
+
+
+def completion_text(messages) -> str:
+    system = messages[0]["content"] if messages else ""
+    user = messages[-1]["content"] if messages else ""
+    if "dictionary" in system:
+        if rng.random() < MALFORMED_RATE:
+            return "Sure! Here is the definition you asked for, but not as JSON."
+        word = user.split('"')[1] if '"' in user else "word"
+        return fake_definition(word)
+    if "comedian" in system:
+        return "Why did the benchmark cross the road? To measure the other side."
+    return "Benchmarking my best life #perf #latency"
+
+
+@groq_app.post("/openai/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    failure = await maybe_fail()
+    if failure is not None:
+        return failure
+
+    text = completion_text(body.get("messages", []))
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+    model = body.get("model", "fake-model")
+    prompt_tokens = sum(len(m.get("content", "")) for m in body.get("messages", [])) // 4
+    completion_tokens = len(text) // 4
+
+    if body.get("stream"):
+        async def chunks():
+            for i in range(0, len(text), 16):
+                chunk = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {"content": text[i:i + 16]}, "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+                await asyncio.sleep(0.005)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(chunks(), media_type="text/event-stream")
+
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": created,
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": text},
+            "finish_reason": "stop",
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+@groq_app.get("/health")
+async def groq_health():
+    return {"status": "ok"}
+
+
+# --- Supabase -------------------------------------------------------------
+
+supabase_app = FastAPI(title="Fake Supabase")
+
+
+def _user_from_token(token: str):
+    # The benchmark mints tokens whose subject is the user id; don't verify here
+    try:
+        payload = token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+    except (IndexError, ValueError):
+        return None
+    return {
+        "id": claims.get("sub"),
+        "aud": "authenticated",
+        "role": "authenticated",
+        "email": claims.get("email"),
+        "app_metadata": {},
+        "user_metadata": claims.get("user_metadata", {}),
+        "created_at": "2024-01-01T00:00:00Z",
+    }
+
+
+@supabase_app.get("/auth/v1/user")
+async def auth_user(request: Request):
+    failure = await maybe_fail()
+    if failure is not None:
+        return failure
+    token = request.headers.get("authorization", "").removeprefix("Bearer ")
+    user = _user_from_token(token)
+    if user is None or not user["id"]:
+        return JSONResponse({"msg": "invalid JWT"}, status_code=401)
+    return user
+
+
+@supabase_app.post("/rest/v1/rpc/resolve_user_identity")
+async def resolve_user_identity(request: Request):
+    body = await request.json()
+    failure = await maybe_fail()
+    if failure is not None:
+        return failure
+    return {
+        "username": body.get("p_username"),
+        "subscription": {
+            "id": str(uuid.uuid4()),
+            "plan": "Premium",
+            "status": "active",
+            "end_date": "2099-01-01T00:00:00Z",
+        },
+    }
+
+
+@supabase_app.api_route("/rest/v1/{table}", methods=["GET", "HEAD", "POST", "PATCH"])
+async def rest_table(table: str):
+    failure = await maybe_fail()
+    if failure is not None:
+        return failure
+    return JSONResponse([], headers={"Content-Range": "0-0/0"})
+
+
+@supabase_app.get("/health")
+async def supabase_health():
+    return {"status": "ok"}
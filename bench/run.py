@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+"""
+Offline load test for backend.main:app.
+
+Starts local fake Groq and Supabase servers (bench/fakes.py), starts the
+backend against them, drives the LLM endpoints at each concurrency level
+and writes latency percentiles, throughput and memory to a JSON file.
+
+    python -m bench.run --concurrency 1 8 32 --requests 200
+    python -m bench.compare bench/results/a.json bench/results/b.json
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import os
+import platform
+import random
+import shlex
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import httpx
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+JWT_SECRET = "bench-jwt-secret"
+
+ENDPOINTS = {
+    "define": ("/define", lambda word: {"text": word}),
+    "jokes": ("/jokes/generate", lambda word: {"prompt": f"a joke about {word}"}),
+    "captions": ("/captions/generate", lambda word: {"prompt": f"a photo of {word}"}),
+}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def mint_token(user_id: str) -> str:
+    """
+    HS256 access token shaped like the ones Supabase issues
+    """
+    def b64(data: bytes) -> str:
+        return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+    header = b64(json.dumps({"alg": "HS256", "typ": "JWT"}).encode())
+    payload = b64(json.dumps({
+        "sub": user_id,
+        "email": f"{user_id}@bench.local",
+        "aud": "authenticated",
+        "role": "authenticated",
+        "exp": int(time.time()) + 3600,
+    }).encode())
+    signature = hmac.new(JWT_SECRET.encode(), f"{header}.{payload}".encode(), hashlib.sha256).digest()
+    return f"{header}.{payload}.{b64(signature)}"
+
+
+def wait_for(url: str, proc: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"Process for {url} exited with {proc.returncode}")
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"Timed out waiting for {url}")
+
+
+@contextmanager
+def process(cmd: List[str], env: Dict[str, str], health_url: str, log_path: str):
+    with open(log_path, "w") as log:
+        proc = subprocess.Popen(cmd, env=env, cwd=REPO_ROOT, stdout=log, stderr=subprocess.STDOUT)
+        try:
+            wait_for(health_url, proc)
+            yield proc
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+def rss_bytes(pid: int) -> Optional[int]:
+    """
+    Resident memory of pid and its children (children need psutil)
+    """
+    if psutil is not None:
+        try:
+            parent = psutil.Process(pid)
+            return sum(p.memory_info().rss for p in [parent] + parent.children(recursive=True))
+        except psutil.Error:
+            return None
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def drive(
+    base_url: str,
+    endpoint: str,
+    concurrency: int,
+    total: int,
+    vocabulary: List[str],
+    tokens: List[str],
+    server_pid: int,
+) -> dict:
+    path, body_for = ENDPOINTS[endpoint]
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    peak_rss = rss_bytes(server_pid) or 0
+    remaining = total
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60.0) as client:
+        async def worker(worker_id: int):
+            nonlocal remaining
+            token = tokens[worker_id % len(tokens)]
+            while remaining > 0:
+                remaining -= 1
+                word = random.choice(vocabulary)
+                start = time.perf_counter()
+                try:
+                    response = await client.post(
+                        path, json=body_for(word), headers={"Authorization": f"Bearer {token}"}
+                    )
+                    key = str(response.status_code)
+                except httpx.HTTPError as e:
+                    key = type(e).__name__
+                latencies.append(time.perf_counter() - start)
+                statuses[key] = statuses.get(key, 0) + 1
+
+        async def sample_memory():
+            nonlocal peak_rss
+            while True:
+                peak_rss = max(peak_rss, rss_bytes(server_pid) or 0)
+                await asyncio.sleep(0.25)
+
+        sampler = asyncio.create_task(sample_memory())
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        sampler.cancel()
+
+    latencies.sort()
+    errors = sum(count for status, count in statuses.items() if status != "200")
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "statuses": statuses,
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 2),
+            "p95": round(percentile(latencies, 95) * 1000, 2),
+            "p99": round(percentile(latencies, 99) * 1000, 2),
+            "mean": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0.0,
+            "max": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        },
+        "peak_rss_mb": round(peak_rss / (1024 * 1024), 1),
+    }
+
+
+def llm_tokens(base_url: str) -> Dict[str, dict]:
+    """
+    Average prompt and completion tokens per successful Groq call, by
+    endpoint, from the server's /metrics (one worker's view)
+    """
+    try:
+        text = httpx.get(f"{base_url}/metrics", timeout=10.0).text
+    except httpx.HTTPError:
+        return {}
+    totals: Dict[str, Dict[str, float]] = {}
+    for line in text.splitlines():
+        if line.startswith("#") or " " not in line:
+            continue
+        series, value = line.rsplit(" ", 1)
+        name, _, labels = series.partition("{")
+        fields = dict(
+            pair.split("=", 1) for pair in labels.rstrip("}").replace('"', "").split(",") if "=" in pair
+        )
+        endpoint = fields.get("endpoint")
+        if name == "llm_tokens_total":
+            key = fields.get("kind")
+        elif name == "llm_request_duration_seconds_count" and fields.get("outcome") == "ok":
+            key = "calls"
+        else:
+            continue
+        counts = totals.setdefault(endpoint, {"calls": 0.0, "prompt": 0.0, "completion": 0.0})
+        counts[key] = counts.get(key, 0.0) + float(value)
+    return {
+        endpoint: {
+            "calls": int(counts["calls"]),
+            "prompt_per_call": round(counts["prompt"] / counts["calls"], 1),
+            "completion_per_call": round(counts["completion"] / counts["calls"], 1),
+        }
+        for endpoint, counts in totals.items()
+        if counts["calls"]
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoints", nargs="+", default=list(ENDPOINTS), choices=list(ENDPOINTS))
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint and concurrency level")
+    parser.add_argument("--warmup", type=int, default=10, help="Unmeasured requests before each level")
+    parser.add_argument("--vocabulary", type=int, default=1000,
+                        help="Distinct words to draw from; small values exercise the caches")
+    parser.add_argument("--users", type=int, default=50, help="Distinct authenticated users")
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="Median fake upstream latency")
+    parser.add_argument("--latency-dist", choices=["fixed", "uniform", "lognormal"], default="lognormal")
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--remote-auth", action="store_true",
+                        help="Don't give the backend the JWT secret, so every token is checked against the fake Supabase")
+    parser.add_argument("--server-cmd", default="{python} -m uvicorn backend.main:app --host 127.0.0.1 --port {port}",
+                        help="Command that starts the backend; {python} and {port} are substituted")
+    parser.add_argument("--label", default="", help="Free-form label stored with the results")
+    parser.add_argument("--output", help="Results file (default bench/results/<timestamp>-<rev>.json)")
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    random.seed(args.seed)
+    log_dir = os.path.join(REPO_ROOT, "bench", "logs")
+    os.makedirs(log_dir, exist_ok=True)
+
+    groq_port, supabase_port, server_port = free_port(), free_port(), free_port()
+    fake_env = dict(
+        os.environ,
+        FAKE_LATENCY_MS=str(args.latency_ms),
+        FAKE_LATENCY_DIST=args.latency_dist,
+        FAKE_LATENCY_SIGMA=str(args.latency_sigma),
+        FAKE_ERROR_RATE=str(args.error_rate),
+        FAKE_MALFORMED_RATE=str(args.malformed_rate),
+        FAKE_SEED=str(args.seed),
+    )
+    server_env = dict(
+        os.environ,
+        GROQ_API_KEY="gsk_bench",
+        GROQ_BASE_URL=f"http://127.0.0.1:{groq_port}",
+        SUPABASE_URL=f"http://127.0.0.1:{supabase_port}",
+        SUPABASE_SERVICE_KEY="bench.service.key",
+        LOG_LEVEL="WARNING",
+        PYTHONPATH=REPO_ROOT,
+    )
+    server_env.pop("SUPABASE_JWT_SECRET", None)
+    if not args.remote_auth:
+        server_env["SUPABASE_JWT_SECRET"] = JWT_SECRET
+
+    def uvicorn_cmd(target: str, port: int) -> List[str]:
+        return [sys.executable, "-m", "uvicorn", target, "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+
+    server_cmd = shlex.split(args.server_cmd.format(python=sys.executable, port=server_port))
+    vocabulary = [f"word{i}" for i in range(args.vocabulary)]
+    tokens = [mint_token(f"00000000-0000-0000-0000-{i:012d}") for i in range(args.users)]
+    base_url = f"http://127.0.0.1:{server_port}"
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="bench-") as state_dir, \
+         process(uvicorn_cmd("bench.fakes:groq_app", groq_port), fake_env,
+                 f"http://127.0.0.1:{groq_port}/health", os.path.join(log_dir, "fake_groq.log")), \
+         process(uvicorn_cmd("bench.fakes:supabase_app", supabase_port), fake_env,
+                 f"http://127.0.0.1:{supabase_port}/health", os.path.join(log_dir, "fake_supabase.log")):
+        # Every run starts cold: no definitions or usage spill from earlier
+        # runs or a local dev server, and no vocabulary index
+        server_env.update(
+            DEFINITION_STORE_PATH=os.path.join(state_dir, "definitions.sqlite3"),
+            USAGE_SPILL_PATH=os.path.join(state_dir, "usage_spill.jsonl"),
+            VOCAB_INDEX_PATH="",
+        )
+        launch = time.perf_counter()
+        with process(server_cmd, server_env, f"{base_url}/health", os.path.join(log_dir, "server.log")) as server:
+            startup_s = time.perf_counter() - launch
+            idle_rss = rss_bytes(server.pid)
+            for endpoint in args.endpoints:
+                for concurrency in args.concurrency:
+                    if args.warmup:
+                        asyncio.run(drive(base_url, endpoint, min(concurrency, args.warmup), args.warmup,
+                                          vocabulary, tokens, server.pid))
+                    result = asyncio.run(drive(base_url, endpoint, concurrency, args.requests,
+                                               vocabulary, tokens, server.pid))
+                    results.append(result)
+                    latency = result["latency_ms"]
+                    print(
+                        f"{endpoint:<9} c={concurrency:<4} rps={result['rps']:<8} "
+                        f"p50={latency['p50']:<8} p95={latency['p95']:<8} p99={latency['p99']:<8} "
+                        f"errors={result['errors']:<5} rss={result['peak_rss_mb']}MB"
+                    )
+            llm_usage = llm_tokens(base_url)
+            for endpoint, counts in llm_usage.items():
+                print(
+                    f"{endpoint:<9} tokens/call prompt={counts['prompt_per_call']} "
+                    f"completion={counts['completion_per_call']} ({counts['calls']} calls)"
+                )
+
+    revision = git_revision()
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "revision": revision,
+            "label": args.label,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "server_cmd": args.server_cmd,
+            "startup_s": round(startup_s, 3),
+            "idle_rss_mb": round((idle_rss or 0) / (1024 * 1024), 1),
+            "config": {key: value for key, value in vars(args).items() if key not in ("output",)},
+        },
+        "results": results,
+        "tokens": llm_usage,
+    }
+    output = args.output or os.path.join(
+        REPO_ROOT, "bench", "results",
+        f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{revision or 'unknown'}.json",
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
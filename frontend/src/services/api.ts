@@ -3,12 +3,16 @@ import { DefinitionRequest, DefinitionResponse } from '@/types/api';
 import { supabase } from '@/lib_supa/supabase';
 
 const API_BASE_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000';
+// Give up on a request after this long; the backend stops working on it at the same point
+const REQUEST_TIMEOUT_MS = 20000;
 
 // Create axios instance with auth interceptor
 const api = axios.create({
   baseURL: API_BASE_URL,
+  timeout: REQUEST_TIMEOUT_MS,
   headers: {
     'Content-Type': 'application/json',
+    'X-Request-Timeout': String(REQUEST_TIMEOUT_MS / 1000),
   },
 });
 
@@ -34,10 +38,25 @@ api.interceptors.response.use(
   }
 );
 
+// Mirrors the backend's normalize_text closely enough to avoid most redirects
+const canonicalText = (text: string): string =>
+  text
+    .normalize('NFKC')
+    .split(/\s+/)
+    .filter(Boolean)
+    .join(' ')
+    .toLowerCase()
+    .replace(/^[\s!-/:-@[-`{-~\u2018\u2019\u201c\u201d\u00ab\u00bb\u2026\u2013\u2014\u00a1\u00bf]+|[\s!-/:-@[-`{-~\u2018\u2019\u201c\u201d\u00ab\u00bb\u2026\u2013\u2014\u00a1\u00bf]+$/g, '') || text.trim().toLowerCase();
+
 export const dictionaryApi = {
   defineText: async (request: DefinitionRequest): Promise<DefinitionResponse> => {
-    const response = await api.post<DefinitionResponse>('/define', request);
-    return response.data;
+    if (request.use_mock) {
+      const response = await api.post<DefinitionResponse>('/define', request);
+      return response.data;
+    }
+    // Cacheable GET on the canonical URL (the backend redirects other spellings)
+    const response = await api.get<DefinitionResponse>(`/definitions/${encodeURIComponent(canonicalText(request.text))}`);
+    return { ...response.data, word: request.text.trim() };
   },
 
   healthCheck: async (): Promise<{ status: string; service: string }> => {
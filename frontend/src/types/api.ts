@@ -20,6 +20,7 @@ export interface DefinitionResponse {
   examples: Example[];
   synonyms: Synonym[];
   confidence: number;
+  stale?: boolean;
 }
 
 export interface ErrorResponse {
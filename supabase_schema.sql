@@ -39,9 +39,21 @@ CREATE TABLE public.user_subscriptions (
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
+-- Usage events for quotas and billing, written in batches by the backend.
+-- The id is generated by the backend so retried batches are idempotent.
+CREATE TABLE public.usage_events (
+    id UUID PRIMARY KEY,
+    user_id UUID REFERENCES auth.users(id) NOT NULL,
+    feature VARCHAR(50) NOT NULL,
+    quantity INTEGER NOT NULL DEFAULT 1,
+    request_id VARCHAR(64),
+    occurred_at TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
 -- Enable Row Level Security (RLS) on all tables
 ALTER TABLE public.user_profiles ENABLE ROW LEVEL SECURITY;
 ALTER TABLE public.user_subscriptions ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.usage_events ENABLE ROW LEVEL SECURITY;
 
 -- User profiles: users can only access their own profile
 CREATE POLICY "Users can view own profile" ON public.user_profiles
@@ -57,6 +69,10 @@ CREATE POLICY "Users can insert own profile" ON public.user_profiles
 CREATE POLICY "Users can view own subscriptions" ON public.user_subscriptions
     FOR SELECT USING (auth.uid() = user_id);
 
+-- Usage: users can only view their own usage
+CREATE POLICY "Users can view own usage" ON public.usage_events
+    FOR SELECT USING (auth.uid() = user_id);
+
 -- Insert default subscription plans
 INSERT INTO public.subscription_plans (name, description, price, duration_days) VALUES
 ('Basic', 'Access to dictionary and basic features', 0.00, 30),
@@ -66,6 +82,68 @@ INSERT INTO public.subscription_plans (name, description, price, duration_days)
 -- Create indexes for better performance
 CREATE INDEX idx_user_subscriptions_user_id ON public.user_subscriptions(user_id);
 CREATE INDEX idx_user_subscriptions_status ON public.user_subscriptions(status);
+CREATE INDEX idx_usage_events_user_occurred ON public.usage_events(user_id, occurred_at);
+
+-- Resolve a user's profile and active subscription in one round trip.
+-- Creates the profile on first login; ON CONFLICT (id) makes concurrent
+-- first requests safe. A username already taken by another account gets
+-- a suffix from the user id. The subscription is looked up on its own, so
+-- it is still returned if the profile could not be created (e.g. its email
+-- belongs to another profile). Called by the backend with the service role.
+CREATE OR REPLACE FUNCTION public.resolve_user_identity(
+    p_user_id UUID,
+    p_email TEXT,
+    p_username TEXT
+)
+RETURNS JSON
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+    BEGIN
+        INSERT INTO public.user_profiles (id, username, email, is_active)
+        VALUES (p_user_id, p_username, p_email, TRUE)
+        ON CONFLICT (id) DO NOTHING;
+    EXCEPTION WHEN unique_violation THEN
+        BEGIN
+            INSERT INTO public.user_profiles (id, username, email, is_active)
+            VALUES (
+                p_user_id,
+                left(p_username, 41) || '_' || left(replace(p_user_id::text, '-', ''), 8),
+                p_email,
+                TRUE
+            )
+            ON CONFLICT (id) DO NOTHING;
+        EXCEPTION WHEN unique_violation THEN
+            RAISE WARNING 'resolve_user_identity: no profile for %, email already in use', p_user_id;
+        END;
+    END;
+
+    RETURN json_build_object(
+        'username', (
+            SELECT p.username FROM public.user_profiles p WHERE p.id = p_user_id
+        ),
+        'subscription', (
+            SELECT json_build_object(
+                'id', s.id,
+                'plan', sp.name,
+                'status', s.status,
+                'end_date', s.end_date
+            )
+            FROM public.user_subscriptions s
+            JOIN public.subscription_plans sp ON sp.id = s.plan_id
+            WHERE s.user_id = p_user_id AND s.status = 'active'
+            ORDER BY s.end_date DESC
+            LIMIT 1
+        )
+    );
+END;
+$$;
+
+-- SECURITY DEFINER bypasses RLS, so only the backend's service role may call it
+REVOKE EXECUTE ON FUNCTION public.resolve_user_identity(UUID, TEXT, TEXT) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.resolve_user_identity(UUID, TEXT, TEXT) TO service_role;
 
 -- Verify creation
 SELECT 'Lean schema created successfully!' as status;
\ No newline at end of file